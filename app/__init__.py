@@ -9,12 +9,36 @@ from flask_sqlalchemy import SQLAlchemy
 
 from config import config
 
+from .database import (
+    ReplicaRouting,
+    RoutingSession,
+    engine_options,
+    set_sqlite_pragmas,
+)
+from .fragments import FragmentCache
+from .hashing import HashingService
+from .instrumentation import QueryInstrumentation
+from .last_seen import LastSeenBuffer
+from .metrics import Metrics
+from .page_cache import PageCache
+from .profiling import SamplingProfiler
+from .rendering import RenderingEngine
+
 bootstrap = Bootstrap5()
 fa = FontAwesome()
 mail = Mail()
 moment = Moment()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 pagedown = PageDown()
+metrics = Metrics()
+profiler = SamplingProfiler()
+instrumentation = QueryInstrumentation()
+last_seen = LastSeenBuffer()
+renderer = RenderingEngine()
+fragment_cache = FragmentCache()
+page_cache = PageCache()
+hashing = HashingService()
+replica_routing = ReplicaRouting()
 
 login_manager = LoginManager()
 login_manager.login_view = "auth.login"
@@ -30,7 +54,19 @@ def create_app(config_name):
     fa.init_app(app)
     mail.init_app(app)
     moment.init_app(app)
+    # first, so that its timings include the other extensions' hooks
+    metrics.init_app(app)
+    profiler.init_app(app)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
     db.init_app(app)
+    replica_routing.init_app(app)
+    set_sqlite_pragmas(app, db)
+    instrumentation.init_app(app, db)
+    last_seen.init_app(app)
+    renderer.init_app(app)
+    fragment_cache.init_app(app)
+    page_cache.init_app(app)
+    hashing.init_app(app)
     pagedown.init_app(app)
     login_manager.init_app(app)
 
@@ -2,4 +2,4 @@ from flask import Blueprint
 
 api = Blueprint("api", __name__)
 
-from . import authentication, comments, errors, posts, users
+from . import authentication, caching, comments, errors, posts, users
@@ -1,13 +1,51 @@
-from flask import g, jsonify
+import hashlib
+import hmac
+
+from flask import current_app, g, jsonify
 from flask_httpauth import HTTPBasicAuth
 
-from ..models import User
+from ..cache import LRUBackend
+from ..models import Permission, User
 from . import api
+from .decorators import permission_required
 from .errors import forbidden, unauthorized
 
 auth = HTTPBasicAuth()
 
 
+def verified_credentials():
+    """Cache of recently verified Basic auth credentials of this worker."""
+    cache = current_app.extensions.get("verified_credentials")
+    if cache is None:
+        cache = current_app.extensions["verified_credentials"] = LRUBackend(
+            maxsize=current_app.config["BASIC_AUTH_CACHE_SIZE"],
+            ttl=current_app.config["BASIC_AUTH_CACHE_TTL"],
+        )
+    return cache
+
+
+def check_password(user, password):
+    """``user.verify_password(password)``, skipping the hash when cached.
+
+    Successful verifications are cached under an HMAC of the email, the
+    password hash and the password, so no password is kept in memory and a
+    password change makes the old entries unreachable.
+    """
+    message = "\0".join([user.email, user.password_hash or "", password])
+    key = hmac.new(
+        current_app.config["SECRET_KEY"].encode("utf-8"),
+        message.encode("utf-8"),
+        hashlib.sha256,
+    ).hexdigest()
+    cache = verified_credentials()
+    if cache.get(key):
+        return True
+    if not user.verify_password(password):
+        return False
+    cache.set(key, True)
+    return True
+
+
 @auth.verify_password
 def verify_password(email_or_token, password):
     if email_or_token == "":
@@ -21,7 +59,7 @@ def verify_password(email_or_token, password):
         return False
     g.current_user = user
     g.token_used = False
-    return user.verify_password(password)
+    return check_password(user, password)
 
 
 @auth.error_handler
@@ -46,3 +84,17 @@ def get_token():
             "expiration": 3600,
         }
     )
+
+
+@api.route("/stats/basic-auth-cache")
+@permission_required(Permission.ADMIN)
+def get_basic_auth_cache_stats():
+    cache = verified_credentials()
+    return jsonify(
+        {
+            "hits": cache.hits,
+            "misses": cache.misses,
+            "size": len(cache),
+            "maxsize": cache.maxsize,
+        }
+    )
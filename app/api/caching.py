@@ -0,0 +1,48 @@
+import hashlib
+from functools import wraps
+
+from flask import abort, make_response, request
+
+from . import api
+
+
+def etag_from(version):
+    """Answer conditional GETs of a resource before its view runs.
+
+    ``version`` is called with the view arguments and returns a value that
+    changes whenever the representation does, or None if the resource does
+    not exist. A client that already holds the current representation gets
+    a 304 for the price of that lookup.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            value = version(**kwargs)
+            if value is None:
+                abort(404)
+            etag = f"{request.endpoint}-{kwargs.get('id')}-{value}"
+            if request.if_none_match.contains(etag):
+                response = make_response("", 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+            response.set_etag(etag)
+            return response
+
+        return decorated_function
+
+    return decorator
+
+
+@api.after_request
+def add_etag(response):
+    if request.method != "GET" or response.status_code != 200:
+        return response
+    if "ETag" not in response.headers:
+        # collections and resources without a version: hash the payload,
+        # which saves the transfer but not the work of building it
+        response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+    # responses depend on the credentials; clients revalidate every time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
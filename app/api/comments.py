@@ -2,13 +2,31 @@ from flask import current_app, g, jsonify, request, url_for
 
 from .. import db
 from ..models import Comment, Permission, Post
+from ..pagination import keyset_paginate
 from . import api
 from .decorators import permission_required
 
 
 @api.route("/comments/")
 def get_comments():
-    page = request.args.get("page", 1, type=int)
+    page = request.args.get("page", type=int)
+    if page is None:
+        pagination = keyset_paginate(
+            Comment.query,
+            (Comment.timestamp, Comment.id),
+            cursor=request.args.get("cursor"),
+            per_page=current_app.config["COMMENTS_PER_PAGE"],
+            error_out=False,
+        )
+        return jsonify(
+            {
+                "comments": [
+                    comment.to_json() for comment in pagination.items
+                ],
+                "prev": pagination.prev_url("api.get_comments"),
+                "next": pagination.next_url("api.get_comments"),
+            }
+        )
     pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
         page=page,
         per_page=current_app.config["COMMENTS_PER_PAGE"],
@@ -40,7 +58,25 @@ def get_comment(id):
 @api.route("/posts/<int:id>/comments/")
 def get_post_comments(id):
     post = Post.query.get_or_404(id)
-    page = request.args.get("page", 1, type=int)
+    page = request.args.get("page", type=int)
+    if page is None:
+        pagination = keyset_paginate(
+            post.comments,
+            (Comment.timestamp, Comment.id),
+            cursor=request.args.get("cursor"),
+            per_page=current_app.config["COMMENTS_PER_PAGE"],
+            descending=False,
+            error_out=False,
+        )
+        return jsonify(
+            {
+                "comments": [
+                    comment.to_json() for comment in pagination.items
+                ],
+                "prev": pagination.prev_url("api.get_post_comments", id=id),
+                "next": pagination.next_url("api.get_post_comments", id=id),
+            }
+        )
     pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
         page=page,
         per_page=current_app.config["COMMENTS_PER_PAGE"],
@@ -68,7 +104,7 @@ def get_post_comments(id):
 def new_post_comment(id):
     post = Post.query.get_or_404(id)
     comment = Comment.from_json(request.json)
-    comment.author = g.current_user
+    comment.author_id = g.current_user.id
     comment.post = post
     db.session.add(comment)
     db.session.commit()
@@ -2,14 +2,31 @@ from flask import current_app, g, jsonify, request, url_for
 
 from .. import db
 from ..models import Permission, Post
+from ..pagination import keyset_paginate
 from . import api
+from .caching import etag_from
 from .decorators import permission_required
 from .errors import forbidden
 
 
 @api.route("/posts/")
 def get_posts():
-    page = request.args.get("page", 1, type=int)
+    page = request.args.get("page", type=int)
+    if page is None:
+        pagination = keyset_paginate(
+            Post.query,
+            (Post.timestamp, Post.id),
+            cursor=request.args.get("cursor"),
+            per_page=current_app.config["POSTS_PER_PAGE"],
+            error_out=False,
+        )
+        return jsonify(
+            {
+                "posts": [post.to_json() for post in pagination.items],
+                "prev": pagination.prev_url("api.get_posts"),
+                "next": pagination.next_url("api.get_posts"),
+            }
+        )
     pagination = Post.query.paginate(
         page=page,
         per_page=current_app.config["POSTS_PER_PAGE"],
@@ -33,6 +50,7 @@ def get_posts():
 
 
 @api.route("/posts/<int:id>")
+@etag_from(Post.current_version)
 def get_post(id):
     post = Post.query.get_or_404(id)
     return jsonify(post.to_json())
@@ -42,7 +60,7 @@ def get_post(id):
 @permission_required(Permission.WRITE)
 def new_post():
     post = Post.from_json(request.json)
-    post.author = g.current_user
+    post.author_id = g.current_user.id
     db.session.add(post)
     db.session.commit()
     return (
@@ -56,7 +74,7 @@ def new_post():
 @permission_required(Permission.WRITE)
 def edit_post(id):
     post = Post.query.get_or_404(id)
-    if g.current_user != post.author and not g.current_user.can(
+    if g.current_user.id != post.author_id and not g.current_user.can(
         Permission.ADMIN
     ):
         return forbidden("Insufficient permissions")
@@ -1,6 +1,7 @@
 from flask import current_app, jsonify, request, url_for
 
-from ..models import Post, User
+from ..models import Post, Timeline, User
+from ..pagination import keyset_paginate
 from . import api
 
 
@@ -13,7 +14,22 @@ def get_user(id):
 @api.route("/users/<int:id>/posts/")
 def get_user_posts(id):
     user = User.query.get_or_404(id)
-    page = request.args.get("page", 1, type=int)
+    page = request.args.get("page", type=int)
+    if page is None:
+        pagination = keyset_paginate(
+            user.posts,
+            (Post.timestamp, Post.id),
+            cursor=request.args.get("cursor"),
+            per_page=current_app.config["POSTS_PER_PAGE"],
+            error_out=False,
+        )
+        return jsonify(
+            {
+                "posts": [post.to_json() for post in pagination.items],
+                "prev": pagination.prev_url("api.get_user_posts", id=id),
+                "next": pagination.next_url("api.get_user_posts", id=id),
+            }
+        )
     pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
         page=page,
         per_page=current_app.config["POSTS_PER_PAGE"],
@@ -39,8 +55,30 @@ def get_user_posts(id):
 @api.route("/users/<int:id>/timeline/")
 def get_user_followed_posts(id):
     user = User.query.get_or_404(id)
-    page = request.args.get("page", 1, type=int)
-    pagination = user.followed_posts.order_by(Post.timestamp.desc()).paginate(
+    page = request.args.get("page", type=int)
+    if page is None:
+        pagination = keyset_paginate(
+            user.followed_posts,
+            (Timeline.timestamp, Timeline.post_id),
+            cursor=request.args.get("cursor"),
+            per_page=current_app.config["POSTS_PER_PAGE"],
+            key=lambda post: (post.timestamp, post.id),
+            error_out=False,
+        )
+        return jsonify(
+            {
+                "posts": [post.to_json() for post in pagination.items],
+                "prev": pagination.prev_url(
+                    "api.get_user_followed_posts", id=id
+                ),
+                "next": pagination.next_url(
+                    "api.get_user_followed_posts", id=id
+                ),
+            }
+        )
+    pagination = user.followed_posts.order_by(
+        Timeline.timestamp.desc()
+    ).paginate(
         page=page,
         per_page=current_app.config["POSTS_PER_PAGE"],
         error_out=False,
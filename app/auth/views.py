@@ -1,7 +1,8 @@
 from flask import flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required, login_user, logout_user
 
-from .. import db
+from .. import db, last_seen
+from ..database import use_primary
 from ..email import send_email
 from ..models import User
 from . import auth
@@ -18,9 +19,10 @@ from .forms import (
 @auth.before_app_request
 def before_request():
     if current_user.is_authenticated:
-        # for user profile to ping logged-in user 
-        # (initiates saving of last visit date)
-        current_user.ping()
+        # for user profile, remember the last visit date of the logged-in
+        # user (buffered, written in batches)
+        if request.endpoint != "static":
+            last_seen.touch(current_user)
 
         if (
             not current_user.confirmed
@@ -86,6 +88,7 @@ def register():
 
 
 @auth.route("/confirm/<token>")
+@use_primary
 @login_required
 def confirm(token):
     if current_user.confirmed:
@@ -194,6 +197,7 @@ def change_email_request():
 
 
 @auth.route("/change_email/<token>")
+@use_primary
 @login_required
 def change_email(token):
     if current_user.change_email(token):
@@ -0,0 +1,227 @@
+"""Chunked, resumable backfills for data migrations.
+
+A migration that adds a column often has to fill it for every existing
+row. One UPDATE over a big table holds its write lock for the whole run.
+A :class:`Backfill` walks the table in primary key ranges instead. Each
+range gets its own short transaction, followed by an optional pause that
+lets other writers in. After every chunk the last key done is saved in
+the ``backfills`` table (:class:`~app.models.BackfillProgress`), so an
+interrupted backfill carries on where it stopped. A backfill that has
+finished is not run again unless it is restarted.
+
+The update of a chunk is a function ``update(connection, key_range)``. It
+gets the condition that selects the rows of the chunk and returns the
+number of rows it changed. A chunk that fails can be applied again, so
+the update must only change rows that still need it.
+
+From the command line::
+
+    flask backfill self_follows --chunk-size 500 --pause 0.1
+
+From an Alembic revision, in an ``autocommit_block``, which commits what
+the migration did so far. Its connection commits every statement on its
+own, so each chunk runs in a transaction of a new connection of the same
+engine instead. The ``backfills`` table has to exist by then::
+
+    users = sa.table("users", sa.column("id"), sa.column("locale"))
+
+    def set_locale(connection, key_range):
+        return connection.execute(
+            users.update()
+            .where(key_range, users.c.locale.is_(None))
+            .values(locale="en")
+        ).rowcount
+
+    def upgrade():
+        op.add_column("users", sa.Column("locale", sa.String(8)))
+        with op.get_context().autocommit_block():
+            Backfill("users_locale", users.c.id, set_locale).run(
+                op.get_bind()
+            )
+"""
+
+import contextlib
+import time
+from datetime import datetime
+
+from . import db
+from .models import BackfillProgress, User
+
+CHUNK_SIZE = 1000
+PAUSE = 0.0
+
+BACKFILLS = {}
+
+
+class Backfill:
+    """An UPDATE applied to a table in primary key ranges.
+
+    :param name: the key of its progress in the ``backfills`` table.
+    :param key: the integer primary key column to walk.
+    :param update: ``update(connection, key_range)``, returning the number
+        of rows changed.
+    """
+
+    def __init__(self, name, key, update, chunk_size=CHUNK_SIZE, pause=PAUSE):
+        self.name = name
+        self.key = key
+        self.update = update
+        self.chunk_size = chunk_size
+        self.pause = pause
+
+    def __repr__(self):
+        return f"<Backfill {self.name}>"
+
+    def progress(self, connection=None):
+        """The saved progress row as a mapping, or None if never run."""
+        progress = BackfillProgress.__table__
+        return (
+            (connection or db.session)
+            .execute(db.select(progress).where(progress.c.name == self.name))
+            .mappings()
+            .first()
+        )
+
+    def next_key(self, connection, last_id, chunk_size):
+        """The last key of the chunk after ``last_id``, or None at the end.
+
+        Seeks the index past ``last_id`` rather than counting from the
+        start, so every chunk costs the same.
+        """
+        after = [] if last_id is None else [self.key > last_id]
+        key = connection.execute(
+            db.select(self.key)
+            .where(*after)
+            .order_by(self.key)
+            .offset(chunk_size - 1)
+            .limit(1)
+        ).scalar()
+        if key is None:
+            key = connection.execute(
+                db.select(db.func.max(self.key)).where(*after)
+            ).scalar()
+        return key
+
+    def run(
+        self,
+        connection=None,
+        chunk_size=None,
+        pause=None,
+        restart=False,
+        log=None,
+    ):
+        """Apply the update to the rows after the saved progress.
+
+        :param connection: the connection to run on, e.g. ``op.get_bind()``
+            in a revision; by default the session's, committed per chunk.
+        :param restart: walk the whole table again, even if finished.
+        :param log: called with a line of progress after each chunk.
+        Returns the number of rows changed by this run.
+        """
+        chunk_size = chunk_size or self.chunk_size
+        pause = self.pause if pause is None else pause
+        progress = BackfillProgress.__table__
+        now = datetime.utcnow()
+        with _transaction(connection) as conn:
+            saved = self.progress(conn)
+            if saved is None:
+                conn.execute(
+                    progress.insert().values(
+                        name=self.name, rows=0, started_at=now
+                    )
+                )
+            elif restart:
+                conn.execute(
+                    progress.update()
+                    .where(progress.c.name == self.name)
+                    .values(
+                        last_id=None,
+                        rows=0,
+                        started_at=now,
+                        finished_at=None,
+                    )
+                )
+            elif saved.finished_at is not None:
+                return 0
+        last_id = None if saved is None or restart else saved.last_id
+
+        total = 0
+        started = time.perf_counter()
+        while True:
+            with _transaction(connection) as conn:
+                high = self.next_key(conn, last_id, chunk_size)
+                if high is None:
+                    conn.execute(
+                        progress.update()
+                        .where(progress.c.name == self.name)
+                        .values(finished_at=datetime.utcnow())
+                    )
+                    break
+                key_range = self.key <= high
+                if last_id is not None:
+                    key_range = db.and_(self.key > last_id, key_range)
+                rows = self.update(conn, key_range)
+                conn.execute(
+                    progress.update()
+                    .where(progress.c.name == self.name)
+                    .values(
+                        last_id=high,
+                        rows=progress.c.rows + rows,
+                        updated_at=datetime.utcnow(),
+                    )
+                )
+            last_id = high
+            total += rows
+            if log is not None:
+                elapsed = time.perf_counter() - started
+                log(
+                    f"{self.name}: {total} rows up to id {last_id}, "
+                    f"{total / elapsed:.0f} rows/s"
+                )
+            if pause:
+                time.sleep(pause)
+        if log is not None:
+            log(f"{self.name}: done, {total} rows.")
+        return total
+
+
+@contextlib.contextmanager
+def _transaction(connection):
+    if connection is None:
+        try:
+            yield db.session.connection()
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            raise
+    elif (
+        connection.get_execution_options().get("isolation_level")
+        == "AUTOCOMMIT"
+    ):
+        # a chunk of several statements must not be half applied
+        with connection.engine.begin() as chunk_connection:
+            yield chunk_connection
+    elif connection.in_transaction():
+        # committed with the caller's transaction
+        yield connection
+    else:
+        with connection.begin():
+            yield connection
+
+
+def register(backfill):
+    """Make ``backfill`` runnable with ``flask backfill``."""
+    BACKFILLS[backfill.name] = backfill
+    return backfill
+
+
+SELF_FOLLOWS = register(
+    Backfill("self_follows", User.__table__.c.id, User.backfill_self_follows)
+)
+DEFAULT_GRAVATAR = register(
+    Backfill(
+        "default_gravatar",
+        User.__table__.c.id,
+        User.backfill_default_gravatar,
+    )
+)
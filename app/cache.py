@@ -0,0 +1,181 @@
+"""Small key/value cache backends.
+
+- ``LRUBackend`` keeps entries in the memory of one worker process.
+- ``FileSystemBackend`` keeps them in a local directory, so every gunicorn
+  worker on the machine shares the same entries.
+- ``NullBackend`` caches nothing.
+
+Values are strings. All backends count hits and misses.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class NullBackend:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        self.misses += 1
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUBackend(NullBackend):
+    """A thread-safe, bounded mapping that evicts the least recently used.
+
+    :param maxsize: maximum number of entries.
+    :param ttl: default lifetime of entries in seconds, or None for no
+    expiry.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value, expires = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires is not None and expires < time.monotonic():
+                del self.data[key]
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        ttl = ttl if ttl is not None else self.ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self.lock:
+            self.data[key] = (value, expires)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+class FileSystemBackend(NullBackend):
+    """Entries stored as files in ``directory``, shared between processes.
+
+    Each file starts with the expiry time of the entry on its own line.
+    Files are written to a temporary name and renamed into place, so a
+    reader never sees a partial entry. Expired entries are pruned every
+    ``prune_every`` writes.
+    """
+
+    def __init__(self, directory, ttl=None, prune_every=1000):
+        super().__init__()
+        self.directory = directory
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self.writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name[:2], name)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                expires = float(f.readline())
+                if expires and expires < time.time():
+                    raise FileNotFoundError
+                value = f.read()
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires = 0 if ttl is None else time.time() + ttl
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(f"{expires}\n")
+                f.write(value)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        self.writes += 1
+        if self.prune_every and self.writes % self.prune_every == 0:
+            self.prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def prune(self):
+        """Remove expired entries."""
+        now = time.time()
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        expires = float(f.readline())
+                    if expires and expires < now:
+                        os.remove(path)
+                except (OSError, ValueError):
+                    pass
+
+    def clear(self):
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                try:
+                    os.remove(os.path.join(root, name))
+                except OSError:
+                    pass
+
+
+def make_backend(name, size=1024, directory=None, ttl=None):
+    """Build a backend from configuration values."""
+    if name == "lru":
+        return LRUBackend(maxsize=size, ttl=ttl)
+    if name == "filesystem":
+        if not directory:
+            raise ValueError("the filesystem cache needs a directory")
+        return FileSystemBackend(directory, ttl=ttl)
+    if name == "null":
+        return NullBackend()
+    raise ValueError(f"unknown cache backend {name!r}")
@@ -0,0 +1,146 @@
+"""Database engine setup per configuration.
+
+SQLite is tuned through ``PRAGMA`` statements run on every new connection
+(``SQLITE_PRAGMAS``), chiefly WAL journaling so that readers do not block
+the writer under several gunicorn workers. Other backends get their
+connection pool sized through ``DB_POOL_*`` settings.
+
+Reads can be spread over read replicas (``READ_REPLICA_URIS``), see
+:class:`RoutingSession`.
+"""
+
+import random
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql import Select
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def engine_options(config):
+    """``SQLALCHEMY_ENGINE_OPTIONS`` completed with the pool settings."""
+    options = dict(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() == "sqlite":
+        return options
+    for option, key in [
+        ("pool_size", "DB_POOL_SIZE"),
+        ("max_overflow", "DB_MAX_OVERFLOW"),
+        ("pool_recycle", "DB_POOL_RECYCLE"),
+        ("pool_pre_ping", "DB_POOL_PRE_PING"),
+    ]:
+        if config.get(key) is not None:
+            options.setdefault(option, config[key])
+    return options
+
+
+def set_sqlite_pragmas(app, db):
+    """Run ``SQLITE_PRAGMAS`` on every new connection of SQLite engines."""
+    pragmas = app.config["SQLITE_PRAGMAS"]
+    if not pragmas:
+        return
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    for engine in all_engines(app, db):
+        if engine.dialect.name == "sqlite":
+            event.listen(engine, "connect", on_connect)
+
+
+def all_engines(app, db):
+    """The engines of the application's binds and of its read replicas."""
+    with app.app_context():
+        engines = list(db.engines.values())
+    return engines + list(app.extensions.get("read_replicas", {}).values())
+
+
+class RoutingSession(Session):
+    """Send the reads of read-only requests to a read replica.
+
+    Statements go to the primary database unless all of these hold: the
+    request is a GET (or HEAD, OPTIONS), it has not written anything yet,
+    the statement is a SELECT outside of a flush, and the previous request
+    of the same browser session did not write (read-your-writes), and the
+    view is not marked with :func:`use_primary`. Models with their own bind
+    key keep using it.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        primary = super().get_bind(
+            mapper=mapper, clause=clause, bind=bind, **kwargs
+        )
+        if bind is not None or not has_request_context():
+            return primary
+        replicas = current_app.extensions["read_replicas"]
+        if not replicas or primary is not self._db.engines.get(None):
+            return primary
+        if self._flushing or not isinstance(clause, (Select, type(None))):
+            g.db_wrote = True
+        if (
+            request.method not in READ_METHODS
+            or g.get("db_wrote")
+            or g.get("read_primary")
+            or clause is None
+        ):
+            g.setdefault("db_binds", set()).add("primary")
+            return primary
+        name = random.choice(list(replicas))
+        g.setdefault("db_binds", set()).add(name)
+        return replicas[name]
+
+
+def use_primary(f):
+    """Read from the primary in the decorated view, even on a GET.
+
+    For GET views that write: the checks they make before writing must not
+    see a replica that lags behind, e.g. a follow that is already there.
+    """
+    f.read_primary = True
+    return f
+
+
+class ReplicaRouting:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # not SQLALCHEMY_BINDS: Flask-SQLAlchemy would give each bind its
+        # own metadata, shared by every application of the process
+        app.extensions["read_replicas"] = {
+            f"replica_{n}": create_engine(
+                uri, **app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+            )
+            for n, uri in enumerate(app.config["READ_REPLICA_URIS"])
+        }
+        if app.extensions["read_replicas"]:
+            app.before_request(self.before_request)
+            app.after_request(self.after_request)
+
+    @staticmethod
+    def before_request():
+        # g outlives the request when an app context was already pushed
+        g.db_wrote = False
+        g.db_binds = set()
+        # only touch the session when the flag is set, so that it is not
+        # rewritten (and the page not kept out of the page cache) for nothing
+        view = current_app.view_functions.get(request.endpoint)
+        g.read_primary = getattr(view, "read_primary", False)
+        if "_read_primary" in session:
+            g.read_primary = True
+            del session["_read_primary"]
+
+    @staticmethod
+    def after_request(response):
+        # the next request must see this one's writes, which may not have
+        # reached the replicas yet
+        if g.get("db_wrote") or request.method not in READ_METHODS:
+            session["_read_primary"] = True
+        return response
@@ -0,0 +1,122 @@
+"""Deployment tasks of ``flask deploy``, run under a database-wide lock.
+
+Every container runs ``flask deploy`` when it starts. The tasks are
+idempotent, set-based statements, and :func:`deploy_lock` makes
+containers that start together take turns: the first one migrates and
+backfills while the others wait, then find nothing left to do.
+
+The lock is taken where the database is: an advisory lock on PostgreSQL,
+a named lock on MySQL, and an exclusive ``flock`` on a file next to the
+database file on SQLite.
+"""
+
+import contextlib
+import time
+import zlib
+
+from sqlalchemy import text
+
+from . import db
+from .exceptions import DeployLockTimeout
+
+LOCK_NAME = "webuzz-deploy"
+
+
+def _wait(acquire, timeout, poll_interval):
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while not acquire():
+        if deadline is not None and time.monotonic() >= deadline:
+            raise DeployLockTimeout(
+                f"another deploy still holds the lock after {timeout}s"
+            )
+        time.sleep(poll_interval)
+
+
+@contextlib.contextmanager
+def _file_lock(path, timeout, poll_interval):
+    import fcntl
+
+    def acquire():
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    with open(path, "a") as f:
+        _wait(acquire, timeout, poll_interval)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def _connection_lock(engine, acquire, release, timeout, poll_interval):
+    # the lock belongs to the database session of this connection, which is
+    # held until the tasks are done
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        _wait(
+            lambda: bool(connection.execute(acquire).scalar()),
+            timeout,
+            poll_interval,
+        )
+        try:
+            yield
+        finally:
+            connection.execute(release)
+
+
+@contextlib.contextmanager
+def deploy_lock(engine=None, timeout=None, poll_interval=1.0):
+    """Hold the deploy lock of the database of ``engine``.
+
+    :param timeout: seconds to wait for another deploy to release the lock
+        before raising :class:`~app.exceptions.DeployLockTimeout`, or None
+        to wait forever.
+    """
+    engine = engine or db.engine
+    dialect = engine.dialect.name
+    database = engine.url.database or ":memory:"
+    if dialect == "postgresql":
+        key = zlib.crc32(LOCK_NAME.encode())
+        lock = _connection_lock(
+            engine,
+            text("SELECT pg_try_advisory_lock(:key)").bindparams(key=key),
+            text("SELECT pg_advisory_unlock(:key)").bindparams(key=key),
+            timeout,
+            poll_interval,
+        )
+    elif dialect == "mysql":
+        lock = _connection_lock(
+            engine,
+            text("SELECT GET_LOCK(:name, 0)").bindparams(name=LOCK_NAME),
+            text("SELECT RELEASE_LOCK(:name)").bindparams(name=LOCK_NAME),
+            timeout,
+            poll_interval,
+        )
+    elif dialect == "sqlite" and database != ":memory:":
+        lock = _file_lock(database + ".deploy-lock", timeout, poll_interval)
+    else:
+        # an in-memory database is private to this process
+        lock = contextlib.nullcontext()
+    with lock:
+        yield
+
+
+def run_tasks(tasks, log=None):
+    """Run ``(name, task)`` pairs in order and time them.
+
+    ``log(name, rows, seconds)`` is called after each task with the value
+    it returned, the number of rows it changed or None. Returns a
+    dictionary mapping each name to its duration in seconds.
+    """
+    timings = {}
+    for name, task in tasks:
+        start = time.perf_counter()
+        rows = task()
+        timings[name] = time.perf_counter() - start
+        if log is not None:
+            log(name, rows, timings[name])
+    return timings
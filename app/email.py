@@ -1,44 +1,234 @@
-from threading import Thread
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
 from flask import current_app, render_template
 from flask_mail import Message
 
-from . import mail
-
-
-def send_async_email(app, msg):
-    """Send email in a new thread.
-
-    Flask-Mail’s send() function uses current_app, so it requires the
-    application context to be active. But since contexts are associated with a
-    thread, when the mail.send() function executes in a different thread it
-    needs the application context to be created artificially using
-    app.app_context(). The app instance is passed to the thread as an argument
-    so that a context can be created.
-    """
-    with app.app_context():
-        mail.send(msg)
+from . import db, mail
+from .models import Outbox
 
 
 def send_email(to, subject, template, **kwargs):
-    """Send an email using a HTML template (and a plain text alternative).
+    """Queue an email using a HTML template (and a plain text alternative).
 
     :param **kwargs: These arguments will be resent to templates to be used
     there, e.g. user=user.
 
-    To avoid unnecessary delays during request handling, the email send
-    function can be moved to a background thread.
+    The message is stored in the outbox table and delivered by the mail
+    worker, so a request never waits for SMTP and queued mail survives a
+    restart. Unless MAIL_WORKER_INLINE is disabled (when a separate
+    `flask mail-worker` process runs), the worker pool of this process is
+    woken up to deliver it right away.
     """
     app = current_app._get_current_object()
 
-    msg = Message(
-        f"{app.config['MAIL_SUBJECT_PREFIX']} {subject}",
+    msg = Outbox(
+        subject=f"{app.config['MAIL_SUBJECT_PREFIX']} {subject}",
         sender=app.config["MAIL_SENDER"],
-        recipients=[to],
+        recipients=to,
+        body=render_template(template + ".txt", **kwargs),
+        html=render_template(template + ".html", **kwargs),
     )
-    msg.body = render_template(template + ".txt", **kwargs)
-    msg.html = render_template(template + ".html", **kwargs)
+    db.session.add(msg)
+    db.session.commit()
+
+    if app.config["MAIL_WORKER_INLINE"]:
+        inline_worker.wake(app)
+    return msg
+
+
+def claim_pending(limit):
+    """Claim up to ``limit`` due messages for delivery by this worker.
+
+    A message is claimed with a conditional UPDATE that only succeeds if no
+    other worker got to it first, so any number of workers can share the
+    outbox.
+    """
+    now = datetime.utcnow()
+    lease = now + timedelta(seconds=current_app.config["MAIL_CLAIM_TIMEOUT"])
+    ids = db.session.scalars(
+        db.select(Outbox.id)
+        .where(
+            Outbox.sent_at.is_(None),
+            Outbox.next_attempt_at <= now,
+            Outbox.attempts < current_app.config["MAIL_MAX_ATTEMPTS"],
+        )
+        .order_by(Outbox.next_attempt_at)
+        .limit(limit)
+    ).all()
+    claimed = []
+    for id in ids:
+        result = db.session.execute(
+            Outbox.__table__.update()
+            .where(
+                Outbox.id == id,
+                Outbox.sent_at.is_(None),
+                Outbox.next_attempt_at <= now,
+            )
+            .values(next_attempt_at=lease, attempts=Outbox.attempts + 1)
+        )
+        if result.rowcount == 1:
+            claimed.append(id)
+    db.session.commit()
+    if not claimed:
+        return []
+    return Outbox.query.filter(Outbox.id.in_(claimed)).all()
+
+
+def retry_delay(attempts):
+    """Exponential backoff: MAIL_RETRY_BACKOFF, then twice that, and so on."""
+    return current_app.config["MAIL_RETRY_BACKOFF"] * 2 ** (attempts - 1)
+
+
+class OutboxWorker:
+    """Deliver queued messages, reusing one SMTP connection across them."""
+
+    def __init__(self, app):
+        self.app = app
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            connection = mail.connect()
+            connection.__enter__()
+            self.connection = connection
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.__exit__(None, None, None)
+            except Exception:
+                pass
+            self.connection = None
+
+    def deliver_pending(self):
+        """Try to deliver one batch of due messages.
+
+        Returns how many messages were attempted, successful or not.
+        """
+        attempted = 0
+        with self.app.app_context():
+            for msg in claim_pending(self.app.config["MAIL_BATCH_SIZE"]):
+                attempted += 1
+                try:
+                    self.connect().send(
+                        Message(
+                            msg.subject,
+                            sender=msg.sender,
+                            recipients=msg.recipients.split(","),
+                            body=msg.body,
+                            html=msg.html,
+                        )
+                    )
+                except Exception as e:
+                    # the connection may be broken, start afresh next time
+                    self.close()
+                    msg.last_error = repr(e)
+                    msg.next_attempt_at = datetime.utcnow() + timedelta(
+                        seconds=retry_delay(msg.attempts)
+                    )
+                    self.app.logger.warning(
+                        "Sending email %d failed (attempt %d): %r",
+                        msg.id,
+                        msg.attempts,
+                        e,
+                    )
+                else:
+                    msg.sent_at = datetime.utcnow()
+                    msg.last_error = None
+                db.session.commit()
+            db.session.remove()
+        return attempted
+
+    def run(self, stop, poll_interval):
+        """Deliver messages until the ``stop`` event is set."""
+        try:
+            while not stop.is_set():
+                if not self.deliver_pending():
+                    # keep the connection only while there is work to do
+                    self.close()
+                    stop.wait(poll_interval)
+        finally:
+            self.close()
+
+
+def run_mail_worker(app, workers=None, poll_interval=None, once=False):
+    """Run a pool of outbox workers in this process.
+
+    Used by the `flask mail-worker` command. Each worker thread keeps its
+    own SMTP connection open while the outbox has work for it.
+    """
+    workers = workers or app.config["MAIL_WORKERS"]
+    poll_interval = poll_interval or app.config["MAIL_POLL_INTERVAL"]
+    if once:
+        return OutboxWorker(app).deliver_pending()
+    stop = threading.Event()
+    threads = [
+        threading.Thread(
+            target=OutboxWorker(app).run,
+            args=(stop, poll_interval),
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+class InlineMailWorker:
+    """Bounded pool that drains the outbox from within the web process.
+
+    Waking it while all its workers are busy does not queue more work, it
+    just makes a running worker look at the outbox once more before it
+    stops, so a burst of messages never starts more than MAIL_WORKERS
+    threads or SMTP connections.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.running = 0
+        self.rerun = False
+
+    def wake(self, app):
+        with self.lock:
+            if self.running >= app.config["MAIL_WORKERS"]:
+                self.rerun = True
+                return
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=app.config["MAIL_WORKERS"],
+                    thread_name_prefix="mail",
+                )
+            self.running += 1
+        self.executor.submit(self.drain, app)
+
+    def drain(self, app):
+        worker = OutboxWorker(app)
+        try:
+            while True:
+                try:
+                    while worker.deliver_pending():
+                        pass
+                except Exception:
+                    app.logger.exception("Mail worker failed")
+                with self.lock:
+                    if not self.rerun:
+                        self.running -= 1
+                        return
+                    self.rerun = False
+        finally:
+            worker.close()
+
 
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+inline_worker = InlineMailWorker()
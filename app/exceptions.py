@@ -1,2 +1,14 @@
 class ValidationError(ValueError):
     pass
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+class HashingServiceBusy(RuntimeError):
+    pass
+
+
+class DeployLockTimeout(RuntimeError):
+    pass
@@ -0,0 +1,111 @@
+"""Query plans of the hot queries of the application.
+
+``flask explain`` prints the plan chosen by the database for each query
+below, built the way the views and the API build it. On SQLite, a plan
+step that scans a whole table or sorts the rows in a temporary B-tree
+(instead of walking an index) is flagged, since list pages must stay fast
+as tables grow.
+"""
+
+from datetime import datetime
+
+from . import db
+from .models import Comment, Follow, Post, Timeline, User
+
+PER_PAGE = 21
+
+
+def _older_than(timestamp_col, id_col):
+    """The seek condition of a "Load older" page."""
+    now = datetime.utcnow()
+    return db.or_(
+        timestamp_col < now,
+        db.and_(timestamp_col == now, id_col < 1),
+    )
+
+
+def hot_queries():
+    """Map a description to a statement of each hot query."""
+    return {
+        "index: all posts": db.select(Post)
+        .order_by(Post.timestamp.desc(), Post.id.desc())
+        .limit(PER_PAGE),
+        "index: older posts": db.select(Post)
+        .where(_older_than(Post.timestamp, Post.id))
+        .order_by(Post.timestamp.desc(), Post.id.desc())
+        .limit(PER_PAGE),
+        "index: followed posts": db.select(Post)
+        .join(Timeline, Timeline.post_id == Post.id)
+        .where(Timeline.user_id == 1)
+        .order_by(Timeline.timestamp.desc(), Timeline.post_id.desc())
+        .limit(PER_PAGE),
+        "user: posts of a user": db.select(Post)
+        .where(Post.author_id == 1)
+        .order_by(Post.timestamp.desc(), Post.id.desc())
+        .limit(PER_PAGE),
+        "user: older posts of a user": db.select(Post)
+        .where(Post.author_id == 1, _older_than(Post.timestamp, Post.id))
+        .order_by(Post.timestamp.desc(), Post.id.desc())
+        .limit(PER_PAGE),
+        "user: lookup by username": db.select(User).where(
+            User.username == "john"
+        ),
+        "post: comments of a post": db.select(Comment)
+        .where(Comment.post_id == 1)
+        .order_by(Comment.timestamp.asc(), Comment.id.asc())
+        .limit(PER_PAGE),
+        "followers: followers of a user": db.select(Follow)
+        .where(Follow.followed_id == 1)
+        .order_by(Follow.timestamp.desc(), Follow.follower_id.desc())
+        .limit(PER_PAGE),
+        "followed_by: users followed by a user": db.select(Follow)
+        .where(Follow.follower_id == 1)
+        .order_by(Follow.timestamp.desc(), Follow.followed_id.desc())
+        .limit(PER_PAGE),
+        "moderate: all comments": db.select(Comment)
+        .order_by(Comment.timestamp.desc(), Comment.id.desc())
+        .limit(PER_PAGE),
+        "counters: comments of a user": db.select(
+            db.func.count(Comment.id)
+        ).where(Comment.author_id == 1),
+        "timeline: remove a deleted post": Timeline.__table__.delete().where(
+            Timeline.post_id == 1
+        ),
+    }
+
+
+def explain(statement):
+    """Return the lines of the query plan of ``statement``."""
+    connection = db.session.connection()
+    dialect = connection.dialect
+    compiled = statement.compile(dialect=dialect)
+    if dialect.name == "sqlite":
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        rows = connection.exec_driver_sql(
+            "EXPLAIN QUERY PLAN " + str(compiled), params
+        )
+        return [row[-1] for row in rows]
+    rows = connection.exec_driver_sql(
+        "EXPLAIN " + str(compiled), compiled.params
+    )
+    return [" ".join(str(value) for value in row) for row in rows]
+
+
+def is_problem(step):
+    """Whether a SQLite plan step reads a table or sorts without an index."""
+    return (
+        step.startswith("SCAN ") and " USING " not in step
+    ) or "TEMP B-TREE" in step
+
+
+def report(log=print):
+    """Print the plan of every hot query; return the number of problems."""
+    problems = 0
+    for name, statement in hot_queries().items():
+        log(name)
+        for step in explain(statement):
+            flagged = is_problem(step)
+            problems += flagged
+            log(f"  {'!!' if flagged else '  '} {step}")
+    db.session.rollback()
+    return problems
@@ -1,42 +1,314 @@
-from random import choice, randint
+"""Fake users, follows, posts and comments in bulk.
+
+Rows are inserted with Core ``executemany`` in large batches rather than
+one ORM object and commit at a time: usernames and emails are made unique
+up front, every user gets the same password hash (the password is
+"password"), and bodies are drawn from a pool of texts rendered once.
+
+Popularity follows a power law, as on real social sites: a few users are
+followed, and post, far more than the others, and a few posts get most of
+the comments, in threads where the author of the post and a handful of
+users take turns.
+
+The materialized timeline and the denormalized counters are not kept up to
+date by these inserts; :func:`generate` rebuilds and reconciles them at the
+end.
+"""
+
+import hashlib
+import random
+import time
+from datetime import datetime, timedelta
 
 from faker import Faker
-from sqlalchemy.exc import IntegrityError
 
-from . import db
-from .models import Post, User
+from . import db, hashing, renderer
+from .models import Comment, Follow, Post, Role, Timeline, User
+
+# users / follows / posts / comments of the ``flask fake --scale`` presets
+SCALES = {
+    "tiny": dict(users=100, follows=1000, posts=100, comments=200),
+    "small": dict(users=1000, follows=20000, posts=10000, comments=20000),
+    "medium": dict(users=10000, follows=500000, posts=200000, comments=400000),
+    "large": dict(
+        users=100000, follows=5000000, posts=2000000, comments=4000000
+    ),
+}
+
+BATCH_SIZE = 10000
+GRAVATARS = ["identicon", "monsterid", "wavatar", "retro", "robohash"]
+YEAR = timedelta(days=365)
+
+
+def _insert(statement, rows, batch_size):
+    """Execute ``statement`` with the dictionaries of ``rows`` in batches."""
+    batch = []
+    count = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            db.session.execute(statement, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(statement, batch)
+        count += len(batch)
+    db.session.commit()
+    return count
+
+
+def _insert_ignore(table):
+    """An INSERT of ``table`` that skips rows with an existing key."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+
+        return insert(table).on_conflict_do_nothing()
+    if dialect == "mysql":
+        return table.insert().prefix_with("IGNORE")
+    return table.insert().prefix_with("OR IGNORE")
 
 
-def users(count=100):
+def _power_law(population, rnd, alpha=1.0):
+    """Shuffle ``population`` and return cumulative weights for
+    ``rnd.choices``, so that the k-th item is drawn in proportion to
+    ``1 / k ** alpha``."""
+    rnd.shuffle(population)
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, len(population) + 1):
+        total += rank**-alpha
+        cum_weights.append(total)
+    return cum_weights
+
+
+def _random(seed, step):
+    """A generator for ``step``; a given seed gives each step other draws,
+    so that e.g. the most followed users are not also the top posters."""
+    return random.Random(None if seed is None else f"{seed}:{step}")
+
+
+def _next_id(model):
+    return (db.session.scalar(db.select(db.func.max(model.id))) or 0) + 1
+
+
+def _random_time(rnd, start, end):
+    return start + timedelta(
+        seconds=rnd.uniform(0, max((end - start).total_seconds(), 0))
+    )
+
+
+def users(count=100, seed=None, batch_size=BATCH_SIZE):
+    """Insert ``count`` users who joined one to two years ago."""
     fake = Faker()
-    i = 0
-    while i < count:
-        u = User(
-            email=fake.email(),
-            username=fake.user_name(),
-            password="password",
-            confirmed=True,
-            name=fake.name(),
-            location=fake.city(),
-            about_me=fake.text(),
-            member_since=fake.past_date(),
-            default_gravatar=choice(
-                ["identicon", "monsterid", "wavatar", "retro", "robohash"]
-            ),
-        )
-        db.session.add(u)
-        try:
-            db.session.commit()
-            i += 1
-        except IntegrityError:
-            db.session.rollback()
-
-
-def posts(count=100):
+    fake.seed_instance(seed)
+    rnd = _random(seed, "users")
+    now = datetime.utcnow()
+    role_id = Role.cache()["default"]
+    password_hash = hashing.hash_password("password")
+    taken = set(db.session.scalars(db.select(User.username)))
+    taken.update(db.session.scalars(db.select(User.email)))
+    first_id = _next_id(User)
+    self_follows = []
+
+    def rows():
+        for id in range(first_id, first_id + count):
+            # the id makes the name unique among the new users
+            username = f"{fake.user_name()}{id}"
+            while username in taken:
+                username = "_" + username
+            email = f"{username}@{fake.free_email_domain()}".lower()
+            while email in taken:
+                email = "_" + email
+            member_since = _random_time(rnd, now - 2 * YEAR, now - YEAR)
+            self_follows.append(
+                {
+                    "follower_id": id,
+                    "followed_id": id,
+                    "timestamp": member_since,
+                }
+            )
+            yield {
+                "id": id,
+                "email": email,
+                "username": username,
+                "role_id": role_id,
+                "password_hash": password_hash,
+                "confirmed": True,
+                "name": fake.name(),
+                "location": fake.city(),
+                "about_me": fake.text(),
+                "member_since": member_since,
+                "last_seen": _random_time(rnd, member_since, now),
+                "avatar_hash": hashlib.md5(email.encode("utf-8")).hexdigest(),
+                "default_gravatar": rnd.choice(GRAVATARS),
+            }
+
+    inserted = _insert(User.__table__.insert(), rows(), batch_size)
+    # every user follows themselves, as User() arranges
+    _insert(Follow.__table__.insert(), self_follows, batch_size)
+    return inserted
+
+
+def follows(count=1000, seed=None, batch_size=BATCH_SIZE, alpha=1.0):
+    """Insert about ``count`` follows between the users.
+
+    How many users someone follows has a heavy-tailed distribution, and who
+    they follow a power-law one. Follows that exist already are skipped.
+    """
+    rnd = _random(seed, "follows")
+    now = datetime.utcnow()
+    ids = list(db.session.scalars(db.select(User.id)))
+    if len(ids) < 2:
+        return 0
+    popular = list(ids)
+    cum_weights = _power_law(popular, rnd, alpha)
+    mean = count / len(ids)
+
+    def rows():
+        for follower in ids:
+            # the mean of paretovariate(1.5) is 3
+            degree = min(int(rnd.paretovariate(1.5) * mean / 3), len(ids) // 2)
+            followed = set()
+            # unpopular users are rarely drawn, do not insist on them
+            draws = 0
+            while len(followed) < degree and draws < 20 * degree:
+                k = degree - len(followed)
+                draws += k
+                for id in rnd.choices(popular, cum_weights=cum_weights, k=k):
+                    if id != follower:
+                        followed.add(id)
+            for id in followed:
+                yield {
+                    "follower_id": follower,
+                    "followed_id": id,
+                    "timestamp": _random_time(rnd, now - YEAR, now),
+                }
+
+    return _insert(_insert_ignore(Follow.__table__), rows(), batch_size)
+
+
+def _bodies(fake, policy, count=1000):
+    """A pool of fake texts and their rendered HTML."""
+    bodies = (fake.text() for i in range(count))
+    return [(body, renderer.render(policy, body)) for body in bodies]
+
+
+def posts(count=100, seed=None, batch_size=BATCH_SIZE, alpha=1.0):
+    """Insert ``count`` posts of the last year, by power-law authors."""
     fake = Faker()
-    user_count = User.query.count()
-    for i in range(count):
-        u = User.query.offset(randint(0, user_count - 1)).first()
-        p = Post(body=fake.text(), timestamp=fake.past_date(), author=u)
-        db.session.add(p)
-    db.session.commit()
+    fake.seed_instance(seed)
+    rnd = _random(seed, "posts")
+    now = datetime.utcnow()
+    authors = list(db.session.scalars(db.select(User.id)))
+    if not authors:
+        return 0
+    cum_weights = _power_law(authors, rnd, alpha)
+    bodies = _bodies(fake, "post")
+    first_id = _next_id(Post)
+
+    def rows():
+        for id in range(first_id, first_id + count):
+            body, body_html = rnd.choice(bodies)
+            yield {
+                "id": id,
+                "body": body,
+                "body_html": body_html,
+                "timestamp": _random_time(rnd, now - YEAR, now),
+                "author_id": rnd.choices(authors, cum_weights=cum_weights)[0],
+            }
+
+    return _insert(Post.__table__.insert(), rows(), batch_size)
+
+
+def comments(count=200, seed=None, batch_size=BATCH_SIZE, alpha=0.7):
+    """Insert ``count`` comments, in threads on power-law posts.
+
+    A thread is a few comments in a row on one post, written in turns by
+    its author and a handful of other users, minutes to hours apart.
+    """
+    fake = Faker()
+    fake.seed_instance(seed)
+    rnd = _random(seed, "comments")
+    now = datetime.utcnow()
+    users = list(db.session.scalars(db.select(User.id)))
+    posts = db.session.execute(
+        db.select(Post.id, Post.author_id, Post.timestamp)
+    ).all()
+    if not users or not posts:
+        return 0
+    cum_weights = _power_law(posts, rnd, alpha)
+    bodies = _bodies(fake, "comment")
+    first_id = _next_id(Comment)
+
+    def rows():
+        id = first_id
+        while id < first_id + count:
+            post_id, author_id, timestamp = rnd.choices(
+                posts, cum_weights=cum_weights
+            )[0]
+            people = [author_id] + rnd.sample(users, min(3, len(users)))
+            length = min(
+                1 + int(rnd.expovariate(1 / 4)), first_id + count - id
+            )
+            for i in range(length):
+                timestamp = min(
+                    timestamp + timedelta(seconds=rnd.expovariate(1 / 3600)),
+                    now,
+                )
+                body, body_html = rnd.choice(bodies)
+                yield {
+                    "id": id,
+                    "body": body,
+                    "body_html": body_html,
+                    "timestamp": timestamp,
+                    "disabled": False,
+                    "author_id": people[i % len(people)],
+                    "post_id": post_id,
+                }
+                id += 1
+
+    return _insert(Comment.__table__.insert(), rows(), batch_size)
+
+
+GENERATORS = {
+    "users": users,
+    "follows": follows,
+    "posts": posts,
+    "comments": comments,
+}
+
+
+def generate(
+    users=100,
+    follows=1000,
+    posts=100,
+    comments=200,
+    seed=None,
+    batch_size=BATCH_SIZE,
+    log=None,
+):
+    """Insert fake data, then rebuild the timeline and the counters.
+
+    Returns a dictionary mapping each step to its number of rows.
+    """
+    Role.insert_roles()
+    counts = dict(users=users, follows=follows, posts=posts, comments=comments)
+    results = {}
+    for name, step in GENERATORS.items():
+        start = time.perf_counter()
+        results[name] = step(counts[name], seed=seed, batch_size=batch_size)
+        if log:
+            log(name, results[name], time.perf_counter() - start)
+    start = time.perf_counter()
+    results["timeline"] = Timeline.rebuild()
+    if log:
+        log("timeline", results["timeline"], time.perf_counter() - start)
+    start = time.perf_counter()
+    # both tables have a comment_count, so the dicts are not merged
+    results["counters"] = sum(User.reconcile_counters().values()) + sum(
+        Post.reconcile_counters().values()
+    )
+    if log:
+        log("counters", results["counters"], time.perf_counter() - start)
+    return results
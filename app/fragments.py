@@ -0,0 +1,64 @@
+"""Cache of the rendered HTML of post items in post lists.
+
+Rendering ``_post.html`` for every post of every listed page is most of the
+template time of the index and profile pages. A rendered item only depends
+on the post, its author, its comment count and on who is looking at it (the
+author and administrators see an "Edit" link), so it is cached under the
+post id, the ``Post.version`` column and the viewer's class. Model events
+bump the version whenever one of these changes, which retires the old
+entry; stale entries are evicted by the LRU or expire after
+``FRAGMENT_CACHE_TTL`` seconds.
+
+The backend is chosen by ``FRAGMENT_CACHE_BACKEND``: "lru" (in memory, per
+worker), "filesystem" (``FRAGMENT_CACHE_DIR``, shared by the workers of one
+machine) or "null".
+"""
+
+from flask import current_app, render_template
+from flask_login import current_user
+from markupsafe import Markup
+
+from .cache import make_backend
+
+
+def viewer_class(post):
+    """Which variant of the item of ``post`` the current user is shown."""
+    if current_user.is_authenticated and current_user.id == post.author_id:
+        return "author"
+    if current_user.is_administrator():
+        return "admin"
+    return "other"
+
+
+class FragmentCache:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # one backend per application, so that test applications that reuse
+        # post ids do not share entries
+        app.extensions["fragment_cache"] = make_backend(
+            app.config["FRAGMENT_CACHE_BACKEND"],
+            size=app.config["FRAGMENT_CACHE_SIZE"],
+            directory=app.config["FRAGMENT_CACHE_DIR"],
+            ttl=app.config["FRAGMENT_CACHE_TTL"],
+        )
+        app.add_template_global(self.render_post, "render_post")
+
+    @property
+    def backend(self):
+        return current_app.extensions["fragment_cache"]
+
+    @staticmethod
+    def key(post):
+        return f"post:{post.id}:{post.version}:{viewer_class(post)}"
+
+    def render_post(self, post):
+        """The HTML of the list item of ``post``, from the cache if possible."""
+        key = self.key(post)
+        html = self.backend.get(key)
+        if html is None:
+            html = render_template("_post.html", post=post)
+            self.backend.set(key, html)
+        return Markup(html)
@@ -0,0 +1,80 @@
+"""Password hashing off the request threads.
+
+Hashing and checking a password with PBKDF2 takes tens of milliseconds of
+CPU by design. Done on the request thread, a burst of logins holds the GIL
+and every other request of the worker waits behind it. The hashing service
+runs them in a small process pool instead, and admits at most
+``PASSWORD_HASH_CONCURRENCY`` of them at a time per worker. When that many
+are already in flight, a request waits ``PASSWORD_HASH_QUEUE_TIMEOUT``
+seconds for a free slot and then fails fast with
+:class:`~app.exceptions.HashingServiceBusy`, which is answered with a 503.
+
+With ``PASSWORD_HASH_WORKERS`` set to 0 the hashes are computed inline,
+still subject to the concurrency limit.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from .exceptions import HashingServiceBusy
+
+
+class _HashingState:
+    def __init__(self, app):
+        self.workers = app.config["PASSWORD_HASH_WORKERS"]
+        if self.workers is None:
+            self.workers = os.cpu_count() or 1
+        self.slots = threading.BoundedSemaphore(
+            app.config["PASSWORD_HASH_CONCURRENCY"] or max(self.workers, 1)
+        )
+        self.queue_timeout = app.config["PASSWORD_HASH_QUEUE_TIMEOUT"]
+        self.lock = threading.Lock()
+        self.pool = None
+        self.pid = None
+
+    def executor(self):
+        # created on first use, and again in each forked worker process
+        with self.lock:
+            if self.pool is None or self.pid != os.getpid():
+                self.pool = ProcessPoolExecutor(max_workers=self.workers)
+                self.pid = os.getpid()
+            return self.pool
+
+    def run(self, f, *args):
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            raise HashingServiceBusy("too many password hashes in flight")
+        try:
+            if not self.workers:
+                return f(*args)
+            return self.executor().submit(f, *args).result()
+        finally:
+            self.slots.release()
+
+    def shutdown(self):
+        with self.lock:
+            if self.pool is not None and self.pid == os.getpid():
+                self.pool.shutdown()
+            self.pool = None
+
+
+class HashingService:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["hashing"] = _HashingState(app)
+
+    @staticmethod
+    def _state():
+        return current_app.extensions["hashing"]
+
+    def hash_password(self, password):
+        return self._state().run(generate_password_hash, password)
+
+    def check_password(self, pwhash, password):
+        return self._state().run(check_password_hash, pwhash, password)
@@ -0,0 +1,182 @@
+"""Per-request database instrumentation.
+
+Built on SQLAlchemy's ``before_cursor_execute`` and
+``after_cursor_execute`` events, so nothing but a few numbers per request
+is kept in memory (``SQLALCHEMY_RECORD_QUERIES`` stays off).
+"""
+
+import random
+import threading
+import time
+from collections import Counter
+
+from flask import (
+    current_app,
+    g,
+    has_app_context,
+    has_request_context,
+    request,
+)
+from sqlalchemy import event
+
+from .database import all_engines
+from .exceptions import QueryBudgetExceeded
+
+# upper bounds in seconds of the buckets of the query latency histograms
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf"))
+
+
+class EndpointStats:
+    """Totals of the database work of the requests of one endpoint."""
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.db_time = 0.0
+        # queries per latency bucket, not cumulative
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def add(self, durations):
+        self.requests += 1
+        self.queries += len(durations)
+        self.db_time += sum(durations)
+        for duration in durations:
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    self.buckets[i] += 1
+                    break
+
+
+class QueryInstrumentation:
+    """Count and time the SQL statements of each request.
+
+    - Per endpoint, the number of requests and queries, the total database
+      time and a histogram of query latencies are kept for this process,
+      see :meth:`stats`.
+    - Statements slower than ``SLOW_DB_QUERY_TIME`` are logged, a fraction
+      ``SLOW_DB_QUERY_SAMPLE_RATE`` of them, with the database they ran on.
+    - A request that runs the same statement ``N_PLUS_ONE_THRESHOLD`` times
+      or more is logged as a likely N+1 query pattern; with
+      ``N_PLUS_ONE_RAISE`` set (the testing configuration does) it fails
+      with :class:`QueryBudgetExceeded`.
+    - When ``QUERY_BUDGET`` is set, a request whose endpoint runs more
+      statements than its budget fails with :class:`QueryBudgetExceeded`.
+      ``QUERY_BUDGETS`` overrides the default budget per endpoint.
+    """
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        replicas = app.extensions.get("read_replicas", {})
+        app.extensions["query_stats"] = {
+            "lock": threading.Lock(),
+            "by": {},
+            # database names for the slow query log
+            "names": {engine: name for name, engine in replicas.items()},
+        }
+        for engine in all_engines(app, db):
+            event.listen(
+                engine, "before_cursor_execute", self.before_cursor_execute
+            )
+            event.listen(
+                engine, "after_cursor_execute", self.after_cursor_execute
+            )
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    @staticmethod
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        conn.info["query_start"] = time.perf_counter()
+
+    @staticmethod
+    def after_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        duration = time.perf_counter() - conn.info.pop("query_start")
+        if not has_app_context():
+            return
+        if has_request_context():
+            g.db_query_count = g.get("db_query_count", 0) + 1
+            g.setdefault("db_durations", []).append(duration)
+            g.setdefault("db_statements", Counter())[statement] += 1
+        config = current_app.config
+        if (
+            duration >= config["SLOW_DB_QUERY_TIME"]
+            and random.random() < config["SLOW_DB_QUERY_SAMPLE_RATE"]
+        ):
+            current_app.logger.warning(
+                "Slow query: %s\nParameters: %s\nDuration: %fs\n"
+                "Database: %s\nEndpoint: %s\n",
+                statement,
+                # the rows of a bulk insert would flood the log
+                f"{len(parameters)} rows" if executemany else parameters,
+                duration,
+                current_app.extensions["query_stats"]["names"].get(
+                    conn.engine, "primary"
+                ),
+                request.endpoint if has_request_context() else None,
+            )
+
+    @staticmethod
+    def before_request():
+        # g outlives the request when an app context was already pushed,
+        # as in the tests, so start every request from zero
+        g.db_query_count = 0
+        g.db_durations = []
+        g.db_statements = Counter()
+
+    @staticmethod
+    def after_request(response):
+        config = current_app.config
+        state = current_app.extensions["query_stats"]
+        with state["lock"]:
+            stats = state["by"].setdefault(request.endpoint, EndpointStats())
+            stats.add(g.get("db_durations", []))
+
+        repeated = [
+            (statement, count)
+            for statement, count in g.get("db_statements", {}).items()
+            if count >= config["N_PLUS_ONE_THRESHOLD"]
+        ]
+        for statement, count in repeated:
+            current_app.logger.warning(
+                "Possible N+1 queries: %s ran %d times\n%s\n",
+                request.endpoint,
+                count,
+                statement,
+            )
+        if repeated and config["N_PLUS_ONE_RAISE"]:
+            raise QueryBudgetExceeded(
+                f"{request.endpoint} ran the same statement "
+                f"{repeated[0][1]} times: {repeated[0][0]}"
+            )
+
+        budget = config["QUERY_BUDGETS"].get(
+            request.endpoint, config["QUERY_BUDGET"]
+        )
+        count = g.get("db_query_count", 0)
+        if budget is not None and count > budget:
+            raise QueryBudgetExceeded(
+                f"{request.endpoint} ran {count} queries, "
+                f"its budget is {budget}"
+            )
+        return response
+
+    @staticmethod
+    def stats():
+        """A snapshot of the per-endpoint totals of this process."""
+        state = current_app.extensions["query_stats"]
+        with state["lock"]:
+            return {
+                endpoint: {
+                    "requests": stats.requests,
+                    "queries": stats.queries,
+                    "db_time": stats.db_time,
+                    "buckets": list(stats.buckets),
+                }
+                for endpoint, stats in state["by"].items()
+            }
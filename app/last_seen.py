@@ -0,0 +1,115 @@
+"""Write-coalescing for the ``last_seen`` timestamp of logged-in users.
+
+Updating ``users.last_seen`` and committing on every authenticated request
+makes every worker queue behind the database write lock (on SQLite there is
+only one). Instead, the timestamps are buffered in memory per worker and
+flushed as a single batched UPDATE every ``LAST_SEEN_FLUSH_INTERVAL``
+seconds, and once more when the worker exits.
+"""
+
+import atexit
+import threading
+import time
+import weakref
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.orm.attributes import set_committed_value
+
+
+# states of the live apps of this process, flushed once when it exits
+_states = weakref.WeakSet()
+
+
+class _LastSeenState:
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.last_flush = time.monotonic()
+
+    def flush(self):
+        from . import db
+        from .models import User
+
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = time.monotonic()
+        if not pending:
+            return 0
+        users = User.__table__
+        stmt = (
+            users.update()
+            .where(users.c.id == bindparam("user_id"))
+            .where(
+                db.or_(
+                    users.c.last_seen.is_(None),
+                    users.c.last_seen < bindparam("seen"),
+                )
+            )
+            .values(last_seen=bindparam("seen"))
+        )
+        rows = [
+            {"user_id": user_id, "seen": seen}
+            for user_id, seen in pending.items()
+        ]
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(stmt, rows)
+        return len(rows)
+
+
+class LastSeenBuffer:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        state = _LastSeenState(app)
+        app.extensions["last_seen"] = state
+        app.after_request(self._after_request)
+        _states.add(state)
+
+    @staticmethod
+    def _state():
+        return current_app.extensions["last_seen"]
+
+    def touch(self, user):
+        """Record that ``user`` was seen now, without writing to the database.
+
+        Nothing is recorded while the stored value is fresher than the flush
+        interval, since writing it again would not change anything a visitor
+        can see.
+        """
+        interval = current_app.config["LAST_SEEN_FLUSH_INTERVAL"]
+        now = datetime.utcnow()
+        if user.last_seen is not None and now - user.last_seen < timedelta(
+            seconds=interval
+        ):
+            return
+        state = self._state()
+        with state.lock:
+            state.pending[user.id] = now
+        # show the new value in this request without making the user dirty
+        set_committed_value(user, "last_seen", now)
+
+    def flush(self):
+        """Write all buffered timestamps; returns the number of users."""
+        return self._state().flush()
+
+    def _after_request(self, response):
+        state = self._state()
+        interval = current_app.config["LAST_SEEN_FLUSH_INTERVAL"]
+        if state.pending and time.monotonic() - state.last_flush >= interval:
+            state.flush()
+        return response
+
+
+@atexit.register
+def _flush_all():
+    for state in list(_states):
+        try:
+            state.flush()
+        except Exception:
+            state.app.logger.exception("Could not flush last_seen on exit")
@@ -1,5 +1,6 @@
 from flask import jsonify, render_template, request
 
+from ..exceptions import HashingServiceBusy
 from . import main
 
 
@@ -40,3 +41,18 @@ def internal_server_error(e):
         response.status_code = 500
         return response
     return render_template("500.html"), 500
+
+
+@main.app_errorhandler(HashingServiceBusy)
+def service_unavailable(e):
+    """Handle saturation of the password hashing service."""
+    headers = {"Retry-After": "1"}
+    if (
+        request.accept_mimetypes.accept_json
+        and not request.accept_mimetypes.accept_html
+    ) or request.blueprint == "api":
+        response = jsonify({"error": "service unavailable"})
+        response.status_code = 503
+        response.headers.update(headers)
+        return response
+    return render_template("503.html"), 503, headers
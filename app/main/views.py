@@ -12,12 +12,21 @@ from flask import (
     url_for,
 )
 from flask_login import current_user, login_required
-from flask_sqlalchemy import get_debug_queries
 
-from .. import db
+from .. import db, metrics, page_cache
+from ..database import use_primary
 from ..decorators import admin_required, permission_required
 from ..email import send_email
-from ..models import Comment, Permission, Post, Role, User
+from ..models import (
+    Comment,
+    Follow,
+    Permission,
+    Post,
+    Role,
+    Timeline,
+    User,
+)
+from ..pagination import keyset_paginate
 from . import main
 from .forms import (
     CommentForm,
@@ -39,49 +48,103 @@ def server_shutdown():
     return "Shutting down..."
 
 
-@main.after_app_request
-def after_request(response):
-    for query in get_debug_queries():
-        if query.duration >= current_app.config["SLOW_DB_QUERY_TIME"]:
-            current_app.logger.warning(
-                "Slow query: %s\nParameters: %s\nDuration: %fs\nContext: %s\n"
-                % (
-                    query.statement,
-                    query.parameters,
-                    query.duration,
-                    query.context,
-                )
-            )
-    return response
+@main.route("/metrics")
+def prometheus_metrics():
+    if (
+        request.remote_addr not in current_app.config["METRICS_ALLOWED_IPS"]
+        and not current_user.is_administrator()
+    ):
+        abort(403)
+    return current_app.response_class(
+        metrics.render(), mimetype="text/plain; version=0.0.4"
+    )
+
+
+def newest_post():
+    return db.session.scalar(db.select(db.func.max(Post.timestamp)))
+
+
+def newest_post_of(username):
+    return db.session.scalar(
+        db.select(
+            db.func.coalesce(db.func.max(Post.timestamp), User.member_since)
+        )
+        .select_from(User)
+        .outerjoin(Post, Post.author_id == User.id)
+        .where(User.username == username)
+        .group_by(User.id)
+    )
+
+
+def newest_comment_of(id):
+    return db.session.scalar(
+        db.select(
+            db.func.coalesce(db.func.max(Comment.timestamp), Post.timestamp)
+        )
+        .select_from(Post)
+        .outerjoin(Comment, Comment.post_id == Post.id)
+        .where(Post.id == id)
+        .group_by(Post.id)
+    )
+
+
+def newest_follow_of(column):
+    def last_modified(username):
+        return db.session.scalar(
+            db.select(db.func.max(Follow.timestamp))
+            .join(User, column == User.id)
+            .where(User.username == username)
+        )
+
+    return last_modified
 
 
 @main.route("/", methods=["GET", "POST"])
+@page_cache.cached(last_modified=newest_post)
 def index():
     """Handle the post form and pass old blog posts to the template.
 
     Also handle pagination.
     """
-    form = PostForm()
-    if current_user.can(Permission.WRITE) and form.validate_on_submit():
-        post = Post(
-            body=form.body.data, author=current_user._get_current_object()
-        )
-        db.session.add(post)
-        db.session.commit()
-        return redirect(url_for(".index"))
-    page = request.args.get("page", 1, type=int)
+    # the post form is of no use to visitors who cannot write, and building
+    # it stores a CSRF token in the session, which would keep the page out
+    # of the page cache
+    form = None
+    if current_user.can(Permission.WRITE):
+        form = PostForm()
+        if form.validate_on_submit():
+            post = Post(
+                body=form.body.data,
+                author=current_user._get_current_object(),
+            )
+            db.session.add(post)
+            db.session.commit()
+            return redirect(url_for(".index"))
+    page = request.args.get("page", type=int)
     show_followed = False
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get("show_followed", ""))
     if show_followed:
         query = current_user.followed_posts
+        order = (Timeline.timestamp, Timeline.post_id)
     else:
         query = Post.query
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
-        page=page,
-        per_page=current_app.config["POSTS_PER_PAGE"],
-        error_out=False,
-    )
+        order = (Post.timestamp, Post.id)
+    query = Post.with_authors(query)
+    if page is None:
+        pagination = keyset_paginate(
+            query,
+            order,
+            cursor=request.args.get("cursor"),
+            per_page=current_app.config["POSTS_PER_PAGE"],
+            key=lambda post: (post.timestamp, post.id),
+        )
+    else:
+        pagination = query.order_by(order[0].desc()).paginate(
+            page=page,
+            per_page=current_app.config["POSTS_PER_PAGE"],
+            error_out=False,
+        )
     posts = pagination.items
     return render_template(
         "index.html",
@@ -206,15 +269,25 @@ def hello(name=None):
 
 # user profile page route
 @main.route("/user/<username>")
+@page_cache.cached(last_modified=newest_post_of)
 def user(username):
     """Show user's profile with posts."""
     user = User.query.filter_by(username=username).first_or_404()
-    page = request.args.get("page", 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page=page,
-        per_page=current_app.config["POSTS_PER_PAGE"],
-        error_out=False,
-    )
+    page = request.args.get("page", type=int)
+    posts = Post.with_authors(user.posts)
+    if page is None:
+        pagination = keyset_paginate(
+            posts,
+            (Post.timestamp, Post.id),
+            cursor=request.args.get("cursor"),
+            per_page=current_app.config["POSTS_PER_PAGE"],
+        )
+    else:
+        pagination = posts.order_by(Post.timestamp.desc()).paginate(
+            page=page,
+            per_page=current_app.config["POSTS_PER_PAGE"],
+            error_out=False,
+        )
     posts = pagination.items
     return render_template(
         "user.html", user=user, posts=posts, pagination=pagination
@@ -271,29 +344,44 @@ def edit_profile_admin(id):
 
 
 @main.route("/post/<int:id>", methods=["GET", "POST"])
+@page_cache.cached(last_modified=newest_comment_of)
 def post(id):
-    post = Post.query.get_or_404(id)
-    form = CommentForm()
-    if form.validate_on_submit():
-        comment = Comment(
-            body=form.body.data,
-            post=post,
-            author=current_user._get_current_object(),
+    post = Post.with_authors(Post.query).get_or_404(id)
+    # as in index(): no form, and no CSRF token in the session, for
+    # visitors who cannot comment
+    form = None
+    if current_user.can(Permission.COMMENT):
+        form = CommentForm()
+        if form.validate_on_submit():
+            comment = Comment(
+                body=form.body.data,
+                post=post,
+                author=current_user._get_current_object(),
+            )
+            db.session.add(comment)
+            db.session.commit()
+            flash("Your comment has been published.")
+            return redirect(url_for(".post", id=post.id, page=-1))
+    page = request.args.get("page", type=int)
+    comments = Comment.with_authors(post.comments)
+    if page is None:
+        pagination = keyset_paginate(
+            comments,
+            (Comment.timestamp, Comment.id),
+            cursor=request.args.get("cursor"),
+            per_page=current_app.config["COMMENTS_PER_PAGE"],
+            descending=False,
+        )
+    else:
+        if page == -1:
+            page = (post.comments.count() - 1) // current_app.config[
+                "COMMENTS_PER_PAGE"
+            ] + 1
+        pagination = comments.order_by(Comment.timestamp.asc()).paginate(
+            page=page,
+            per_page=current_app.config["COMMENTS_PER_PAGE"],
+            error_out=False,
         )
-        db.session.add(comment)
-        db.session.commit()
-        flash("Your comment has been published.")
-        return redirect(url_for(".post", id=post.id, page=-1))
-    page = request.args.get("page", 1, type=int)
-    if page == -1:
-        page = (post.comments.count() - 1) // current_app.config[
-            "COMMENTS_PER_PAGE"
-        ] + 1
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
-        page=page,
-        per_page=current_app.config["COMMENTS_PER_PAGE"],
-        error_out=False,
-    )
     comments = pagination.items
     return render_template(
         "post.html",
@@ -322,6 +410,7 @@ def edit(id):
 
 
 @main.route("/follow/<username>")
+@use_primary
 @login_required
 @permission_required(Permission.FOLLOW)
 def follow(username):
@@ -339,6 +428,7 @@ def follow(username):
 
 
 @main.route("/unfollow/<username>")
+@use_primary
 @login_required
 @permission_required(Permission.FOLLOW)
 def unfollow(username):
@@ -356,17 +446,26 @@ def unfollow(username):
 
 
 @main.route("/followers/<username>")
+@page_cache.cached(last_modified=newest_follow_of(Follow.followed_id))
 def followers(username):
     user = User.query.filter_by(username=username).first()
     if user is None:
         flash("Invalid user.")
         return redirect(url_for(".index"))
-    page = request.args.get("page", 1, type=int)
-    pagination = user.followers.paginate(
-        page=page,
-        per_page=current_app.config["FOLLOWERS_PER_PAGE"],
-        error_out=False,
-    )
+    page = request.args.get("page", type=int)
+    if page is None:
+        pagination = keyset_paginate(
+            user.followers,
+            (Follow.timestamp, Follow.follower_id),
+            cursor=request.args.get("cursor"),
+            per_page=current_app.config["FOLLOWERS_PER_PAGE"],
+        )
+    else:
+        pagination = user.followers.paginate(
+            page=page,
+            per_page=current_app.config["FOLLOWERS_PER_PAGE"],
+            error_out=False,
+        )
     follows = [
         {"user": item.follower, "timestamp": item.timestamp}
         for item in pagination.items
@@ -382,17 +481,26 @@ def followers(username):
 
 
 @main.route("/followed_by/<username>")
+@page_cache.cached(last_modified=newest_follow_of(Follow.follower_id))
 def followed_by(username):
     user = User.query.filter_by(username=username).first()
     if user is None:
         flash("Invalid user.")
         return redirect(url_for(".index"))
-    page = request.args.get("page", 1, type=int)
-    pagination = user.followed.paginate(
-        page=page,
-        per_page=current_app.config["FOLLOWERS_PER_PAGE"],
-        error_out=False,
-    )
+    page = request.args.get("page", type=int)
+    if page is None:
+        pagination = keyset_paginate(
+            user.followed,
+            (Follow.timestamp, Follow.followed_id),
+            cursor=request.args.get("cursor"),
+            per_page=current_app.config["FOLLOWERS_PER_PAGE"],
+        )
+    else:
+        pagination = user.followed.paginate(
+            page=page,
+            per_page=current_app.config["FOLLOWERS_PER_PAGE"],
+            error_out=False,
+        )
     follows = [
         {"user": item.followed, "timestamp": item.timestamp}
         for item in pagination.items
@@ -427,19 +535,34 @@ def show_followed():
 @login_required
 @permission_required(Permission.MODERATE)
 def moderate():
-    page = request.args.get("page", 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page=page,
-        per_page=current_app.config["COMMENTS_PER_PAGE"],
-        error_out=False,
-    )
+    page = request.args.get("page", type=int)
+    cursor = request.args.get("cursor")
+    query = Comment.with_authors(Comment.query)
+    if page is None:
+        pagination = keyset_paginate(
+            query,
+            (Comment.timestamp, Comment.id),
+            cursor=cursor,
+            per_page=current_app.config["COMMENTS_PER_PAGE"],
+        )
+    else:
+        pagination = query.order_by(Comment.timestamp.desc()).paginate(
+            page=page,
+            per_page=current_app.config["COMMENTS_PER_PAGE"],
+            error_out=False,
+        )
     comments = pagination.items
     return render_template(
-        "moderate.html", comments=comments, pagination=pagination, page=page
+        "moderate.html",
+        comments=comments,
+        pagination=pagination,
+        page=page,
+        cursor=cursor,
     )
 
 
 @main.route("/moderate/enable/<int:id>")
+@use_primary
 @login_required
 @permission_required(Permission.MODERATE)
 def moderate_enable(id):
@@ -448,11 +571,16 @@ def moderate_enable(id):
     db.session.add(comment)
     db.session.commit()
     return redirect(
-        url_for(".moderate", page=request.args.get("page", 1, type=int))
+        url_for(
+            ".moderate",
+            page=request.args.get("page", type=int),
+            cursor=request.args.get("cursor"),
+        )
     )
 
 
 @main.route("/moderate/disable/<int:id>")
+@use_primary
 @login_required
 @permission_required(Permission.MODERATE)
 def moderate_disable(id):
@@ -461,5 +589,9 @@ def moderate_disable(id):
     db.session.add(comment)
     db.session.commit()
     return redirect(
-        url_for(".moderate", page=request.args.get("page", 1, type=int))
+        url_for(
+            ".moderate",
+            page=request.args.get("page", type=int),
+            cursor=request.args.get("cursor"),
+        )
     )
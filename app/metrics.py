@@ -0,0 +1,396 @@
+"""Prometheus metrics of the application.
+
+``/metrics`` serves, in the Prometheus text format:
+
+- requests per endpoint, method and status, and a histogram of their
+  latencies per endpoint;
+- SQL statements, database time and a histogram of query latencies per
+  endpoint, as counted by :class:`~app.instrumentation.QueryInstrumentation`;
+- the time spent rendering templates per endpoint;
+- hits and misses of the caches, and their hit ratio;
+- the number of messages of the outbox not delivered yet.
+
+Each gunicorn worker counts its own requests. With ``METRICS_DIR`` set,
+every worker writes its totals to a file of that directory at most every
+``METRICS_FLUSH_INTERVAL`` seconds, and the worker answering the scrape
+adds up the files of all workers. The directory must be emptied before the
+workers start, as ``boot.sh`` does.
+"""
+
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+from flask import (
+    before_render_template,
+    current_app,
+    g,
+    has_request_context,
+    request,
+    template_rendered,
+)
+
+from .instrumentation import LATENCY_BUCKETS, QueryInstrumentation
+
+# upper bounds in seconds of the buckets of the request latency histograms
+REQUEST_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    float("inf"),
+)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    "webuzz_http_requests_total": (
+        "counter",
+        "HTTP requests by endpoint, method and status.",
+        None,
+    ),
+    "webuzz_http_request_duration_seconds": (
+        "histogram",
+        "Latency of HTTP requests by endpoint.",
+        REQUEST_BUCKETS,
+    ),
+    "webuzz_db_queries_total": (
+        "counter",
+        "SQL statements run by endpoint.",
+        None,
+    ),
+    "webuzz_db_time_seconds_total": (
+        "counter",
+        "Time spent in SQL statements by endpoint.",
+        None,
+    ),
+    "webuzz_db_query_duration_seconds": (
+        "histogram",
+        "Latency of SQL statements by endpoint.",
+        LATENCY_BUCKETS,
+    ),
+    "webuzz_template_render_seconds_total": (
+        "counter",
+        "Time spent rendering templates by endpoint.",
+        None,
+    ),
+    "webuzz_cache_hits_total": ("counter", "Cache hits by cache.", None),
+    "webuzz_cache_misses_total": ("counter", "Cache misses by cache.", None),
+    "webuzz_cache_hit_ratio": (
+        "gauge",
+        "Share of the lookups of a cache that were hits.",
+        None,
+    ),
+    "webuzz_email_queue_depth": (
+        "gauge",
+        "Messages of the outbox not delivered yet.",
+        None,
+    ),
+}
+
+
+def _key(name, **labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def _add(samples, key, value):
+    """Add a counter value or a histogram to ``samples``."""
+    if not isinstance(value, dict):
+        samples[key] = samples.get(key, 0) + value
+        return
+    current = samples.setdefault(
+        key, {"buckets": [0] * len(value["buckets"]), "sum": 0, "count": 0}
+    )
+    for i, count in enumerate(value["buckets"]):
+        current["buckets"][i] += count
+    current["sum"] += value["sum"]
+    current["count"] += value["count"]
+
+
+def _histogram(bounds, values):
+    buckets = [0] * len(bounds)
+    for value in values:
+        for i, bound in enumerate(bounds):
+            if value <= bound:
+                buckets[i] += 1
+                break
+    return {"buckets": buckets, "sum": sum(values), "count": len(values)}
+
+
+def dump(samples):
+    return json.dumps(
+        [[name, labels, value] for (name, labels), value in samples.items()]
+    )
+
+
+def load(data):
+    return {
+        (name, tuple(tuple(label) for label in labels)): value
+        for name, labels, value in json.loads(data)
+    }
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value)
+            .replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n"),
+        )
+        for name, value in labels
+    )
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(samples):
+    """The Prometheus text format of ``samples``."""
+    lines = []
+    for name, (kind, help, bounds) in METRICS.items():
+        keys = sorted(key for key in samples if key[0] == name)
+        if not keys:
+            continue
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key in keys:
+            labels, value = key[1], samples[key]
+            if kind != "histogram":
+                lines.append(
+                    f"{name}{_format_labels(labels)} "
+                    f"{_format_value(value)}"
+                )
+                continue
+            cumulative = 0
+            for bound, count in zip(bounds, value["buckets"]):
+                cumulative += count
+                bucket_labels = labels + (("le", _format_value(bound)),)
+                lines.append(
+                    f"{name}_bucket{_format_labels(bucket_labels)} "
+                    f"{cumulative}"
+                )
+            lines.append(
+                f"{name}_sum{_format_labels(labels)} "
+                f"{_format_value(value['sum'])}"
+            )
+            lines.append(
+                f"{name}_count{_format_labels(labels)} {value['count']}"
+            )
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsState:
+    def __init__(self, app):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.directory = app.config["METRICS_DIR"]
+        self.flush_interval = app.config["METRICS_FLUSH_INTERVAL"]
+        self.flushed_at = 0.0
+
+
+class Metrics:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        state = app.extensions["metrics"] = _MetricsState(app)
+        if state.directory:
+            os.makedirs(state.directory, exist_ok=True)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        before_render_template.connect(self.before_render_template, app)
+        template_rendered.connect(self.template_rendered, app)
+
+    @staticmethod
+    def _state():
+        return current_app.extensions["metrics"]
+
+    @staticmethod
+    def before_request():
+        # g outlives the request when an app context was already pushed
+        g.metrics_start = time.perf_counter()
+        g.template_starts = []
+        g.template_time = 0.0
+
+    @staticmethod
+    def before_render_template(sender, template, context, **extra):
+        if has_request_context():
+            g.setdefault("template_starts", []).append(time.perf_counter())
+
+    @staticmethod
+    def template_rendered(sender, template, context, **extra):
+        starts = g.get("template_starts") if has_request_context() else None
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        # templates rendered while rendering another one are counted once
+        if not starts:
+            g.template_time = g.get("template_time", 0.0) + elapsed
+
+    def after_request(self, response):
+        if "metrics_start" not in g:
+            return response
+        duration = time.perf_counter() - g.pop("metrics_start")
+        # requests that match no route share one label value
+        endpoint = request.endpoint or "none"
+        state = self._state()
+        with state.lock:
+            _add(
+                state.samples,
+                _key(
+                    "webuzz_http_requests_total",
+                    blueprint=request.blueprint or "",
+                    endpoint=endpoint,
+                    method=request.method,
+                    status=response.status_code,
+                ),
+                1,
+            )
+            _add(
+                state.samples,
+                _key(
+                    "webuzz_http_request_duration_seconds", endpoint=endpoint
+                ),
+                _histogram(REQUEST_BUCKETS, [duration]),
+            )
+            _add(
+                state.samples,
+                _key(
+                    "webuzz_template_render_seconds_total", endpoint=endpoint
+                ),
+                g.get("template_time", 0.0),
+            )
+        if (
+            state.directory
+            and time.monotonic() - state.flushed_at >= state.flush_interval
+        ):
+            self.flush()
+        return response
+
+    @staticmethod
+    def caches():
+        """Map a name to each cache backend of this process."""
+        from . import renderer
+
+        extensions = current_app.extensions
+        caches = {
+            "render": renderer.cache,
+            "fragment": extensions.get("fragment_cache"),
+            "page": extensions.get("page_cache"),
+            "token_generation": extensions.get("token_generations"),
+            "basic_auth": extensions.get("verified_credentials"),
+        }
+        return {
+            name: cache for name, cache in caches.items() if cache is not None
+        }
+
+    def process_samples(self):
+        """The counters and histograms of this process."""
+        state = self._state()
+        samples = {}
+        with state.lock:
+            for key, value in state.samples.items():
+                _add(samples, key, value)
+        for endpoint, stats in QueryInstrumentation.stats().items():
+            endpoint = endpoint or "none"
+            _add(
+                samples,
+                _key("webuzz_db_queries_total", endpoint=endpoint),
+                stats["queries"],
+            )
+            _add(
+                samples,
+                _key("webuzz_db_time_seconds_total", endpoint=endpoint),
+                stats["db_time"],
+            )
+            _add(
+                samples,
+                _key("webuzz_db_query_duration_seconds", endpoint=endpoint),
+                {
+                    "buckets": stats["buckets"],
+                    "sum": stats["db_time"],
+                    "count": stats["queries"],
+                },
+            )
+        for name, cache in self.caches().items():
+            _add(
+                samples,
+                _key("webuzz_cache_hits_total", cache=name),
+                cache.hits,
+            )
+            _add(
+                samples,
+                _key("webuzz_cache_misses_total", cache=name),
+                cache.misses,
+            )
+        return samples
+
+    def flush(self, samples=None):
+        """Write the totals of this process to ``METRICS_DIR``."""
+        state = self._state()
+        if samples is None:
+            samples = self.process_samples()
+        state.flushed_at = time.monotonic()
+        fd, tmp = tempfile.mkstemp(dir=state.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(dump(samples))
+        os.replace(
+            tmp, os.path.join(state.directory, f"metrics-{os.getpid()}.json")
+        )
+
+    def collect(self):
+        """The samples of all workers, with the gauges computed now."""
+        from . import db
+        from .models import Outbox
+
+        state = self._state()
+        samples = self.process_samples()
+        if state.directory:
+            self.flush(samples)
+            samples = {}
+            pattern = os.path.join(state.directory, "metrics-*.json")
+            for path in glob.glob(pattern):
+                try:
+                    with open(path) as f:
+                        worker_samples = load(f.read())
+                except (OSError, ValueError):
+                    continue
+                for key, value in worker_samples.items():
+                    _add(samples, key, value)
+
+        for (name, labels), hits in list(samples.items()):
+            if name != "webuzz_cache_hits_total":
+                continue
+            lookups = hits + samples.get(
+                ("webuzz_cache_misses_total", labels), 0
+            )
+            samples[("webuzz_cache_hit_ratio", labels)] = (
+                hits / lookups if lookups else 0.0
+            )
+        samples[_key("webuzz_email_queue_depth")] = db.session.scalar(
+            db.select(db.func.count(Outbox.id)).where(
+                Outbox.sent_at.is_(None),
+                Outbox.attempts < current_app.config["MAIL_MAX_ATTEMPTS"],
+            )
+        )
+        return samples
+
+    def render(self):
+        return render(self.collect())
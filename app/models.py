@@ -1,18 +1,19 @@
 """Here reside database models, used by ORM."""
 
 import hashlib
+import time
 from datetime import datetime
 
-import bleach
 from flask import current_app, request, url_for
 from flask_login import AnonymousUserMixin, UserMixin
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from markdown import markdown
-from werkzeug.security import check_password_hash, generate_password_hash
+from itsdangerous import URLSafeSerializer
+from sqlalchemy.orm import Session, joinedload
 
+from app.cache import LRUBackend
 from app.exceptions import ValidationError
 
-from . import db, login_manager
+from . import db, hashing, login_manager, renderer
 
 
 class Permission:
@@ -70,6 +71,7 @@ class Role(db.Model):
             role.default = role.name == default_role
             db.session.add(role)
         db.session.commit()
+        Role.clear_cache()
 
     def add_permission(self, perm):
         if not self.has_permission(perm):
@@ -85,6 +87,44 @@ class Role(db.Model):
     def has_permission(self, perm):
         return self.permissions & perm == perm
 
+    @staticmethod
+    def cache():
+        """Ids and permissions of all roles, read once per process.
+
+        There are only a handful of roles, so they are kept in memory and
+        users' permissions are checked without loading their role. The
+        cache is reloaded every ``ROLE_CACHE_TTL`` seconds, and right away
+        after roles change in this process.
+        """
+        cache = current_app.extensions.get("roles")
+        if cache is None or cache["expires"] < time.monotonic():
+            rows = db.session.execute(
+                db.select(Role.id, Role.name, Role.default, Role.permissions)
+            ).all()
+            cache = current_app.extensions["roles"] = {
+                "expires": time.monotonic()
+                + current_app.config["ROLE_CACHE_TTL"],
+                "permissions": {row.id: row.permissions or 0 for row in rows},
+                "ids": {row.name: row.id for row in rows},
+                "default": next((row.id for row in rows if row.default), None),
+            }
+        return cache
+
+    @staticmethod
+    def clear_cache(*args):
+        current_app.extensions.pop("roles", None)
+
+    @staticmethod
+    def on_update(mapper, connection, target):
+        if db.inspect(target).attrs.permissions.history.has_changes():
+            # API tokens of the role's users carry the old permissions
+            users = User.__table__
+            connection.execute(
+                users.update()
+                .where(users.c.role_id == target.id)
+                .values(token_generation=users.c.token_generation + 1)
+            )
+
     def __repr__(self):
         return f"<Role {self.name}>"
 
@@ -98,6 +138,159 @@ class Follow(db.Model):
         db.Integer, db.ForeignKey("users.id"), primary_key=True
     )
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # the follower and followed lists, newest first
+    __table_args__ = (
+        db.Index(
+            "ix_follows_followed_id_timestamp",
+            "followed_id",
+            "timestamp",
+            "follower_id",
+        ),
+        db.Index(
+            "ix_follows_follower_id_timestamp",
+            "follower_id",
+            "timestamp",
+            "followed_id",
+        ),
+    )
+
+    @staticmethod
+    def on_insert(mapper, connection, target):
+        User.add_to_counters(connection, target.follower_id, followed_count=1)
+        User.add_to_counters(connection, target.followed_id, follower_count=1)
+
+    @staticmethod
+    def on_delete(mapper, connection, target):
+        User.add_to_counters(connection, target.follower_id, followed_count=-1)
+        User.add_to_counters(connection, target.followed_id, follower_count=-1)
+
+
+class Timeline(db.Model):
+    """Materialized home timeline, one row per (follower, post).
+
+    Rows are fanned out when a post is written and backfilled or pruned when
+    a follow is created or removed, so reading a user's followed posts is a
+    range scan over the ``(user_id, timestamp)`` index instead of a join of
+    ``posts`` and ``follows`` followed by a sort.
+    """
+
+    __tablename__ = "timeline"
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("users.id"), primary_key=True
+    )
+    post_id = db.Column(
+        db.Integer, db.ForeignKey("posts.id"), primary_key=True
+    )
+    timestamp = db.Column(db.DateTime, nullable=False)
+    __table_args__ = (
+        # post_id breaks ties of the keyset order without a sort
+        db.Index(
+            "ix_timeline_user_id_timestamp", "user_id", "timestamp", "post_id"
+        ),
+        # removal of a deleted post from every timeline
+        db.Index("ix_timeline_post_id", "post_id"),
+    )
+
+    @staticmethod
+    def fan_out_post(connection, post):
+        """Insert a new post into the timelines of the author's followers."""
+        connection.execute(
+            Timeline.__table__.insert().from_select(
+                ["user_id", "post_id", "timestamp"],
+                db.select(
+                    Follow.follower_id,
+                    db.literal(post.id),
+                    db.literal(post.timestamp, db.DateTime),
+                ).where(Follow.followed_id == post.author_id),
+            )
+        )
+
+    @staticmethod
+    def backfill_follow(connection, follow):
+        """Copy the posts of a newly followed user into the timeline."""
+        existing = db.select(Timeline.post_id).where(
+            Timeline.user_id == follow.follower_id,
+            Timeline.post_id == Post.id,
+        )
+        connection.execute(
+            Timeline.__table__.insert().from_select(
+                ["user_id", "post_id", "timestamp"],
+                db.select(
+                    db.literal(follow.follower_id),
+                    Post.id,
+                    Post.timestamp,
+                ).where(
+                    Post.author_id == follow.followed_id,
+                    ~existing.exists(),
+                ),
+            )
+        )
+
+    @staticmethod
+    def prune_follow(connection, follow):
+        """Remove the posts of an unfollowed user from the timeline."""
+        connection.execute(
+            Timeline.__table__.delete().where(
+                Timeline.user_id == follow.follower_id,
+                Timeline.post_id.in_(
+                    db.select(Post.id).where(
+                        Post.author_id == follow.followed_id
+                    )
+                ),
+            )
+        )
+
+    @staticmethod
+    def prune_post(connection, post):
+        connection.execute(
+            Timeline.__table__.delete().where(Timeline.post_id == post.id)
+        )
+
+    @staticmethod
+    def on_after_flush(session, flush_context):
+        """Keep the timeline in step with posts and follows in the same
+        transaction that writes them."""
+        connection = session.connection()
+        for obj in session.new:
+            if isinstance(obj, Post):
+                Timeline.fan_out_post(connection, obj)
+        for obj in session.new:
+            if isinstance(obj, Follow):
+                Timeline.backfill_follow(connection, obj)
+        for obj in session.deleted:
+            if isinstance(obj, Follow):
+                Timeline.prune_follow(connection, obj)
+            elif isinstance(obj, Post):
+                Timeline.prune_post(connection, obj)
+            elif isinstance(obj, User):
+                connection.execute(
+                    Timeline.__table__.delete().where(
+                        Timeline.user_id == obj.id
+                    )
+                )
+
+    @staticmethod
+    def rebuild(user_id=None):
+        """Recompute the timeline from ``follows`` and ``posts``.
+
+        :param user_id: rebuild only this user's timeline, or every timeline
+        if None.
+        """
+        delete = Timeline.__table__.delete()
+        select = db.select(Follow.follower_id, Post.id, Post.timestamp).join(
+            Post, Post.author_id == Follow.followed_id
+        )
+        if user_id is not None:
+            delete = delete.where(Timeline.user_id == user_id)
+            select = select.where(Follow.follower_id == user_id)
+        db.session.execute(delete)
+        result = db.session.execute(
+            Timeline.__table__.insert().from_select(
+                ["user_id", "post_id", "timestamp"], select
+            )
+        )
+        db.session.commit()
+        return result.rowcount
 
 
 class User(UserMixin, db.Model):
@@ -113,6 +306,11 @@ class User(UserMixin, db.Model):
     role_id = db.Column(db.Integer, db.ForeignKey("roles.id"))
     password_hash = db.Column(db.String(128))
     confirmed = db.Column(db.Boolean, default=False)
+    # API tokens carry the generation they were issued in; bumping it
+    # revokes all tokens of the user
+    token_generation = db.Column(
+        db.Integer, default=0, server_default="0", nullable=False
+    )
     # ---for user profile --------------
     name = db.Column(db.String(64))
     location = db.Column(db.String(64))
@@ -121,6 +319,19 @@ class User(UserMixin, db.Model):
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
     avatar_hash = db.Column(db.String(32))
     default_gravatar = db.Column(db.String(16))
+    # ---denormalized counters ----------
+    post_count = db.Column(
+        db.Integer, default=0, server_default="0", nullable=False
+    )
+    comment_count = db.Column(
+        db.Integer, default=0, server_default="0", nullable=False
+    )
+    follower_count = db.Column(
+        db.Integer, default=0, server_default="0", nullable=False
+    )
+    followed_count = db.Column(
+        db.Integer, default=0, server_default="0", nullable=False
+    )
     # ----------------------------------
     posts = db.relationship("Post", backref="author", lazy="dynamic")
     followed = db.relationship(
@@ -141,27 +352,186 @@ class User(UserMixin, db.Model):
 
     @staticmethod
     def add_self_follows():
-        for user in User.query.all():
-            if not user.is_following(user):
-                user.follow(user)
-                db.session.add(user)
-                db.session.commit()
+        """Make every user follow themselves, see :mod:`app.backfill`.
+
+        Returns the number of follows added.
+        """
+        # app.backfill imports this module
+        from .backfill import SELF_FOLLOWS
+
+        return SELF_FOLLOWS.run()
 
     @staticmethod
     def add_default_gravatar():
-        for user in User.query.all():
-            if user.default_gravatar is None:
-                user.default_gravatar = current_app.config["DEFAULT_GRAVATAR"]
-                db.session.add(user)
-                db.session.commit()
+        """Set the default gravatar of the users without one, see
+        :mod:`app.backfill`. Returns the number of users updated."""
+        from .backfill import DEFAULT_GRAVATAR
+
+        return DEFAULT_GRAVATAR.run()
+
+    @staticmethod
+    def backfill_self_follows(connection, users_range):
+        """Add the missing self follows of the users in ``users_range``.
+
+        The follows are inserted without the ORM, so the counters and the
+        timeline rows that the Follow events maintain are written here, in
+        the same transaction. Returns the number of follows added.
+        """
+        users = User.__table__
+        follows = Follow.__table__
+        posts = Post.__table__
+        timeline = Timeline.__table__
+        missing = db.and_(
+            users_range,
+            ~db.select(follows.c.follower_id)
+            .where(
+                follows.c.follower_id == users.c.id,
+                follows.c.followed_id == users.c.id,
+            )
+            .exists(),
+        )
+        in_timeline = (
+            db.select(timeline.c.post_id)
+            .where(
+                timeline.c.user_id == users.c.id,
+                timeline.c.post_id == posts.c.id,
+            )
+            .exists()
+        )
+        # all three statements select the users without a self follow, so
+        # the follows go in last
+        connection.execute(
+            timeline.insert().from_select(
+                ["user_id", "post_id", "timestamp"],
+                db.select(users.c.id, posts.c.id, posts.c.timestamp)
+                .join(posts, posts.c.author_id == users.c.id)
+                .where(missing, ~in_timeline),
+            )
+        )
+        connection.execute(
+            users.update()
+            .where(missing)
+            .values(
+                follower_count=users.c.follower_count + 1,
+                followed_count=users.c.followed_count + 1,
+            )
+        )
+        return connection.execute(
+            follows.insert().from_select(
+                ["follower_id", "followed_id", "timestamp"],
+                db.select(
+                    users.c.id,
+                    users.c.id,
+                    db.literal(datetime.utcnow(), db.DateTime),
+                ).where(missing),
+            )
+        ).rowcount
+
+    @staticmethod
+    def backfill_default_gravatar(connection, users_range):
+        """Set the default gravatar of the users in ``users_range`` that
+        have none. Returns the number of users updated."""
+        users = User.__table__
+        posts = Post.__table__
+        missing = db.and_(users_range, users.c.default_gravatar.is_(None))
+        # see on_update: the cached fragments of their posts show it
+        connection.execute(
+            posts.update()
+            .where(posts.c.author_id.in_(db.select(users.c.id).where(missing)))
+            .values(version=posts.c.version + 1)
+        )
+        return connection.execute(
+            users.update()
+            .where(missing)
+            .values(default_gravatar=current_app.config["DEFAULT_GRAVATAR"])
+        ).rowcount
+
+    @staticmethod
+    def add_to_counters(connection, user_id, **deltas):
+        """Atomically add ``deltas`` to the counter columns of a user.
+
+        Called from mapper events, so it runs on the flush connection and
+        does not touch the ORM state of the user.
+        """
+        if user_id is None:
+            return
+        users = User.__table__
+        connection.execute(
+            users.update()
+            .where(users.c.id == user_id)
+            .values(
+                {
+                    users.c[name]: users.c[name] + delta
+                    for name, delta in deltas.items()
+                }
+            )
+        )
+
+    @staticmethod
+    def on_update(mapper, connection, target):
+        state = db.inspect(target)
+        # these columns are shown in the cached fragments of the user's posts
+        if any(
+            state.attrs[name].history.has_changes()
+            for name in ("username", "avatar_hash", "default_gravatar")
+        ):
+            Post.bump_versions(connection, target.id)
+
+    @staticmethod
+    def on_before_update(mapper, connection, target):
+        state = db.inspect(target)
+        # API tokens carry the permissions and the confirmed flag, and must
+        # not outlive the password they were obtained with
+        if any(
+            state.attrs[name].history.has_changes()
+            for name in ("role_id", "confirmed", "password_hash")
+        ):
+            target.token_generation = User.token_generation + 1
+
+    @staticmethod
+    def reconcile_counters():
+        """Recompute drifted counters of all users with set-based UPDATEs.
+
+        Returns a dictionary mapping each counter to the number of users
+        whose value was fixed.
+        """
+        users = User.__table__
+        follows = Follow.__table__
+        counts = {
+            "post_count": db.select(db.func.count(Post.__table__.c.id))
+            .where(Post.__table__.c.author_id == users.c.id)
+            .scalar_subquery(),
+            "comment_count": db.select(db.func.count(Comment.__table__.c.id))
+            .where(Comment.__table__.c.author_id == users.c.id)
+            .scalar_subquery(),
+            "follower_count": db.select(db.func.count())
+            .select_from(follows)
+            .where(follows.c.followed_id == users.c.id)
+            .scalar_subquery(),
+            "followed_count": db.select(db.func.count())
+            .select_from(follows)
+            .where(follows.c.follower_id == users.c.id)
+            .scalar_subquery(),
+        }
+        fixed = {}
+        for name, count in counts.items():
+            result = db.session.execute(
+                users.update()
+                .where(users.c[name] != count)
+                .values({users.c[name]: count})
+            )
+            fixed[name] = result.rowcount
+        db.session.commit()
+        return fixed
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        if self.role is None:
+        if self.role is None and self.role_id is None:
+            roles = Role.cache()
             if self.email == current_app.config["ADMIN_EMAIL"]:
-                self.role = Role.query.filter_by(name="Administrator").first()
-            if self.role is None:
-                self.role = Role.query.filter_by(default=True).first()
+                self.role_id = roles["ids"].get("Administrator")
+            if self.role_id is None:
+                self.role_id = roles["default"]
         if self.email is not None and self.avatar_hash is None:
             self.avatar_hash = self.gravatar_hash()
             if self.default_gravatar is None:
@@ -179,10 +549,10 @@ class User(UserMixin, db.Model):
             raise AttributeError(
                 f"Password minimum length should be at least {passwd_min_len} characters"
             )
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hashing.hash_password(password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hashing.check_password(self.password_hash, password)
 
     def generate_confirmation_token(self, expiration=3600):
         s = Serializer(current_app.config["SECRET_KEY"], expiration)
@@ -242,18 +612,22 @@ class User(UserMixin, db.Model):
         db.session.add(self)
         return True
 
+    @property
+    def permissions(self):
+        """Permission bits of the user's role, without loading the role."""
+        # a role that is already loaded or was just assigned wins over
+        # role_id, which is only updated on flush
+        role = self.__dict__.get("role")
+        if role is not None:
+            return role.permissions or 0
+        return Role.cache()["permissions"].get(self.role_id, 0)
+
     def can(self, perm):
-        return self.role is not None and self.role.has_permission(perm)
+        return self.permissions & perm == perm
 
     def is_administrator(self):
         return self.can(Permission.ADMIN)
 
-    # for user profile
-    def ping(self):
-        self.last_seen = datetime.utcnow()
-        db.session.add(self)
-        db.session.commit()
-
     def gravatar_hash(self):
         return hashlib.md5(self.email.lower().encode("utf-8")).hexdigest()
 
@@ -286,9 +660,14 @@ class User(UserMixin, db.Model):
 
     @property
     def followed_posts(self):
-        return Post.query.join(
-            Follow, Follow.followed_id == Post.author_id
-        ).filter(Follow.follower_id == self.id)
+        """Posts of followed users, read from the materialized timeline.
+
+        Order by ``Timeline.timestamp`` to let the database walk the
+        ``(user_id, timestamp)`` index instead of sorting.
+        """
+        return Post.query.join(Timeline, Timeline.post_id == Post.id).filter(
+            Timeline.user_id == self.id
+        )
 
     def to_json(self):
         json_user = {
@@ -300,22 +679,68 @@ class User(UserMixin, db.Model):
             "followed_posts_url": url_for(
                 "api.get_user_followed_posts", id=self.id
             ),
-            "post_count": self.posts.count(),
+            "post_count": self.post_count,
         }
         return json_user
 
     def generate_auth_token(self, expiration):
-        s = Serializer(current_app.config["SECRET_KEY"], expires_in=expiration)
-        return s.dumps({"id": self.id}).decode("utf-8")
+        """A signed token that identifies the user without a query.
+
+        It carries the user id, the permissions of the user's role, the
+        confirmed flag, the token generation and the expiry time.
+        """
+        s = URLSafeSerializer(
+            current_app.config["SECRET_KEY"], salt="auth-token"
+        )
+        return s.dumps(
+            [
+                self.id,
+                self.permissions,
+                bool(self.confirmed),
+                self.token_generation or 0,
+                int(time.time()) + expiration,
+            ]
+        )
 
     @staticmethod
     def verify_auth_token(token):
-        s = Serializer(current_app.config["SECRET_KEY"])
+        s = URLSafeSerializer(
+            current_app.config["SECRET_KEY"], salt="auth-token"
+        )
         try:
-            data = s.loads(token)
+            id, permissions, confirmed, generation, expires = s.loads(token)
         except:
             return None
-        return User.query.get(data["id"])
+        if expires < time.time():
+            return None
+        current = User.current_token_generation(id, newer_than=generation)
+        if current != generation:
+            return None
+        return TokenUser(id, permissions, confirmed)
+
+    @staticmethod
+    def current_token_generation(id, newer_than=None):
+        """The token generation of a user, cached for a few seconds.
+
+        Revoked tokens are accepted until the cached value expires, after
+        ``TOKEN_GENERATION_TTL`` seconds. A cached value older than
+        ``newer_than`` is looked up again, so new tokens work at once.
+        """
+        cache = current_app.extensions.get("token_generations")
+        if cache is None:
+            cache = current_app.extensions["token_generations"] = LRUBackend(
+                maxsize=10000, ttl=current_app.config["TOKEN_GENERATION_TTL"]
+            )
+        generation = cache.get(id)
+        if generation is None or (
+            newer_than is not None and generation < newer_than
+        ):
+            generation = db.session.scalar(
+                db.select(User.token_generation).where(User.id == id)
+            )
+            if generation is not None:
+                cache.set(id, generation)
+        return generation
 
     def __repr__(self):
         return f"<User {self.username}>"
@@ -332,6 +757,24 @@ class AnonymousUser(AnonymousUserMixin):
 login_manager.anonymous_user = AnonymousUser
 
 
+class TokenUser:
+    """The user behind a verified API token, known without loading it."""
+
+    is_anonymous = False
+    is_authenticated = True
+
+    def __init__(self, id, permissions, confirmed):
+        self.id = id
+        self.permissions = permissions
+        self.confirmed = confirmed
+
+    def can(self, perm):
+        return self.permissions & perm == perm
+
+    def is_administrator(self):
+        return self.can(Permission.ADMIN)
+
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -349,37 +792,96 @@ class Post(db.Model):
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    comment_count = db.Column(
+        db.Integer, default=0, server_default="0", nullable=False
+    )
+    # bumped whenever the rendered post item changes; part of the key of
+    # its cached HTML fragment
+    version = db.Column(
+        db.Integer, default=1, server_default="1", nullable=False
+    )
     comments = db.relationship("Comment", backref="post", lazy="dynamic")
+    # the posts of a user, newest first
+    __table_args__ = (
+        db.Index("ix_posts_author_id_timestamp", "author_id", "timestamp"),
+    )
 
     @staticmethod
-    def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = [
-            "a",
-            "abbr",
-            "acronym",
-            "b",
-            "blockquote",
-            "code",
-            "em",
-            "i",
-            "li",
-            "ol",
-            "pre",
-            "strong",
-            "ul",
-            "h1",
-            "h2",
-            "h3",
-            "p",
-        ]
-        target.body_html = bleach.linkify(
-            bleach.clean(
-                markdown(value, output_format="html"),
-                tags=allowed_tags,
-                strip=True,
+    def with_authors(query):
+        """Eager-load the author of every listed post."""
+        return query.options(joinedload(Post.author))
+
+    @staticmethod
+    def on_insert(mapper, connection, target):
+        User.add_to_counters(connection, target.author_id, post_count=1)
+
+    @staticmethod
+    def on_delete(mapper, connection, target):
+        User.add_to_counters(connection, target.author_id, post_count=-1)
+
+    @staticmethod
+    def on_update(mapper, connection, target):
+        if db.inspect(target).attrs.body.history.has_changes():
+            # incremented in SQL so concurrent bumps are not lost
+            target.version = Post.version + 1
+
+    @staticmethod
+    def current_version(id):
+        """The version of a post, or None if there is no such post."""
+        return db.session.scalar(db.select(Post.version).where(Post.id == id))
+
+    @staticmethod
+    def bump_versions(connection, author_id):
+        """Invalidate the cached fragments of all posts of an author."""
+        posts = Post.__table__
+        connection.execute(
+            posts.update()
+            .where(posts.c.author_id == author_id)
+            .values(version=posts.c.version + 1)
+        )
+
+    @staticmethod
+    def add_to_counters(connection, post_id, **deltas):
+        """Atomically add ``deltas`` to the counter columns of a post."""
+        if post_id is None:
+            return
+        posts = Post.__table__
+        connection.execute(
+            posts.update()
+            .where(posts.c.id == post_id)
+            .values(
+                {
+                    posts.c[name]: posts.c[name] + delta
+                    for name, delta in deltas.items()
+                }
             )
         )
 
+    @staticmethod
+    def reconcile_counters():
+        """Recompute drifted comment counters of all posts.
+
+        Returns a dictionary mapping the counter to the number of posts
+        whose value was fixed.
+        """
+        posts = Post.__table__
+        count = (
+            db.select(db.func.count(Comment.__table__.c.id))
+            .where(Comment.__table__.c.post_id == posts.c.id)
+            .scalar_subquery()
+        )
+        result = db.session.execute(
+            posts.update()
+            .where(posts.c.comment_count != count)
+            .values(comment_count=count)
+        )
+        db.session.commit()
+        return {"comment_count": result.rowcount}
+
+    @staticmethod
+    def on_changed_body(target, value, oldvalue, initiator):
+        target.body_html = renderer.render("post", value)
+
     def to_json(self):
         json_post = {
             "url": url_for("api.get_post", id=self.id),
@@ -388,7 +890,7 @@ class Post(db.Model):
             "timestamp": self.timestamp,
             "author_url": url_for("api.get_user", id=self.author_id),
             "comments_url": url_for("api.get_post_comments", id=self.id),
-            "comment_count": self.comments.count(),
+            "comment_count": self.comment_count,
         }
         return json_post
 
@@ -401,6 +903,9 @@ class Post(db.Model):
 
 
 db.event.listen(Post.body, "set", Post.on_changed_body)
+db.event.listen(Post, "after_insert", Post.on_insert)
+db.event.listen(Post, "after_delete", Post.on_delete)
+db.event.listen(Post, "before_update", Post.on_update)
 
 
 class Comment(db.Model):
@@ -417,27 +922,35 @@ class Comment(db.Model):
     disabled = db.Column(db.Boolean)
     author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
     post_id = db.Column(db.Integer, db.ForeignKey("posts.id"))
+    # the comments of a post in order, and the comments of a user
+    __table_args__ = (
+        db.Index("ix_comments_post_id_timestamp", "post_id", "timestamp"),
+        db.Index("ix_comments_author_id_timestamp", "author_id", "timestamp"),
+    )
 
     @staticmethod
-    def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = [
-            "a",
-            "abbr",
-            "acronym",
-            "b",
-            "code",
-            "em",
-            "i",
-            "strong",
-        ]
-        target.body_html = bleach.linkify(
-            bleach.clean(
-                markdown(value, output_format="html"),
-                tags=allowed_tags,
-                strip=True,
-            )
+    def with_authors(query):
+        """Eager-load the author of every listed comment."""
+        return query.options(joinedload(Comment.author))
+
+    @staticmethod
+    def on_insert(mapper, connection, target):
+        User.add_to_counters(connection, target.author_id, comment_count=1)
+        Post.add_to_counters(
+            connection, target.post_id, comment_count=1, version=1
         )
 
+    @staticmethod
+    def on_delete(mapper, connection, target):
+        User.add_to_counters(connection, target.author_id, comment_count=-1)
+        Post.add_to_counters(
+            connection, target.post_id, comment_count=-1, version=1
+        )
+
+    @staticmethod
+    def on_changed_body(target, value, oldvalue, initiator):
+        target.body_html = renderer.render("comment", value)
+
     def to_json(self):
         json_comment = {
             "url": url_for("api.get_comment", id=self.id),
@@ -458,3 +971,64 @@ class Comment(db.Model):
 
 
 db.event.listen(Comment.body, "set", Comment.on_changed_body)
+db.event.listen(Comment, "after_insert", Comment.on_insert)
+db.event.listen(Comment, "after_delete", Comment.on_delete)
+db.event.listen(User, "before_update", User.on_before_update)
+db.event.listen(User, "after_update", User.on_update)
+db.event.listen(Role, "before_update", Role.on_update)
+db.event.listen(Role, "after_insert", Role.clear_cache)
+db.event.listen(Role, "after_update", Role.clear_cache)
+db.event.listen(Role, "after_delete", Role.clear_cache)
+db.event.listen(Follow, "after_insert", Follow.on_insert)
+db.event.listen(Follow, "after_delete", Follow.on_delete)
+db.event.listen(Session, "after_flush", Timeline.on_after_flush)
+
+
+class Outbox(db.Model):
+    """An email waiting to be delivered by the mail worker.
+
+    Messages are persisted before sending so that nothing is lost when a
+    worker restarts. A message is due when ``next_attempt_at`` has passed;
+    claiming it pushes ``next_attempt_at`` forward, which also keeps other
+    workers away from it while it is being sent.
+    """
+
+    __tablename__ = "outbox"
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(128))
+    recipients = db.Column(db.Text)
+    subject = db.Column(db.String(256))
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    __table_args__ = (
+        db.Index(
+            "ix_outbox_sent_at_next_attempt_at", "sent_at", "next_attempt_at"
+        ),
+    )
+
+    def __repr__(self):
+        return f"<Outbox {self.id} {self.subject!r}>"
+
+
+class BackfillProgress(db.Model):
+    """How far a chunked backfill of :mod:`app.backfill` has got.
+
+    ``last_id`` is the last primary key of the walked table whose chunk has
+    been committed; a backfill that is run again resumes after it.
+    """
+
+    __tablename__ = "backfills"
+    name = db.Column(db.String(64), primary_key=True)
+    last_id = db.Column(db.Integer)
+    rows = db.Column(db.Integer, default=0, nullable=False)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"<BackfillProgress {self.name} {self.last_id}>"
@@ -0,0 +1,113 @@
+"""Full-page cache of the public pages as seen by anonymous visitors.
+
+Anonymous visitors all see the same page for a URL, so a rendered ``GET``
+response is stored under its path and query string for the number of
+seconds ``PAGE_CACHE_TTLS`` gives for its endpoint. A view opts in with the
+:meth:`PageCache.cached` decorator.
+
+Responses carry a strong ``ETag`` (a hash of the body) and a
+``Last-Modified`` date, the newest timestamp of the data on the page. A
+conditional request that matches a cached entry gets a 304 without running
+the view at all. Requests of logged-in users, responses that set cookies,
+and pages with pending flashed messages are never cached.
+"""
+
+import hashlib
+import json
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+
+from .cache import make_backend
+
+
+class PageCache:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["page_cache"] = make_backend(
+            app.config["PAGE_CACHE_BACKEND"],
+            size=app.config["PAGE_CACHE_SIZE"],
+            directory=app.config["PAGE_CACHE_DIR"],
+        )
+
+    @property
+    def backend(self):
+        return current_app.extensions["page_cache"]
+
+    @staticmethod
+    def cacheable_request():
+        return (
+            request.method in ("GET", "HEAD")
+            and request.endpoint in current_app.config["PAGE_CACHE_TTLS"]
+            and not current_user.is_authenticated
+            and "_flashes" not in session
+        )
+
+    @staticmethod
+    def cacheable_response(response):
+        return (
+            response.status_code == 200
+            and not session.modified
+            and "Set-Cookie" not in response.headers
+        )
+
+    @staticmethod
+    def build_response(entry):
+        response = current_app.response_class(
+            entry["body"], mimetype=entry["mimetype"]
+        )
+        response.set_etag(entry["etag"])
+        if entry["last_modified"] is not None:
+            response.last_modified = datetime.fromisoformat(
+                entry["last_modified"]
+            )
+        response.cache_control.max_age = 0
+        response.cache_control.must_revalidate = True
+        # logged-in users get a different page for the same URL
+        response.vary.add("Cookie")
+        return response.make_conditional(request)
+
+    def cached(self, last_modified=None):
+        """Serve the decorated view from the cache for anonymous visitors.
+
+        :param last_modified: optional function called with the view
+        arguments, returning the newest timestamp shown on the page.
+        """
+
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if not self.cacheable_request():
+                    return f(*args, **kwargs)
+                key = "page:" + request.full_path
+                entry = self.backend.get(key)
+                if entry is not None:
+                    return self.build_response(json.loads(entry))
+                response = make_response(f(*args, **kwargs))
+                if not self.cacheable_response(response):
+                    return response
+                body = response.get_data()
+                stamp = last_modified(**kwargs) if last_modified else None
+                entry = {
+                    "body": body.decode("utf-8"),
+                    "mimetype": response.mimetype,
+                    "etag": hashlib.sha1(body).hexdigest(),
+                    "last_modified": stamp and stamp.isoformat(),
+                }
+                self.backend.set(
+                    key,
+                    json.dumps(entry),
+                    ttl=current_app.config["PAGE_CACHE_TTLS"][
+                        request.endpoint
+                    ],
+                )
+                return self.build_response(entry)
+
+            return decorated_function
+
+        return decorator
@@ -0,0 +1,135 @@
+"""Keyset (cursor) pagination.
+
+Offset pagination makes the database walk and discard every row before the
+requested page and also runs a ``COUNT(*)``, so deep pages get slower the
+deeper they are. Keyset pagination instead remembers the sort key of the
+last row shown and asks for the rows that sort after it, which is a single
+index range scan no matter how deep the page is.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from flask import abort, url_for
+
+from . import db
+from .exceptions import ValidationError
+
+
+def encode_cursor(key, direction):
+    """Pack a ``(timestamp, id)`` sort key into an opaque URL-safe token."""
+    timestamp, id = key
+    data = json.dumps([timestamp.isoformat(), id, direction])
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor.encode("ascii"))
+        timestamp, id, direction = json.loads(data)
+        timestamp = datetime.fromisoformat(timestamp)
+    except (ValueError, TypeError, UnicodeError):
+        raise ValidationError("invalid cursor")
+    if direction not in ("next", "prev") or not isinstance(id, int):
+        raise ValidationError("invalid cursor")
+    return (timestamp, id), direction
+
+
+class KeysetPagination:
+    """One page of a query ordered by a ``(timestamp, id)`` pair of columns.
+
+    :param query: the query to paginate, without an ORDER BY.
+    :param order: the ``(timestamp, id)`` columns to order and seek by.
+    :param cursor: an opaque cursor from a previous page, or None for the
+    first page.
+    :param descending: newest rows first when True.
+    :param key: a function returning the ``(timestamp, id)`` key of an item;
+    by default the attributes named like the ``order`` columns are used.
+    """
+
+    keyset = True
+
+    def __init__(
+        self,
+        query,
+        order,
+        cursor=None,
+        per_page=20,
+        descending=True,
+        key=None,
+    ):
+        self.per_page = per_page
+        self.cursor = cursor
+        self.descending = descending
+        timestamp_col, id_col = order
+        if key is None:
+
+            def key(item):
+                return (
+                    getattr(item, timestamp_col.key),
+                    getattr(item, id_col.key),
+                )
+
+        direction = "next"
+        if cursor is not None:
+            (timestamp, id), direction = decode_cursor(cursor)
+            # going back a page is the same seek in the opposite order
+            after = descending == (direction == "next")
+            if after:
+                seek = db.or_(
+                    timestamp_col < timestamp,
+                    db.and_(timestamp_col == timestamp, id_col < id),
+                )
+            else:
+                seek = db.or_(
+                    timestamp_col > timestamp,
+                    db.and_(timestamp_col == timestamp, id_col > id),
+                )
+            query = query.filter(seek)
+        reverse = descending != (direction == "prev")
+        if reverse:
+            query = query.order_by(timestamp_col.desc(), id_col.desc())
+        else:
+            query = query.order_by(timestamp_col.asc(), id_col.asc())
+        items = query.limit(per_page + 1).all()
+        more = len(items) > per_page
+        items = items[:per_page]
+        if direction == "prev":
+            items.reverse()
+            self.has_prev = more
+            self.has_next = True
+        else:
+            self.has_next = more
+            self.has_prev = cursor is not None
+        self.items = items
+        self.next_cursor = None
+        self.prev_cursor = None
+        if items and self.has_next:
+            self.next_cursor = encode_cursor(key(items[-1]), "next")
+        if items and self.has_prev:
+            self.prev_cursor = encode_cursor(key(items[0]), "prev")
+
+    def prev_url(self, endpoint, **values):
+        if self.prev_cursor is None:
+            return None
+        return url_for(endpoint, cursor=self.prev_cursor, **values)
+
+    def next_url(self, endpoint, **values):
+        if self.next_cursor is None:
+            return None
+        return url_for(endpoint, cursor=self.next_cursor, **values)
+
+
+def keyset_paginate(query, order, cursor=None, error_out=True, **kwargs):
+    """Return a :class:`KeysetPagination` for ``query``.
+
+    Like Flask-SQLAlchemy's ``paginate()``, an invalid cursor aborts with a
+    404 if ``error_out`` is True, otherwise ``ValidationError`` is raised.
+    """
+    try:
+        return KeysetPagination(query, order, cursor=cursor, **kwargs)
+    except ValidationError:
+        if error_out:
+            abort(404)
+        raise
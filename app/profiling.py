@@ -0,0 +1,243 @@
+"""Sampling profiler of the requests, and export of its profiles.
+
+``flask profile`` runs the development server either under Werkzeug's
+:class:`~werkzeug.middleware.profiler.ProfilerMiddleware`, which runs
+every request under cProfile, or with the sampling profiler below.
+
+The sampling profiler is cheap enough to leave on in production
+(``PROFILER_ENABLED``). The requests themselves run untouched; a
+background thread of each worker looks at the stacks of the threads that
+are serving a request every ``PROFILER_INTERVAL`` seconds and counts them
+per endpoint. With ``PROFILER_DIR`` set, each worker writes its counts
+there every ``PROFILER_FLUSH_INTERVAL`` seconds and when it exits, in the
+collapsed-stack format, one ``endpoint;frame;...;frame count`` line per
+stack, as read by flamegraph.pl and speedscope. ``flask profile-export``
+merges the files of all workers into one collapsed-stack or speedscope
+file.
+"""
+
+import atexit
+import glob
+import os
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from collections import Counter
+
+from flask import request
+
+MAX_DEPTH = 128
+
+# states of the live apps of this process, flushed once when it exits
+_states = weakref.WeakSet()
+
+
+class _ProfilerState:
+    def __init__(self, app):
+        self.configure(app.config)
+        self.lock = threading.Lock()
+        # thread ident: endpoint, of the threads serving a request
+        self.active = {}
+        # endpoint: Counter of stacks, outermost frame first
+        self.stacks = {}
+        self.names = {}
+        self.thread = None
+        self.pid = None
+        self.stopping = threading.Event()
+
+    def configure(self, config):
+        self.interval = config["PROFILER_INTERVAL"]
+        self.directory = config["PROFILER_DIR"]
+        self.flush_interval = config["PROFILER_FLUSH_INTERVAL"]
+
+    def start(self):
+        # started on first use, and again in each forked worker process
+        with self.lock:
+            if self.thread is not None and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            # a forked worker must not report its parent's samples again
+            self.active = {}
+            self.stacks = {}
+            self.stopping.clear()
+            self.thread = threading.Thread(
+                target=self.run, name="sampling-profiler", daemon=True
+            )
+            self.thread.start()
+
+    def stop(self):
+        thread = self.thread
+        if thread is None or self.pid != os.getpid():
+            return
+        self.stopping.set()
+        thread.join()
+        self.thread = None
+        if self.directory:
+            self.flush()
+
+    def frame_name(self, code):
+        name = self.names.get(code)
+        if name is None:
+            path = code.co_filename
+            for prefix in sys.path:
+                if prefix and path.startswith(prefix + os.sep):
+                    path = path[len(prefix) + 1 :]
+                    break
+            name = self.names[code] = "{} ({}:{})".format(
+                getattr(code, "co_qualname", code.co_name),
+                path,
+                code.co_firstlineno,
+            ).replace(";", ":")
+        return name
+
+    def stack(self, frame):
+        names = []
+        while frame is not None and len(names) < MAX_DEPTH:
+            names.append(self.frame_name(frame.f_code))
+            frame = frame.f_back
+        return tuple(reversed(names))
+
+    def sample(self):
+        frames = sys._current_frames()
+        with self.lock:
+            active = list(self.active.items())
+        stacks = [
+            (endpoint, self.stack(frames[ident]))
+            for ident, endpoint in active
+            if ident in frames
+        ]
+        del frames
+        with self.lock:
+            for endpoint, stack in stacks:
+                self.stacks.setdefault(endpoint, Counter())[stack] += 1
+
+    def run(self):
+        flushed_at = time.monotonic()
+        while not self.stopping.wait(self.interval):
+            self.sample()
+            if (
+                self.directory
+                and time.monotonic() - flushed_at >= self.flush_interval
+            ):
+                self.flush()
+                flushed_at = time.monotonic()
+
+    def flush(self):
+        """Write the counts of this process to ``PROFILER_DIR``."""
+        with self.lock:
+            text = collapsed(self.stacks)
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(
+            tmp,
+            os.path.join(self.directory, f"profile-{os.getpid()}.collapsed"),
+        )
+
+
+class SamplingProfiler:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config["PROFILER_ENABLED"]:
+            return
+        if "profiler" in app.extensions:
+            # e.g. flask profile --sampling when PROFILER_ENABLED is set
+            app.extensions["profiler"].configure(app.config)
+            return
+        state = app.extensions["profiler"] = _ProfilerState(app)
+        _states.add(state)
+
+        @app.before_request
+        def before_request():
+            state.start()
+            with state.lock:
+                state.active[threading.get_ident()] = (
+                    request.endpoint or "none"
+                )
+
+        @app.teardown_request
+        def teardown_request(exc):
+            with state.lock:
+                state.active.pop(threading.get_ident(), None)
+
+
+@atexit.register
+def _stop_all():
+    # a recycled gunicorn worker would lose its samples since the last flush
+    for state in list(_states):
+        state.stop()
+
+
+def collapsed(stacks):
+    """The collapsed-stack text of ``stacks``, rooted at the endpoints."""
+    return "".join(
+        "{} {}\n".format(";".join((endpoint,) + stack), count)
+        for endpoint in sorted(stacks)
+        for stack, count in sorted(stacks[endpoint].items())
+    )
+
+
+def read_collapsed(lines, stacks=None):
+    """Add the counts of collapsed-stack ``lines`` to ``stacks``."""
+    stacks = {} if stacks is None else stacks
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        path, count = line.rsplit(" ", 1)
+        endpoint, *stack = path.split(";")
+        stacks.setdefault(endpoint, Counter())[tuple(stack)] += int(count)
+    return stacks
+
+
+def read_directory(directory):
+    """The merged counts of the files of all workers in ``directory``."""
+    stacks = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.collapsed"))):
+        with open(path) as f:
+            read_collapsed(f, stacks)
+    return stacks
+
+
+def speedscope(stacks, interval, name="webuzz"):
+    """A speedscope file of ``stacks``, one sampled profile per endpoint.
+
+    :param interval: seconds between samples, the weight of a sample.
+    """
+    frames = []
+    index = {}
+    profiles = []
+    for endpoint in sorted(stacks):
+        samples = []
+        weights = []
+        for stack, count in sorted(stacks[endpoint].items()):
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({"name": frame})
+            samples.append([index[frame] for frame in stack])
+            weights.append(count * interval)
+        profiles.append(
+            {
+                "type": "sampled",
+                "name": endpoint,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }
+        )
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "webuzz",
+        "shared": {"frames": frames},
+        "profiles": profiles,
+    }
@@ -0,0 +1,156 @@
+"""Markdown to sanitized HTML rendering for post and comment bodies.
+
+Building a Markdown converter, a bleach Cleaner and a Linker is several
+times more expensive than running them on a short body, so they are built
+once per thread and reused. Rendered HTML is cached under a hash of the tag
+policy and the body, in a bounded in-memory LRU and optionally in a
+directory shared by all workers, so identical or re-saved bodies are not
+rendered again.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+
+from bleach.linkifier import Linker
+from bleach.sanitizer import Cleaner
+from markdown import Markdown
+
+from .cache import LRUBackend
+
+# HTML tags allowed to survive sanitizing, per kind of body
+POLICIES = {
+    "post": [
+        "a",
+        "abbr",
+        "acronym",
+        "b",
+        "blockquote",
+        "code",
+        "em",
+        "i",
+        "li",
+        "ol",
+        "pre",
+        "strong",
+        "ul",
+        "h1",
+        "h2",
+        "h3",
+        "p",
+    ],
+    "comment": [
+        "a",
+        "abbr",
+        "acronym",
+        "b",
+        "code",
+        "em",
+        "i",
+        "strong",
+    ],
+}
+
+
+def render_uncached(policy, body):
+    """Render ``body`` the way the models used to, with fresh objects.
+
+    Kept as the reference implementation for the benchmark and for worker
+    processes that have no use for a cache.
+    """
+    from bleach import clean, linkify
+    from markdown import markdown
+
+    return linkify(
+        clean(
+            markdown(body, output_format="html"),
+            tags=POLICIES[policy],
+            strip=True,
+        )
+    )
+
+
+class RenderingEngine:
+    """Render bodies through reusable per-thread converters and a cache."""
+
+    def __init__(self, app=None):
+        self.local = threading.local()
+        self.cache = LRUBackend()
+        self.directory = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cache.maxsize = app.config["RENDER_CACHE_SIZE"]
+        self.directory = app.config["RENDER_CACHE_DIR"]
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _converters(self):
+        converters = getattr(self.local, "converters", None)
+        if converters is None:
+            converters = {
+                "markdown": Markdown(output_format="html"),
+                "linker": Linker(),
+            }
+            for policy, tags in POLICIES.items():
+                converters[policy] = Cleaner(tags=tags, strip=True)
+            self.local.converters = converters
+        return converters
+
+    @staticmethod
+    def cache_key(policy, body):
+        """Hash of the tag policy and the body; equal keys render alike."""
+        digest = hashlib.sha256()
+        digest.update(" ".join(POLICIES[policy]).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(body.encode("utf-8"))
+        return digest.hexdigest()
+
+    def render_fresh(self, policy, body):
+        """Render ``body`` without looking at or filling the cache."""
+        converters = self._converters()
+        html = converters["markdown"].reset().convert(body)
+        return converters["linker"].linkify(converters[policy].clean(html))
+
+    def render(self, policy, body):
+        if body is None:
+            return None
+        key = self.cache_key(policy, body)
+        html = self.cache.get(key)
+        if html is not None:
+            return html
+        html = self._read(key)
+        if html is None:
+            html = self.render_fresh(policy, body)
+            self._write(key, html)
+        self.cache.set(key, html)
+        return html
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".html")
+
+    def _read(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write(self, key, html):
+        if not self.directory:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write to a temporary file first so readers in other workers
+            # never see a partial file
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(html)
+            os.replace(tmp, path)
+        except OSError:
+            pass
@@ -0,0 +1,147 @@
+"""Bulk re-rendering of the body_html column of posts and comments.
+
+After the allowed tags in :data:`app.rendering.POLICIES` change, every
+stored ``body_html`` is stale. Rows are streamed in id order in chunks,
+rendered in a process pool and written back with one batched UPDATE per
+chunk. The last id written is saved to a checkpoint file after every chunk,
+so an interrupted run can be resumed; the table's entry is removed when it
+is done, so the next run starts from the first row again.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import bindparam
+
+from . import db
+from .models import Comment, Post
+from .rendering import RenderingEngine
+
+MODELS = {"posts": (Post, "post"), "comments": (Comment, "comment")}
+
+_engine = None
+
+
+def render_chunk(policy, rows):
+    """Render ``(id, body)`` rows; runs in a worker process."""
+    global _engine
+    if _engine is None:
+        _engine = RenderingEngine()
+    return [
+        {"_id": id, "_html": _engine.render_fresh(policy, body or "")}
+        for id, body in rows
+    ]
+
+
+def read_checkpoint(path, table):
+    if path is None or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f).get(table, 0)
+
+
+def write_checkpoint(path, table, last_id):
+    if path is None:
+        return
+    data = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+    data[table] = last_id
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+def clear_checkpoint(path, table):
+    if path is None or not os.path.exists(path):
+        return
+    with open(path) as f:
+        data = json.load(f)
+    data.pop(table, None)
+    if not data:
+        os.remove(path)
+        return
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+def chunks(model, start_id, chunk_size):
+    """Yield lists of ``(id, body)`` with ids above ``start_id``, in order.
+
+    Each chunk seeks past the last id of the previous one, so reading the
+    table is a series of primary key range scans rather than OFFSETs.
+    """
+    last_id = start_id
+    while True:
+        rows = db.session.execute(
+            db.select(model.id, model.body)
+            .where(model.id > last_id)
+            .order_by(model.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield [tuple(row) for row in rows]
+
+
+def rerender(
+    table,
+    chunk_size=500,
+    workers=None,
+    start_id=None,
+    checkpoint=None,
+    log=print,
+):
+    """Re-render ``body_html`` of ``table`` ("posts" or "comments").
+
+    Returns the number of rows written.
+    """
+    model, policy = MODELS[table]
+    if start_id is None:
+        start_id = read_checkpoint(checkpoint, table)
+    values = {"body_html": bindparam("_html")}
+    if "version" in model.__table__.c:
+        # retire cached fragments and ETags of the re-rendered rows
+        values["version"] = model.__table__.c.version + 1
+    update = (
+        model.__table__.update()
+        .where(model.__table__.c.id == bindparam("_id"))
+        .values(values)
+    )
+    total = 0
+    started = time.perf_counter()
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        source = chunks(model, start_id, chunk_size)
+        while True:
+            # keep every worker busy without reading the whole table ahead
+            while len(pending) < 2 * workers:
+                rows = next(source, None)
+                if rows is None:
+                    break
+                pending.append(
+                    (rows[-1][0], pool.submit(render_chunk, policy, rows))
+                )
+            if not pending:
+                break
+            # write in submission order so the checkpoint only moves forward
+            last_id, future = pending.pop(0)
+            results = future.result()
+            db.session.execute(update, results)
+            db.session.commit()
+            write_checkpoint(checkpoint, table, last_id)
+            total += len(results)
+            elapsed = time.perf_counter() - started
+            log(
+                f"{table}: {total} rows up to id {last_id}, "
+                f"{total / elapsed:.0f} rows/s"
+            )
+    clear_checkpoint(checkpoint, table)
+    log(f"{table}: done, {total} rows re-rendered.")
+    return total
@@ -0,0 +1,6 @@
+"""Performance benchmarks for WeBuzz.
+
+Each module can be run on its own, e.g. `python -m benchmarks.rendering`.
+The load test (`benchmarks.load`) runs against a database seeded by
+`benchmarks.dataset`; its JSON baselines are kept in `benchmarks/baselines`.
+"""
@@ -0,0 +1,56 @@
+"""Seed a database with a large synthetic dataset for the load test.
+
+Creates a new SQLite database with the production configuration and fills
+it with :func:`app.fake.generate`: power-law follows, posts and comment
+threads, inserted in large batches, then the timeline and the counters
+rebuilt. Every user has the password "password". The same ``--seed``
+always gives the same data.
+
+The timeline gets one row per follower of each post, so the large scale
+makes a timeline of tens of millions of rows.
+
+Scales (users / follows / posts / comments):
+    small       1,000 /    20,000 /    10,000 /    20,000
+    medium     10,000 /   500,000 /   200,000 /   400,000
+    large     100,000 / 5,000,000 / 2,000,000 / 4,000,000
+
+Usage:
+    python -m benchmarks.dataset data-bench.sqlite [--scale small] [--seed 0]
+"""
+
+import argparse
+import os
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("database", help="SQLite file to create")
+    parser.add_argument(
+        "--scale", choices=["small", "medium", "large"], default="small"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        parser.error(f"{args.database} exists already")
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.abspath(args.database)
+    from app import create_app, db, fake
+
+    def log(name, rows, seconds):
+        print(f"{name:<10} {rows:>10} rows {seconds:8.1f}s")
+
+    app = create_app("production")
+    with app.app_context():
+        db.create_all()
+        fake.generate(
+            **fake.SCALES[args.scale],
+            seed=args.seed,
+            batch_size=args.batch_size,
+            log=log,
+        )
+    app.extensions["hashing"].shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,547 @@
+"""Load test of a realistic mix of page and API requests.
+
+Client threads replay a weighted mix of requests of the main and api
+blueprints, as anonymous visitors, logged-in users and API clients,
+against a database seeded by :mod:`benchmarks.dataset`. The application
+runs with the production configuration, either in this process behind the
+Flask test client (``--target client``) or as gunicorn workers queried over
+HTTP (``--target gunicorn``). Reported per entry of the mix are the
+requests per second, the p50/p95/p99 latency and the SQL statements per
+request of its endpoint; the latter come from the query instrumentation,
+read from ``/metrics`` for gunicorn (whose workers then write their totals
+after every request).
+
+The mix writes new posts, so a run is only comparable with a baseline
+taken on a freshly seeded database of the same scale and seed.
+
+Results are saved as JSON baselines under ``benchmarks/baselines``, so that
+a regression shows up in the diff of a baseline, and ``--compare`` checks a
+run against one.
+
+Usage:
+    python -m benchmarks.dataset data-bench.sqlite --scale small
+    python -m benchmarks.load data-bench.sqlite [--target client]
+        [--clients 8] [--requests 2000] [--save BASELINE.json]
+        [--compare BASELINE.json] [--tolerance 0.2]
+"""
+
+import argparse
+import base64
+import http.cookiejar
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+class Entry:
+    """A kind of request of the mix.
+
+    :param name: label of the results.
+    :param endpoint: Flask endpoint serving it, to count its queries.
+    :param weight: relative frequency in the mix.
+    :param kind: ``"anonymous"``, ``"user"`` (logged in through the login
+    form) or ``"api"`` (Basic auth).
+    :param request: function of a random generator and the :class:`Dataset`,
+    returning the method, the URL and the form data of a request.
+    """
+
+    def __init__(self, name, endpoint, weight, kind, request):
+        self.name = name
+        self.endpoint = endpoint
+        self.weight = weight
+        self.kind = kind
+        self.request = request
+
+
+def _get(url):
+    return lambda rnd, dataset: ("GET", url(rnd, dataset), None)
+
+
+def _username(rnd, dataset):
+    return rnd.choice(dataset.users)[1]
+
+
+def _user_id(rnd, dataset):
+    return rnd.choice(dataset.users)[0]
+
+
+def _post_id(rnd, dataset):
+    return rnd.randint(1, dataset.last_post_id)
+
+
+MIX = [
+    Entry(
+        "index, anonymous",
+        "main.index",
+        20,
+        "anonymous",
+        _get(lambda rnd, dataset: "/"),
+    ),
+    Entry(
+        "index, followed",
+        "main.index",
+        15,
+        "user",
+        _get(lambda rnd, dataset: "/"),
+    ),
+    Entry(
+        "user",
+        "main.user",
+        15,
+        "anonymous",
+        _get(lambda rnd, dataset: f"/user/{_username(rnd, dataset)}"),
+    ),
+    Entry(
+        "post",
+        "main.post",
+        15,
+        "user",
+        _get(lambda rnd, dataset: f"/post/{_post_id(rnd, dataset)}"),
+    ),
+    Entry(
+        "followers",
+        "main.followers",
+        5,
+        "anonymous",
+        _get(lambda rnd, dataset: f"/followers/{_username(rnd, dataset)}"),
+    ),
+    Entry(
+        "new post",
+        "main.index",
+        3,
+        "user",
+        lambda rnd, dataset: (
+            "POST",
+            "/",
+            {"body": f"A new post {rnd.random()}"},
+        ),
+    ),
+    Entry(
+        "api posts",
+        "api.get_posts",
+        10,
+        "api",
+        _get(lambda rnd, dataset: "/api/v1/posts/"),
+    ),
+    Entry(
+        "api post",
+        "api.get_post",
+        10,
+        "api",
+        _get(lambda rnd, dataset: f"/api/v1/posts/{_post_id(rnd, dataset)}"),
+    ),
+    Entry(
+        "api timeline",
+        "api.get_user_followed_posts",
+        7,
+        "api",
+        _get(
+            lambda rnd, dataset: f"/api/v1/users/{_user_id(rnd, dataset)}/timeline/"
+        ),
+    ),
+]
+
+
+class ClientTarget:
+    """The application in this process, behind the Flask test client."""
+
+    def __init__(self, database):
+        os.environ["DATABASE_URL"] = "sqlite:///" + database
+        from app import create_app
+
+        self.app = create_app("production")
+
+    def session(self):
+        return self.app.test_client()
+
+    def request(self, session, method, url, data=None, headers=None):
+        response = session.open(url, method=method, data=data, headers=headers)
+        return response.status_code, response.get_data(as_text=True)
+
+    def query_counts(self):
+        from app.instrumentation import QueryInstrumentation
+
+        with self.app.app_context():
+            stats = QueryInstrumentation.stats()
+        return {
+            endpoint: (s["requests"], s["queries"])
+            for endpoint, s in stats.items()
+        }
+
+    def close(self):
+        self.app.extensions["hashing"].shutdown()
+
+
+class _NoRedirects(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class GunicornTarget:
+    """gunicorn workers serving the application over HTTP."""
+
+    def __init__(self, database, workers, port):
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.metrics_dir = tempfile.mkdtemp()
+        env = dict(
+            os.environ,
+            FLASK_CONFIG="production",
+            DATABASE_URL="sqlite:///" + database,
+            METRICS_DIR=self.metrics_dir,
+            METRICS_FLUSH_INTERVAL="0",
+        )
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "gunicorn",
+                "-w",
+                str(workers),
+                "-b",
+                f"127.0.0.1:{port}",
+                "webuzz:app",
+            ],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env=env,
+        )
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                self.request(self.session(), "GET", "/about")
+                break
+            except OSError:
+                if self.process.poll() is not None:
+                    raise SystemExit("gunicorn did not start")
+                if time.monotonic() > deadline:
+                    self.close()
+                    raise SystemExit("gunicorn did not start in 30 s")
+                time.sleep(0.2)
+
+    def session(self):
+        return urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirects,
+        )
+
+    def request(self, session, method, url, data=None, headers=None):
+        body = urllib.parse.urlencode(data).encode() if data else None
+        request = urllib.request.Request(
+            self.base_url + url, data=body, headers=headers or {}
+        )
+        request.method = method
+        try:
+            with session.open(request) as response:
+                return response.status, response.read().decode()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode()
+
+    def query_counts(self):
+        status, text = self.request(self.session(), "GET", "/metrics")
+        counts = {}
+        for line in text.splitlines():
+            match = re.match(
+                r"webuzz_(http_requests|db_queries)_total\{.*"
+                r'endpoint="([^"]+)".*\} (\S+)',
+                line,
+            )
+            if match:
+                kind, endpoint, value = match.groups()
+                requests, queries = counts.get(endpoint, (0, 0))
+                if kind == "http_requests":
+                    requests += int(float(value))
+                else:
+                    queries += int(float(value))
+                counts[endpoint] = (requests, queries)
+        return counts
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def percentile(values, p):
+    """The nearest-rank percentile ``p`` (0-100) of sorted ``values``."""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Dataset:
+    """The sizes of the tables of the seeded database, and its users."""
+
+    def __init__(self, database):
+        import sqlite3
+
+        connection = sqlite3.connect(database)
+        try:
+            self.sizes = {
+                table: connection.execute(
+                    f"SELECT count(*) FROM {table}"
+                ).fetchone()[0]
+                for table in ("users", "posts", "comments", "follows")
+            }
+            self.users = connection.execute(
+                "SELECT id, username, email FROM users"
+            ).fetchall()
+            self.last_post_id = connection.execute(
+                "SELECT max(id) FROM posts"
+            ).fetchone()[0]
+        finally:
+            connection.close()
+
+
+def log_in(target, session, email):
+    """Log in through the form; return a CSRF token for new posts."""
+    status, page = target.request(session, "GET", "/login")
+    data = {
+        "email": email,
+        "password": "password",
+        "csrf_token": CSRF_TOKEN.search(page).group(1),
+    }
+    # the hashing service refuses logins beyond its concurrency limit
+    for attempt in range(50):
+        status, page = target.request(session, "POST", "/login", data)
+        if status != 503:
+            break
+        time.sleep(0.1)
+    if status != 302:
+        raise RuntimeError(f"{email} could not log in: {status}")
+    target.request(session, "GET", "/followed")
+    status, page = target.request(session, "GET", "/")
+    return CSRF_TOKEN.search(page).group(1)
+
+
+def run(target, dataset, clients, requests, warmup, seed):
+    """Replay the mix; return the latencies of each entry and the time."""
+    latencies = {entry.name: [] for entry in MIX}
+    errors = {entry.name: 0 for entry in MIX}
+    lock = threading.Lock()
+    remaining = [warmup + requests]
+    warmed = [0]
+    start_barrier = threading.Barrier(clients + 1)
+    done_warmup = threading.Event()
+
+    def client(n):
+        rnd = random.Random(seed + n)
+        email = rnd.choice(dataset.users)[2]
+        credentials = base64.b64encode(f"{email}:password".encode()).decode()
+        sessions = {
+            "anonymous": target.session(),
+            "user": target.session(),
+            "api": target.session(),
+        }
+        try:
+            token = log_in(target, sessions["user"], email)
+        except Exception:
+            start_barrier.abort()
+            raise
+        headers = {"Authorization": "Basic " + credentials}
+        weights = [entry.weight for entry in MIX]
+        start_barrier.wait()
+
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+                warming = remaining[0] >= requests
+            if not warming:
+                done_warmup.wait()
+            entry = rnd.choices(MIX, weights)[0]
+            method, url, data = entry.request(rnd, dataset)
+            if data is not None:
+                data = dict(data, csrf_token=token)
+            began = time.perf_counter()
+            status, body = target.request(
+                sessions[entry.kind],
+                method,
+                url,
+                data,
+                headers if entry.kind == "api" else None,
+            )
+            elapsed = time.perf_counter() - began
+            with lock:
+                if warming:
+                    warmed[0] += 1
+                    continue
+                latencies[entry.name].append(elapsed)
+                if status >= 400:
+                    errors[entry.name] += 1
+
+    threads = [
+        threading.Thread(target=client, args=(n,)) for n in range(clients)
+    ]
+    for t in threads:
+        t.start()
+    start_barrier.wait()
+    # the warm-up requests are all done before any measured one
+    while True:
+        with lock:
+            if warmed[0] == warmup:
+                break
+        time.sleep(0.01)
+    counts_before = target.query_counts()
+    started = time.perf_counter()
+    done_warmup.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    counts_after = target.query_counts()
+    return latencies, errors, elapsed, counts_before, counts_after
+
+
+def report(args, dataset, latencies, errors, elapsed, before, after):
+    def ms(seconds):
+        return round(seconds * 1000, 1)
+
+    results = {
+        "target": args.target,
+        "clients": args.clients,
+        "dataset": dataset.sizes,
+        "endpoints": {},
+    }
+    every = sorted(sum(latencies.values(), []))
+    results["total"] = {
+        "requests": len(every),
+        "errors": sum(errors.values()),
+        "requests/s": round(len(every) / elapsed, 1),
+        "p50 ms": ms(percentile(every, 50)),
+        "p95 ms": ms(percentile(every, 95)),
+        "p99 ms": ms(percentile(every, 99)),
+    }
+    for entry in MIX:
+        values = sorted(latencies[entry.name])
+        requests = (
+            after.get(entry.endpoint, (0, 0))[0]
+            - before.get(entry.endpoint, (0, 0))[0]
+        )
+        queries = (
+            after.get(entry.endpoint, (0, 0))[1]
+            - before.get(entry.endpoint, (0, 0))[1]
+        )
+        results["endpoints"][entry.name] = {
+            "endpoint": entry.endpoint,
+            "requests": len(values),
+            "errors": errors[entry.name],
+            "requests/s": round(len(values) / elapsed, 1),
+            "p50 ms": ms(percentile(values, 50)),
+            "p95 ms": ms(percentile(values, 95)),
+            "p99 ms": ms(percentile(values, 99)),
+            # of all requests of the endpoint, e.g. both kinds of index
+            "queries/request": (
+                round(queries / requests, 1) if requests else None
+            ),
+        }
+    return results
+
+
+def print_results(results):
+    columns = ["requests/s", "p50 ms", "p95 ms", "p99 ms", "queries/request"]
+    print(f"{'':<18}" + "".join(f"{c:>17}" for c in columns))
+    rows = list(results["endpoints"].items()) + [("total", results["total"])]
+    for name, row in rows:
+        print(
+            f"{name:<18}"
+            + "".join(
+                f"{'-' if row.get(c) is None else row[c]:>17}" for c in columns
+            )
+        )
+    print(f"{results['total']['errors']} errors")
+
+
+def compare(results, baseline, tolerance):
+    """Print the changes against ``baseline``; return the regressions."""
+    regressions = []
+    rows = [("total", results["total"], baseline["total"])] + [
+        (name, row, baseline["endpoints"][name])
+        for name, row in results["endpoints"].items()
+        if name in baseline["endpoints"]
+    ]
+    for name, row, old in rows:
+        changes = []
+        for column, worse in [
+            ("p95 ms", 1),
+            ("requests/s", -1),
+            ("queries/request", 1),
+        ]:
+            if not old.get(column) or row.get(column) is None:
+                continue
+            change = (row[column] - old[column]) / old[column]
+            changes.append(f"{column} {change:+.0%}")
+            if change * worse > tolerance:
+                regressions.append(f"{name}: {column} {change:+.0%}")
+        print(f"{name:<18} " + "  ".join(changes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("database", help="SQLite file of benchmarks.dataset")
+    parser.add_argument(
+        "--target", choices=["client", "gunicorn"], default="client"
+    )
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--save", help="write the results to this file")
+    parser.add_argument("--compare", help="baseline to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="relative change counted as a regression",
+    )
+    args = parser.parse_args()
+
+    database = os.path.abspath(args.database)
+    if not os.path.exists(database):
+        parser.error(f"{args.database} does not exist")
+    dataset = Dataset(database)
+    if args.target == "client":
+        target = ClientTarget(database)
+    else:
+        target = GunicornTarget(database, args.workers, args.port)
+    try:
+        latencies, errors, elapsed, before, after = run(
+            target,
+            dataset,
+            args.clients,
+            args.requests,
+            args.warmup,
+            args.seed,
+        )
+    finally:
+        target.close()
+
+    results = report(args, dataset, latencies, errors, elapsed, before, after)
+    print_results(results)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Benchmark of login throughput with and without the hashing service.
+
+Client threads log in concurrently while one more thread keeps requesting
+the cheap about page. Reported are logins per second, the number of logins
+refused with a 503, and the median and 95th percentile latency of the about
+page, which shows how much the logins hold up everything else.
+
+Usage:
+    python -m benchmarks.login [--threads 8] [--logins 20] [--workers 4]
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+# the benchmark needs a database file shared by the client threads
+_db = tempfile.NamedTemporaryFile(suffix=".sqlite", delete=False)
+os.environ["TEST_DATABASE_URL"] = "sqlite:///" + _db.name
+
+from app import create_app, db
+from app.hashing import _HashingState
+from app.models import Role, User
+
+
+def run(app, threads, logins):
+    stop = threading.Event()
+    about = []
+    refused = []
+
+    def login():
+        client = app.test_client()
+        for i in range(logins):
+            response = client.post(
+                "/login",
+                data={"email": "john@example.com", "password": "cat"},
+            )
+            if response.status_code == 503:
+                refused.append(1)
+            client.get("/logout")
+
+    def browse():
+        client = app.test_client()
+        while not stop.is_set():
+            start = time.perf_counter()
+            client.get("/about")
+            about.append(time.perf_counter() - start)
+
+    browser = threading.Thread(target=browse)
+    browser.start()
+    clients = [threading.Thread(target=login) for i in range(threads)]
+    start = time.perf_counter()
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    browser.join()
+    about.sort()
+    return {
+        "logins/s": threads * logins / elapsed,
+        "refused": len(refused),
+        "about p50 ms": statistics.median(about) * 1000,
+        "about p95 ms": about[int(len(about) * 0.95)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--logins", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    app = create_app("testing")
+    app.config["QUERY_BUDGET"] = None
+    with app.app_context():
+        db.create_all()
+        Role.insert_roles()
+        db.session.add(
+            User(email="john@example.com", password="cat", confirmed=True)
+        )
+        db.session.commit()
+
+    modes = {
+        # the original behaviour: every login hashes on its own thread
+        "inline": dict(
+            PASSWORD_HASH_WORKERS=0,
+            PASSWORD_HASH_CONCURRENCY=args.threads,
+        ),
+        "process pool": dict(
+            PASSWORD_HASH_WORKERS=args.workers,
+            PASSWORD_HASH_CONCURRENCY=2 * args.workers,
+        ),
+    }
+    print(f"{args.threads} threads x {args.logins} logins:")
+    try:
+        for name, config in modes.items():
+            app.config.update(config)
+            state = app.extensions["hashing"] = _HashingState(app)
+            results = run(app, args.threads, args.logins)
+            state.shutdown()
+            print(
+                f"  {name:<13} "
+                + "  ".join(f"{k} {v:8.1f}" for k, v in results.items())
+            )
+    finally:
+        os.remove(_db.name)
+
+
+if __name__ == "__main__":
+    main()
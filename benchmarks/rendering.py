@@ -0,0 +1,85 @@
+"""Micro-benchmark of Markdown to HTML rendering of post bodies.
+
+Compares the original path (a new Markdown converter, Cleaner and Linker for
+every body) with the rendering engine, both with a cold cache (every body is
+new) and a warm one (bodies are re-saved unchanged).
+
+Usage:
+    python -m benchmarks.rendering [--bodies 2000] [--repeat 3]
+"""
+
+import argparse
+import random
+import time
+
+from app.rendering import RenderingEngine, render_uncached
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua"
+).split()
+
+
+def make_body(rnd):
+    paragraphs = []
+    for i in range(rnd.randint(1, 4)):
+        words = [rnd.choice(WORDS) for j in range(rnd.randint(10, 60))]
+        words[rnd.randrange(len(words))] = "*emphasis*"
+        words[rnd.randrange(len(words))] = "http://example.com/%d" % i
+        paragraphs.append(" ".join(words))
+    if rnd.random() < 0.3:
+        paragraphs.append("- one\n- two\n- <script>alert(1)</script>")
+    return "\n\n".join(paragraphs)
+
+
+def timed(render, bodies):
+    start = time.perf_counter()
+    for body in bodies:
+        render("post", body)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bodies", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    bodies = [make_body(rnd) for i in range(args.bodies)]
+
+    engine = RenderingEngine()
+    engine.cache.maxsize = args.bodies
+    for body in bodies[:50]:
+        assert engine.render_fresh("post", body) == render_uncached(
+            "post", body
+        ), "the engine renders differently from the original path"
+
+    results = {}
+    results["original"] = min(
+        timed(render_uncached, bodies) for i in range(args.repeat)
+    )
+    results["engine, no cache"] = min(
+        timed(engine.render_fresh, bodies) for i in range(args.repeat)
+    )
+    cold = []
+    for i in range(args.repeat):
+        engine.cache.clear()
+        cold.append(timed(engine.render, bodies))
+    results["engine, cold cache"] = min(cold)
+    results["engine, warm cache"] = min(
+        timed(engine.render, bodies) for i in range(args.repeat)
+    )
+
+    baseline = results["original"]
+    print(f"{args.bodies} bodies, best of {args.repeat}:")
+    for name, seconds in results.items():
+        print(
+            f"  {name:<20} {seconds * 1000:9.1f} ms "
+            f"{args.bodies / seconds:10.0f} bodies/s "
+            f"{baseline / seconds:6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
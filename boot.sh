@@ -1,6 +1,11 @@
 #!/bin/sh
 source venv/bin/activate
 
+# per-worker totals of /metrics, from this run only
+export METRICS_DIR=${METRICS_DIR:-/tmp/webuzz-metrics}
+rm -rf "$METRICS_DIR"
+mkdir -p "$METRICS_DIR"
+
 while true; do
     flask deploy
     if [[ "$?" == "0" ]]; then
@@ -19,7 +19,27 @@ class Config:
     # The Flask-SQLAlchemy documentation also suggests to set this key to False
     # to use less memory unless signals for object changes are needed.
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SQLALCHEMY_RECORD_QUERIES = True
+    # PRAGMAs run on every new SQLite connection, e.g. {"journal_mode": "WAL"}
+    SQLITE_PRAGMAS = {}
+    # connection pool of other databases (None keeps SQLAlchemy's default)
+    DB_POOL_SIZE = (
+        int(os.environ["DB_POOL_SIZE"])
+        if "DB_POOL_SIZE" in os.environ
+        else None
+    )
+    DB_MAX_OVERFLOW = (
+        int(os.environ["DB_MAX_OVERFLOW"])
+        if "DB_MAX_OVERFLOW" in os.environ
+        else None
+    )
+    DB_POOL_RECYCLE = None
+    DB_POOL_PRE_PING = None
+    # comma-separated URIs of read replicas of the database
+    READ_REPLICA_URIS = [
+        uri
+        for uri in os.environ.get("READ_REPLICA_URIS", "").split(",")
+        if uri
+    ]
 
     MAIL_SERVER = os.environ.get("MAIL_SERVER")
     MAIL_PORT = int(os.environ.get("MAIL_PORT", "587"))
@@ -34,13 +54,95 @@ class Config:
     MAIL_SENDER_EMAIL = os.environ.get("MAIL_SENDER_EMAIL")
     MAIL_SENDER = f"{APP_NAME} HQ <{MAIL_SENDER_EMAIL}>"
     ADMIN_EMAIL = os.environ.get("ADMIN_EMAIL")
+    # outbox delivery: disable MAIL_WORKER_INLINE when a separate
+    # `flask mail-worker` process delivers the mail
+    MAIL_WORKER_INLINE = os.environ.get(
+        "MAIL_WORKER_INLINE", "true"
+    ).lower() in ["true", "on", "1"]
+    MAIL_WORKERS = int(os.environ.get("MAIL_WORKERS", "2"))
+    MAIL_BATCH_SIZE = 50
+    MAIL_POLL_INTERVAL = 5
+    MAIL_MAX_ATTEMPTS = 5
+    MAIL_RETRY_BACKOFF = 30
+    MAIL_CLAIM_TIMEOUT = 300
     SSL_REDIRECT = False
     POSTS_PER_PAGE = 20
     COMMENTS_PER_PAGE = 30
     FOLLOWERS_PER_PAGE = 50
+    # statements slower than this many seconds are logged, a sample of them
     SLOW_DB_QUERY_TIME = 0.5
+    SLOW_DB_QUERY_SAMPLE_RATE = 1.0
+    # a request running the same statement this many times is logged as a
+    # likely N+1 query pattern (and fails, when N_PLUS_ONE_RAISE is set)
+    N_PLUS_ONE_THRESHOLD = 5
+    N_PLUS_ONE_RAISE = False
+    # rendered Markdown of post and comment bodies: entries kept in memory
+    # per worker, and an optional directory shared by all workers
+    RENDER_CACHE_SIZE = int(os.environ.get("RENDER_CACHE_SIZE", "1024"))
+    RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR")
+    # rendered post items of post lists: "lru" (per worker), "filesystem"
+    # (FRAGMENT_CACHE_DIR, shared by all workers) or "null"
+    FRAGMENT_CACHE_BACKEND = os.environ.get("FRAGMENT_CACHE_BACKEND", "lru")
+    FRAGMENT_CACHE_SIZE = int(os.environ.get("FRAGMENT_CACHE_SIZE", "4096"))
+    FRAGMENT_CACHE_DIR = os.environ.get("FRAGMENT_CACHE_DIR")
+    FRAGMENT_CACHE_TTL = 24 * 3600
+    # full pages served to anonymous visitors, and the number of seconds
+    # the pages of each endpoint are kept
+    PAGE_CACHE_BACKEND = os.environ.get("PAGE_CACHE_BACKEND", "lru")
+    PAGE_CACHE_SIZE = int(os.environ.get("PAGE_CACHE_SIZE", "512"))
+    PAGE_CACHE_DIR = os.environ.get("PAGE_CACHE_DIR")
+    PAGE_CACHE_TTLS = {
+        "main.index": 30,
+        "main.user": 60,
+        "main.post": 60,
+        "main.followers": 300,
+        "main.followed_by": 300,
+    }
+    # maximum number of SQL statements per request (None disables the
+    # check), and per-endpoint overrides of it
+    QUERY_BUDGET = None
+    QUERY_BUDGETS = {}
     PASSWORD_MIN_LENGTH = 3
+    # sampling profiler of the requests: seconds between samples, and a
+    # directory where each worker writes its stacks every so many seconds
+    PROFILER_ENABLED = os.environ.get(
+        "PROFILER_ENABLED", "false"
+    ).lower() in ["true", "on", "1"]
+    PROFILER_INTERVAL = float(os.environ.get("PROFILER_INTERVAL", "0.01"))
+    PROFILER_DIR = os.environ.get("PROFILER_DIR")
+    PROFILER_FLUSH_INTERVAL = 60
+    # /metrics: clients allowed without logging in as an administrator, and
+    # a directory where each worker writes its totals every so many seconds
+    # so that a scrape sees all workers (None counts this process only)
+    METRICS_ALLOWED_IPS = [
+        ip
+        for ip in os.environ.get("METRICS_ALLOWED_IPS", "127.0.0.1").split(",")
+        if ip
+    ]
+    METRICS_DIR = os.environ.get("METRICS_DIR")
+    METRICS_FLUSH_INTERVAL = float(
+        os.environ.get("METRICS_FLUSH_INTERVAL", "5")
+    )
+    # seconds before a worker reloads roles and their permissions
+    ROLE_CACHE_TTL = 60
+    # seconds a worker trusts its cached token generation of a user, i.e.
+    # how long a revoked API token can still be accepted
+    TOKEN_GENERATION_TTL = 30
+    # successful Basic auth verifications of the API kept per worker, and
+    # for how many seconds
+    BASIC_AUTH_CACHE_SIZE = 1024
+    BASIC_AUTH_CACHE_TTL = 300
+    # password hashing in a process pool: pool size (None for one process
+    # per CPU, 0 to hash inline), hashes in flight per worker, and seconds
+    # to wait for a free slot before answering 503
+    PASSWORD_HASH_WORKERS = None
+    PASSWORD_HASH_CONCURRENCY = None
+    PASSWORD_HASH_QUEUE_TIMEOUT = 0.5
     DEFAULT_GRAVATAR = "identicon"
+    # seconds between batched writes of users' last_seen timestamps
+    LAST_SEEN_FLUSH_INTERVAL = int(
+        os.environ.get("LAST_SEEN_FLUSH_INTERVAL", "60")
+    )
 
     @staticmethod
     def init_app(app):
@@ -62,12 +164,34 @@ class TestingConfig(Config):
         os.environ.get("TEST_DATABASE_URL") or "sqlite://"
     )
     WTF_CSRF_ENABLED = False
+    QUERY_BUDGET = 10
+    N_PLUS_ONE_RAISE = True
+    LAST_SEEN_FLUSH_INTERVAL = 0
+    MAIL_WORKER_INLINE = False
+    # tests change data between anonymous requests; see test_client.py for
+    # the page cache itself
+    PAGE_CACHE_BACKEND = "null"
+    PASSWORD_HASH_WORKERS = 0
 
 
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get(
         "DATABASE_URL"
     ) or "sqlite:///" + os.path.join(basedir, "data.sqlite")
+    # with WAL, readers in some gunicorn workers do not block the writer in
+    # another; NORMAL sync is safe in WAL mode and a write is then one fsync
+    # per checkpoint instead of per commit; busy writers wait 5 s instead of
+    # failing with "database is locked"
+    SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,
+    }
+    # drop connections the database server or a proxy may have closed
+    DB_POOL_RECYCLE = 1800
+    DB_POOL_PRE_PING = True
 
     @classmethod
     def init_app(cls, app):
@@ -0,0 +1,49 @@
+"""add denormalized counters
+
+Revision ID: 6c89e2060c78
+Revises: 9f9ded97ef23
+Create Date: 2026-10-18 10:31:07.552910
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c89e2060c78'
+down_revision = '9f9ded97ef23'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('post_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('follower_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('followed_count', sa.Integer(), server_default='0', nullable=False))
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.add_column(sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+
+    # initialize the counters from the existing rows
+    op.execute(
+        'UPDATE users SET '
+        'post_count = (SELECT count(*) FROM posts WHERE posts.author_id = users.id), '
+        'comment_count = (SELECT count(*) FROM comments WHERE comments.author_id = users.id), '
+        'follower_count = (SELECT count(*) FROM follows WHERE follows.followed_id = users.id), '
+        'followed_count = (SELECT count(*) FROM follows WHERE follows.follower_id = users.id)'
+    )
+    op.execute(
+        'UPDATE posts SET '
+        'comment_count = (SELECT count(*) FROM comments WHERE comments.post_id = posts.id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('comment_count')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('followed_count')
+        batch_op.drop_column('follower_count')
+        batch_op.drop_column('comment_count')
+        batch_op.drop_column('post_count')
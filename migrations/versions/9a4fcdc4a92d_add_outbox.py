@@ -0,0 +1,39 @@
+"""add outbox
+
+Revision ID: 9a4fcdc4a92d
+Revises: 6c89e2060c78
+Create Date: 2026-10-18 10:52:19.804113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4fcdc4a92d'
+down_revision = '6c89e2060c78'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sender', sa.String(length=128), nullable=True),
+    sa.Column('recipients', sa.Text(), nullable=True),
+    sa.Column('subject', sa.String(length=256), nullable=True),
+    sa.Column('body', sa.Text(), nullable=True),
+    sa.Column('html', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=True),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_sent_at_next_attempt_at', 'outbox', ['sent_at', 'next_attempt_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_outbox_sent_at_next_attempt_at', table_name='outbox')
+    op.drop_table('outbox')
@@ -0,0 +1,40 @@
+"""add timeline
+
+Revision ID: 9f9ded97ef23
+Revises: 4372936f3760
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9f9ded97ef23'
+down_revision = '4372936f3760'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('timeline',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'post_id')
+    )
+    op.create_index('ix_timeline_user_id_timestamp', 'timeline', ['user_id', 'timestamp'], unique=False)
+
+    # fan out the existing posts to their authors' followers
+    op.execute(
+        'INSERT INTO timeline (user_id, post_id, timestamp) '
+        'SELECT follows.follower_id, posts.id, posts.timestamp '
+        'FROM follows JOIN posts ON posts.author_id = follows.followed_id'
+    )
+
+
+def downgrade():
+    op.drop_index('ix_timeline_user_id_timestamp', table_name='timeline')
+    op.drop_table('timeline')
@@ -0,0 +1,26 @@
+"""add post version
+
+Revision ID: b37c0e5d8f21
+Revises: 9a4fcdc4a92d
+Create Date: 2026-10-18 11:24:41.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b37c0e5d8f21'
+down_revision = '9a4fcdc4a92d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('version')
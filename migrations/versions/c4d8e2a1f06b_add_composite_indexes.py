@@ -0,0 +1,38 @@
+"""add composite indexes
+
+Revision ID: c4d8e2a1f06b
+Revises: e5a91c07d3b4
+Create Date: 2026-10-18 12:14:36.902113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d8e2a1f06b'
+down_revision = 'e5a91c07d3b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_posts_author_id_timestamp', 'posts', ['author_id', 'timestamp'], unique=False)
+    op.create_index('ix_comments_post_id_timestamp', 'comments', ['post_id', 'timestamp'], unique=False)
+    op.create_index('ix_comments_author_id_timestamp', 'comments', ['author_id', 'timestamp'], unique=False)
+    op.create_index('ix_follows_followed_id_timestamp', 'follows', ['followed_id', 'timestamp', 'follower_id'], unique=False)
+    op.create_index('ix_follows_follower_id_timestamp', 'follows', ['follower_id', 'timestamp', 'followed_id'], unique=False)
+    op.create_index('ix_timeline_post_id', 'timeline', ['post_id'], unique=False)
+    op.drop_index('ix_timeline_user_id_timestamp', table_name='timeline')
+    op.create_index('ix_timeline_user_id_timestamp', 'timeline', ['user_id', 'timestamp', 'post_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_timeline_user_id_timestamp', table_name='timeline')
+    op.create_index('ix_timeline_user_id_timestamp', 'timeline', ['user_id', 'timestamp'], unique=False)
+    op.drop_index('ix_timeline_post_id', table_name='timeline')
+    op.drop_index('ix_follows_follower_id_timestamp', table_name='follows')
+    op.drop_index('ix_follows_followed_id_timestamp', table_name='follows')
+    op.drop_index('ix_comments_author_id_timestamp', table_name='comments')
+    op.drop_index('ix_comments_post_id_timestamp', table_name='comments')
+    op.drop_index('ix_posts_author_id_timestamp', table_name='posts')
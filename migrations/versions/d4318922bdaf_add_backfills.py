@@ -0,0 +1,32 @@
+"""add backfills
+
+Revision ID: d4318922bdaf
+Revises: c4d8e2a1f06b
+Create Date: 2026-10-18 14:02:51.377120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4318922bdaf'
+down_revision = 'c4d8e2a1f06b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('backfills',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('last_id', sa.Integer(), nullable=True),
+    sa.Column('rows', sa.Integer(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('backfills')
@@ -0,0 +1,26 @@
+"""add user token generation
+
+Revision ID: e5a91c07d3b4
+Revises: b37c0e5d8f21
+Create Date: 2026-10-18 11:52:09.611470
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a91c07d3b4'
+down_revision = 'b37c0e5d8f21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('token_generation', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('token_generation')
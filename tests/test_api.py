@@ -1,6 +1,7 @@
 import unittest
 import json
 import re
+from datetime import datetime, timedelta
 from base64 import b64encode
 from app import create_app, db
 from app.models import User, Role, Post, Comment
@@ -165,7 +166,7 @@ class APITestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         json_response = json.loads(response.get_data(as_text=True))
         self.assertIsNotNone(json_response.get("posts"))
-        self.assertEqual(json_response.get("count", 0), 1)
+        self.assertEqual(len(json_response["posts"]), 1)
         self.assertEqual(json_response["posts"][0], json_post)
 
         # get the post from the user as a follower
@@ -176,7 +177,7 @@ class APITestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         json_response = json.loads(response.get_data(as_text=True))
         self.assertIsNotNone(json_response.get("posts"))
-        self.assertEqual(json_response.get("count", 0), 1)
+        self.assertEqual(len(json_response["posts"]), 1)
         self.assertEqual(json_response["posts"][0], json_post)
 
         # edit post
@@ -295,14 +296,147 @@ class APITestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         json_response = json.loads(response.get_data(as_text=True))
         self.assertIsNotNone(json_response.get("comments"))
-        self.assertEqual(json_response.get("count", 0), 2)
+        self.assertEqual(len(json_response["comments"]), 2)
 
-        # get all the comments
+        # get all the comments, paginated by page number
         response = self.client.get(
-            "/api/v1/posts/{}/comments/".format(post.id),
+            "/api/v1/posts/{}/comments/?page=1".format(post.id),
             headers=self.get_api_headers("susan@example.com", "dog"),
         )
         self.assertEqual(response.status_code, 200)
         json_response = json.loads(response.get_data(as_text=True))
         self.assertIsNotNone(json_response.get("comments"))
         self.assertEqual(json_response.get("count", 0), 2)
+
+    def test_cursor_pagination(self):
+        # add a user with more posts than fit in a page
+        r = Role.query.filter_by(name="User").first()
+        u = User(
+            email="john@example.com", password="cat", confirmed=True, role=r
+        )
+        db.session.add(u)
+        db.session.commit()
+        self.app.config["POSTS_PER_PAGE"] = 2
+        timestamp = datetime.utcnow()
+        for i in range(5):
+            # posts sharing a timestamp are still ordered by id
+            db.session.add(
+                Post(
+                    body="post #{}".format(i),
+                    author=u,
+                    timestamp=timestamp - timedelta(seconds=i // 2),
+                )
+            )
+        db.session.commit()
+        headers = self.get_api_headers("john@example.com", "cat")
+
+        # walk forward through all the pages
+        bodies = []
+        prevs = []
+        url = "/api/v1/posts/"
+        while url:
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            json_response = json.loads(response.get_data(as_text=True))
+            self.assertNotIn("count", json_response)
+            bodies += [post["body"] for post in json_response["posts"]]
+            prevs.append(json_response["prev"])
+            url = json_response["next"]
+        self.assertEqual(
+            bodies, ["post #1", "post #0", "post #3", "post #2", "post #4"]
+        )
+        self.assertIsNone(prevs[0])
+
+        # and back from the last page
+        response = self.client.get(prevs[-1], headers=headers)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(
+            [post["body"] for post in json_response["posts"]],
+            ["post #3", "post #2"],
+        )
+
+        # a tampered cursor is a bad request
+        response = self.client.get(
+            "/api/v1/posts/?cursor=garbage", headers=headers
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # page numbers are still supported
+        response = self.client.get("/api/v1/posts/?page=3", headers=headers)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(json_response["count"], 5)
+        self.assertEqual(len(json_response["posts"]), 1)
+
+    def test_conditional_get(self):
+        r = Role.query.filter_by(name="User").first()
+        u = User(
+            email="john@example.com", password="cat", confirmed=True, role=r
+        )
+        p = Post(body="body of the post", author=u)
+        db.session.add_all([u, p])
+        db.session.commit()
+        headers = self.get_api_headers("john@example.com", "cat")
+
+        # a versioned resource
+        response = self.client.get("/api/v1/posts/1", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-cache", response.headers["Cache-Control"])
+        etag = response.headers["ETag"]
+        response = self.client.get(
+            "/api/v1/posts/1", headers=dict(headers, **{"If-None-Match": etag})
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b"")
+
+        # a new comment changes the comment count of the post
+        db.session.add(Comment(body="hi", post=p, author=u))
+        db.session.commit()
+        response = self.client.get(
+            "/api/v1/posts/1", headers=dict(headers, **{"If-None-Match": etag})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+        # a collection, tagged with a hash of its payload
+        response = self.client.get("/api/v1/posts/", headers=headers)
+        etag = response.headers["ETag"]
+        response = self.client.get(
+            "/api/v1/posts/", headers=dict(headers, **{"If-None-Match": etag})
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # missing resources are still not found
+        response = self.client.get("/api/v1/posts/2", headers=headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_basic_auth_cache(self):
+        r = Role.query.filter_by(name="Administrator").first()
+        u = User(
+            email="john@example.com", password="cat", confirmed=True, role=r
+        )
+        db.session.add(u)
+        db.session.commit()
+        headers = self.get_api_headers("john@example.com", "cat")
+        for i in range(3):
+            response = self.client.get("/api/v1/posts/", headers=headers)
+            self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            "/api/v1/stats/basic-auth-cache", headers=headers
+        )
+        stats = json.loads(response.get_data(as_text=True))
+        self.assertEqual(stats["hits"], 3)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+
+        # a wrong password is never served from the cache
+        response = self.client.get(
+            "/api/v1/posts/",
+            headers=self.get_api_headers("john@example.com", "dog"),
+        )
+        self.assertEqual(response.status_code, 401)
+
+        # nor is the old password after a change
+        u.password = "dog"
+        db.session.commit()
+        response = self.client.get("/api/v1/posts/", headers=headers)
+        self.assertEqual(response.status_code, 401)
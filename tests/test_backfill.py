@@ -0,0 +1,141 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+
+from app import create_app, db
+from app.backfill import BACKFILLS, Backfill
+from app.models import BackfillProgress, User
+
+
+class BackfillTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        # ids with a gap, to check that chunks are key ranges
+        db.session.execute(
+            User.__table__.insert(),
+            [
+                {"id": id, "email": f"u{id}@example.com", "username": f"u{id}"}
+                for id in list(range(1, 8)) + [20, 21, 22]
+            ],
+        )
+        db.session.commit()
+        self.chunks = []
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def set_location(self, connection, key_range):
+        users = User.__table__
+        ids = connection.execute(
+            db.select(users.c.id).where(key_range).order_by(users.c.id)
+        ).scalars()
+        self.chunks.append(list(ids))
+        if getattr(self, "fail_at", None) in self.chunks[-1]:
+            raise RuntimeError("interrupted")
+        return connection.execute(
+            users.update()
+            .where(key_range, users.c.location.is_(None))
+            .values(location="Vilnius")
+        ).rowcount
+
+    def backfill(self):
+        return Backfill(
+            "location", User.__table__.c.id, self.set_location, chunk_size=3
+        )
+
+    def test_chunks(self):
+        self.assertEqual(self.backfill().run(), 10)
+        self.assertEqual(
+            self.chunks, [[1, 2, 3], [4, 5, 6], [7, 20, 21], [22]]
+        )
+        self.assertEqual(User.query.filter_by(location="Vilnius").count(), 10)
+        progress = db.session.get(BackfillProgress, "location")
+        self.assertEqual((progress.last_id, progress.rows), (22, 10))
+        self.assertIsNotNone(progress.finished_at)
+
+        # a finished backfill is not run again, unless restarted
+        self.chunks = []
+        self.assertEqual(self.backfill().run(), 0)
+        self.assertEqual(self.chunks, [])
+        self.assertEqual(self.backfill().run(restart=True), 0)
+        self.assertEqual(len(self.chunks), 4)
+
+    def test_resume(self):
+        self.fail_at = 20
+        with self.assertRaises(RuntimeError):
+            self.backfill().run()
+        # the committed chunks stay, the failed one is rolled back
+        self.assertEqual(User.query.filter_by(location="Vilnius").count(), 6)
+        self.assertEqual(self.backfill().progress().last_id, 6)
+
+        self.fail_at = None
+        self.chunks = []
+        self.assertEqual(self.backfill().run(), 4)
+        self.assertEqual(self.chunks, [[7, 20, 21], [22]])
+        self.assertEqual(self.backfill().progress().rows, 10)
+
+    def test_connection(self):
+        # as in an Alembic revision: chunks commit on the given connection
+        with db.engine.connect() as connection:
+            self.assertEqual(self.backfill().run(connection, chunk_size=4), 10)
+        self.assertEqual(self.chunks, [[1, 2, 3, 4], [5, 6, 7, 20], [21, 22]])
+
+    def test_autocommit_connection(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        engine = create_engine(
+            "sqlite:///" + os.path.join(directory, "data.sqlite")
+        )
+        self.addCleanup(engine.dispose)
+        db.metadata.create_all(engine)
+        users = User.__table__
+        with engine.begin() as connection:
+            connection.execute(
+                users.insert(),
+                [
+                    {"id": id, "email": f"u{id}@example.com"}
+                    for id in range(1, 6)
+                ],
+            )
+
+        def set_location(connection, key_range):
+            connection.execute(
+                users.update().where(key_range).values(location="Vilnius")
+            )
+            if connection.execute(
+                db.select(users.c.id).where(key_range, users.c.id == 4)
+            ).first():
+                raise RuntimeError("interrupted")
+            return 2
+
+        # as in an Alembic autocommit_block
+        with engine.connect() as connection:
+            connection = connection.execution_options(
+                isolation_level="AUTOCOMMIT"
+            )
+            backfill = Backfill(
+                "location", users.c.id, set_location, chunk_size=2
+            )
+            with self.assertRaises(RuntimeError):
+                backfill.run(connection)
+            # the failed chunk is rolled back as a whole
+            locations = connection.execute(
+                db.select(users.c.location).order_by(users.c.id)
+            ).scalars()
+            self.assertEqual(
+                list(locations), ["Vilnius", "Vilnius", None, None, None]
+            )
+            self.assertEqual(backfill.progress(connection).last_id, 2)
+
+    def test_registered(self):
+        self.assertEqual(list(BACKFILLS), ["self_follows", "default_gravatar"])
+        self.assertEqual(User.add_default_gravatar(), 10)
+        self.assertEqual(BACKFILLS["default_gravatar"].progress().rows, 10)
@@ -1,7 +1,12 @@
+import gc
 import re
 import unittest
-from app import create_app, db
-from app.models import User, Role
+from datetime import datetime, timedelta
+
+from app import create_app, db, instrumentation, last_seen
+from app.cache import LRUBackend
+from app.exceptions import QueryBudgetExceeded
+from app.models import Comment, Post, Role, User
 
 
 class FlaskClientTestCase(unittest.TestCase):
@@ -70,3 +75,218 @@ class FlaskClientTestCase(unittest.TestCase):
         self.assertTrue(
             "You have been logged out" in response.get_data(as_text=True)
         )
+
+    def test_list_pages_query_budget(self):
+        # one post and one comment per author must not cost a query each
+        users = [
+            User(
+                email="user{}@example.com".format(i),
+                username="user{}".format(i),
+                password="cat",
+                confirmed=True,
+            )
+            for i in range(10)
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        post = Post(body="a post", author=users[0])
+        db.session.add(post)
+        db.session.add_all(Post(body="a post", author=u) for u in users[1:])
+        db.session.add_all(
+            Comment(body="a comment", author=u, post=post) for u in users
+        )
+        db.session.commit()
+        for url in ["/", "/user/user0", "/post/{}".format(post.id)]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+        # a page over its budget fails loudly
+        self.app.config["QUERY_BUDGETS"] = {"main.index": 0}
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get("/")
+
+    def test_query_instrumentation(self):
+        @self.app.route("/n-plus-one")
+        def n_plus_one():
+            for i in range(5):
+                db.session.execute(db.select(User).where(User.id == i))
+            return "done"
+
+        self.client.get("/")
+        self.client.get("/")
+        stats = instrumentation.stats()["main.index"]
+        self.assertEqual(stats["requests"], 2)
+        self.assertGreater(stats["queries"], 0)
+        self.assertEqual(sum(stats["buckets"]), stats["queries"])
+
+        # the same statement run once per row is caught
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get("/n-plus-one")
+        self.app.config["N_PLUS_ONE_RAISE"] = False
+        with self.assertLogs(self.app.logger, "WARNING") as logs:
+            response = self.client.get("/n-plus-one")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Possible N+1 queries", logs.output[0])
+
+        # slow queries are logged with their database
+        self.app.config["SLOW_DB_QUERY_TIME"] = 0
+        with self.assertLogs(self.app.logger, "WARNING") as logs:
+            self.client.get("/")
+        self.assertIn("Database: primary", logs.output[0])
+
+    def test_last_seen_is_buffered(self):
+        u = User(
+            email="john@example.com",
+            username="john",
+            password="cat",
+            confirmed=True,
+            last_seen=datetime.utcnow() - timedelta(hours=1),
+        )
+        db.session.add(u)
+        db.session.commit()
+        self.app.config["LAST_SEEN_FLUSH_INTERVAL"] = 60
+        self.client.post(
+            "/login", data={"email": "john@example.com", "password": "cat"}
+        )
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+
+        # not written yet
+        db.session.expire_all()
+        self.assertGreater(
+            (datetime.utcnow() - u.last_seen).total_seconds(), 60
+        )
+
+        # written in one batch on flush
+        self.assertEqual(last_seen.flush(), 1)
+        db.session.expire_all()
+        self.assertLess((datetime.utcnow() - u.last_seen).total_seconds(), 3)
+
+        # a fresh value is not buffered again
+        self.client.get("/")
+        self.assertEqual(last_seen.flush(), 0)
+
+    def test_last_seen_exit_hook(self):
+        from app.last_seen import _states
+
+        # one process-wide hook flushes the states of the live apps only
+        state = self.app.extensions["last_seen"]
+        self.assertIn(state, _states)
+        app = create_app("testing")
+        self.assertIn(app.extensions["last_seen"], _states)
+        gc.collect()
+        count = len(_states)
+        del app
+        gc.collect()
+        self.assertEqual(len(_states), count - 1)
+
+    def test_post_fragments_are_cached(self):
+        u = User(
+            email="john@example.com",
+            username="john",
+            password="cat",
+            confirmed=True,
+        )
+        p = Post(body="first version", author=u)
+        db.session.add_all([u, p])
+        db.session.commit()
+        cache = self.app.extensions["fragment_cache"]
+
+        self.assertIn("first version", self.client.get("/").get_data(True))
+        self.client.get("/")
+        self.assertEqual(cache.hits, 1)
+
+        # editing the post, commenting on it and renaming its author all
+        # retire the cached fragment
+        p.body = "second version"
+        db.session.commit()
+        self.assertIn("second version", self.client.get("/").get_data(True))
+        db.session.add(Comment(body="hi", post=p, author=u))
+        db.session.commit()
+        self.assertIn("1 Comments", self.client.get("/").get_data(True))
+        u.username = "johnny"
+        db.session.commit()
+        self.assertIn("johnny", self.client.get("/").get_data(True))
+        self.assertEqual(p.version, 4)
+        self.assertEqual(cache.hits, 1)
+
+        # the author sees a different variant, with an edit link
+        self.client.post(
+            "/login", data={"email": "john@example.com", "password": "cat"}
+        )
+        self.assertIn("Edit", self.client.get("/").get_data(True))
+        self.assertEqual(cache.hits, 1)
+
+    def test_anonymous_index_sets_no_cookie(self):
+        cache = self.app.extensions["page_cache"] = LRUBackend()
+        self.app.config["WTF_CSRF_ENABLED"] = True
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Set-Cookie", response.headers)
+        self.assertEqual(cache.hits, 0)
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(cache.hits, 1)
+
+    def test_anonymous_post_page_sets_no_cookie(self):
+        cache = self.app.extensions["page_cache"] = LRUBackend()
+        self.app.config["WTF_CSRF_ENABLED"] = True
+        u = User(
+            email="john@example.com",
+            username="john",
+            password="cat",
+            confirmed=True,
+        )
+        p = Post(body="cached post", author=u)
+        db.session.add_all([u, p])
+        db.session.commit()
+        response = self.client.get(f"/post/{p.id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Set-Cookie", response.headers)
+        self.assertEqual(cache.hits, 0)
+        response = self.client.get(f"/post/{p.id}")
+        self.assertIn("cached post", response.get_data(as_text=True))
+        self.assertEqual(cache.hits, 1)
+
+    def test_anonymous_page_cache(self):
+        cache = self.app.extensions["page_cache"] = LRUBackend()
+        u = User(
+            email="john@example.com",
+            username="john",
+            password="cat",
+            confirmed=True,
+        )
+        p = Post(body="cached post", author=u)
+        db.session.add_all([u, p])
+        db.session.commit()
+
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+        self.assertEqual(
+            response.last_modified.replace(tzinfo=None),
+            p.timestamp.replace(microsecond=0),
+        )
+
+        # served from the cache, without running the view
+        p.body = "changed post"
+        db.session.commit()
+        response = self.client.get("/")
+        self.assertIn("cached post", response.get_data(as_text=True))
+        response = self.client.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(cache.hits, 2)
+
+        # other query strings are other entries
+        response = self.client.get("/?page=1")
+        self.assertIn("changed post", response.get_data(as_text=True))
+
+        # logged-in users are never served cached pages
+        self.client.post(
+            "/login", data={"email": "john@example.com", "password": "cat"}
+        )
+        response = self.client.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("changed post", response.get_data(as_text=True))
+        self.assertEqual(cache.hits, 2)
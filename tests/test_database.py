@@ -0,0 +1,175 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import g
+
+from app import create_app, db
+from app.database import engine_options
+from app.models import Post, Role, User
+from config import ProductionConfig, TestingConfig, config
+
+
+class DatabaseTestCase(unittest.TestCase):
+    def test_sqlite_pragmas(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        class WALConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(
+                directory, "wal.sqlite"
+            )
+            SQLITE_PRAGMAS = ProductionConfig.SQLITE_PRAGMAS
+
+        config["wal"] = WALConfig
+        self.addCleanup(config.pop, "wal")
+        app = create_app("wal")
+        with app.app_context():
+            pragma = lambda name: db.session.execute(
+                db.text(f"PRAGMA {name}")
+            ).scalar()
+            self.assertEqual(pragma("journal_mode"), "wal")
+            self.assertEqual(pragma("synchronous"), 1)  # NORMAL
+            self.assertEqual(pragma("busy_timeout"), 5000)
+            db.session.remove()
+
+    def test_read_replica_routing(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        primary = os.path.join(directory, "primary.sqlite")
+        replica = os.path.join(directory, "replica.sqlite")
+
+        class ReplicaConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = "sqlite:///" + primary
+            READ_REPLICA_URIS = ["sqlite:///" + replica]
+
+        config["replica"] = ReplicaConfig
+        self.addCleanup(config.pop, "replica")
+        app = create_app("replica")
+        app.config["QUERY_BUDGET"] = None
+        with app.app_context():
+            db.create_all()
+            Role.insert_roles()
+            u = User(
+                email="john@example.com",
+                username="john",
+                password="cat",
+                confirmed=True,
+            )
+            db.session.add_all([u, Post(body="old post", author=u)])
+            db.session.commit()
+            # a copy of the file stands in for a replica that lags behind
+            shutil.copy(primary, replica)
+            db.session.add(Post(body="new post", author=u))
+            db.session.commit()
+            db.session.remove()
+
+        client = app.test_client()
+        with client:
+            response = client.get("/")
+            self.assertEqual(g.db_binds, {"replica_0"})
+        self.assertIn("old post", response.get_data(as_text=True))
+        self.assertNotIn("new post", response.get_data(as_text=True))
+
+        # the request after a write reads its own writes
+        client.post(
+            "/login", data={"email": "john@example.com", "password": "cat"}
+        )
+        with client:
+            response = client.get("/")
+            self.assertEqual(g.db_binds, {"primary"})
+        self.assertIn("new post", response.get_data(as_text=True))
+        response = client.get("/")
+        self.assertNotIn("new post", response.get_data(as_text=True))
+
+    def test_use_primary(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        primary = os.path.join(directory, "primary.sqlite")
+        replica = os.path.join(directory, "replica.sqlite")
+
+        class ReplicaConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = "sqlite:///" + primary
+            READ_REPLICA_URIS = ["sqlite:///" + replica]
+
+        config["replica"] = ReplicaConfig
+        self.addCleanup(config.pop, "replica")
+        app = create_app("replica")
+        app.config["QUERY_BUDGET"] = None
+        with app.app_context():
+            db.create_all()
+            Role.insert_roles()
+            john = User(
+                email="john@example.com",
+                username="john",
+                password="cat",
+                confirmed=True,
+            )
+            susan = User(
+                email="susan@example.com",
+                username="susan",
+                password="dog",
+                confirmed=True,
+            )
+            db.session.add_all([john, susan])
+            db.session.commit()
+            # the replica has not seen the follow yet
+            shutil.copy(primary, replica)
+            john.follow(susan)
+            db.session.commit()
+            db.session.remove()
+
+        client = app.test_client()
+        client.post(
+            "/login", data={"email": "john@example.com", "password": "cat"}
+        )
+        client.get("/")
+        with client:
+            response = client.get("/follow/susan")
+            self.assertEqual(g.db_binds, {"primary"})
+        self.assertEqual(response.status_code, 302)
+        response = client.get("/user/susan")
+        self.assertIn(
+            "You are already following this user.",
+            response.get_data(as_text=True),
+        )
+
+    def test_use_primary_views(self):
+        # the GET views that check the database before writing to it
+        app = create_app("testing")
+        self.assertEqual(
+            {
+                endpoint
+                for endpoint, view in app.view_functions.items()
+                if getattr(view, "read_primary", False)
+            },
+            {
+                "auth.change_email",
+                "auth.confirm",
+                "main.follow",
+                "main.moderate_disable",
+                "main.moderate_enable",
+                "main.unfollow",
+            },
+        )
+
+    def test_pool_options(self):
+        options = engine_options(
+            {
+                "SQLALCHEMY_DATABASE_URI": "postgresql://localhost/webuzz",
+                "DB_POOL_SIZE": 10,
+                "DB_MAX_OVERFLOW": None,
+                "DB_POOL_RECYCLE": 1800,
+                "DB_POOL_PRE_PING": True,
+            }
+        )
+        self.assertEqual(
+            options,
+            {"pool_size": 10, "pool_recycle": 1800, "pool_pre_ping": True},
+        )
+        # SQLite is tuned with PRAGMAs instead
+        options = engine_options(
+            {"SQLALCHEMY_DATABASE_URI": "sqlite://", "DB_POOL_SIZE": 10}
+        )
+        self.assertEqual(options, {})
@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+
+from app import create_app, db
+from app.deploy import deploy_lock, run_tasks
+from app.exceptions import DeployLockTimeout
+from app.models import Follow, Post, Role, Timeline, User
+
+
+class DeployTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        # rows written as by an old release: no self follows, no gravatar
+        db.session.execute(
+            User.__table__.insert(),
+            [
+                {"id": id, "email": f"u{id}@example.com", "username": f"u{id}"}
+                for id in (1, 2, 3)
+            ],
+        )
+        db.session.execute(
+            Post.__table__.insert(),
+            [
+                {"id": id, "author_id": author_id, "body": "post"}
+                for id, author_id in ((1, 1), (2, 1), (3, 2))
+            ],
+        )
+        db.session.execute(
+            Follow.__table__.insert(),
+            [{"follower_id": 3, "followed_id": 3}],
+        )
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_add_self_follows(self):
+        self.assertEqual(User.add_self_follows(), 2)
+        self.assertTrue(
+            all(u.is_following(u) for u in User.query.order_by(User.id))
+        )
+        self.assertEqual(
+            [(u.follower_count, u.followed_count) for u in User.query],
+            [(1, 1), (1, 1), (0, 0)],
+        )
+        self.assertEqual(
+            sorted((t.user_id, t.post_id) for t in Timeline.query),
+            [(1, 1), (1, 2), (2, 3)],
+        )
+        # idempotent
+        self.assertEqual(User.add_self_follows(), 0)
+        self.assertEqual(Follow.query.count(), 3)
+        self.assertEqual(Timeline.query.count(), 3)
+
+    def test_add_default_gravatar(self):
+        db.session.execute(
+            User.__table__.update()
+            .where(User.__table__.c.id == 2)
+            .values(default_gravatar="retro")
+        )
+        db.session.commit()
+        self.assertEqual(User.add_default_gravatar(), 2)
+        default = self.app.config["DEFAULT_GRAVATAR"]
+        self.assertEqual(
+            [u.default_gravatar for u in User.query.order_by(User.id)],
+            [default, "retro", default],
+        )
+        # the cached fragments of the posts of updated users are stale
+        self.assertEqual(
+            [p.version for p in Post.query.order_by(Post.id)], [2, 2, 1]
+        )
+        self.assertEqual(User.add_default_gravatar(), 0)
+
+    def test_run_tasks(self):
+        logged = []
+        timings = run_tasks(
+            [
+                ("roles", Role.insert_roles),
+                ("self follows", User.add_self_follows),
+            ],
+            log=lambda name, rows, seconds: logged.append((name, rows)),
+        )
+        self.assertEqual(list(timings), ["roles", "self follows"])
+        self.assertEqual(logged, [("roles", None), ("self follows", 2)])
+
+
+class DeployLockTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.engine = create_engine(
+            "sqlite:///" + os.path.join(self.directory, "data.sqlite")
+        )
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def test_sqlite_file_lock(self):
+        with deploy_lock(self.engine, timeout=0):
+            with self.assertRaises(DeployLockTimeout):
+                with deploy_lock(
+                    self.engine, timeout=0.05, poll_interval=0.01
+                ):
+                    pass
+        # released
+        with deploy_lock(self.engine, timeout=0):
+            pass
+
+    def test_memory_database(self):
+        engine = create_engine("sqlite://")
+        with deploy_lock(engine, timeout=0):
+            with deploy_lock(engine, timeout=0):
+                pass
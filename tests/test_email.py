@@ -0,0 +1,87 @@
+import unittest
+from datetime import datetime, timedelta
+
+from app import create_app, db, mail
+from app.email import OutboxWorker, send_email
+from app.models import Outbox
+
+
+class OutboxTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_send_email_is_queued(self):
+        with self.app.test_request_context("/"):
+            send_email(
+                "admin@example.com",
+                "Visitor interested!",
+                "email/visitor_engaged",
+                visitor_name="John",
+            )
+        msg = Outbox.query.one()
+        self.assertEqual(msg.recipients, "admin@example.com")
+        self.assertTrue("Visitor interested!" in msg.subject)
+        self.assertTrue("John" in msg.body)
+        self.assertIsNone(msg.sent_at)
+
+    def test_worker_delivers_queued_email(self):
+        for i in range(3):
+            db.session.add(
+                Outbox(
+                    sender="webuzz@example.com",
+                    recipients="user{}@example.com".format(i),
+                    subject="Hello",
+                    body="body",
+                    html="<p>body</p>",
+                )
+            )
+        db.session.commit()
+        with mail.record_messages() as outbox:
+            self.assertEqual(OutboxWorker(self.app).deliver_pending(), 3)
+        self.assertEqual(len(outbox), 3)
+        self.assertEqual(
+            Outbox.query.filter(Outbox.sent_at.is_(None)).count(), 0
+        )
+
+        # nothing is sent twice
+        with mail.record_messages() as outbox:
+            self.assertEqual(OutboxWorker(self.app).deliver_pending(), 0)
+        self.assertEqual(len(outbox), 0)
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        # point the mail extension at a port nobody listens on
+        state = self.app.extensions["mail"]
+        state.suppress = False
+        state.server = "localhost"
+        state.port = 1
+        state.use_tls = False
+        msg = Outbox(
+            sender="webuzz@example.com",
+            recipients="john@example.com",
+            subject="Hi",
+            body="hi",
+        )
+        db.session.add(msg)
+        db.session.commit()
+
+        before = datetime.utcnow()
+        self.assertEqual(OutboxWorker(self.app).deliver_pending(), 1)
+        msg = db.session.get(Outbox, msg.id)
+        self.assertIsNone(msg.sent_at)
+        self.assertEqual(msg.attempts, 1)
+        self.assertIsNotNone(msg.last_error)
+        self.assertGreaterEqual(
+            msg.next_attempt_at,
+            before + timedelta(seconds=self.app.config["MAIL_RETRY_BACKOFF"]),
+        )
+
+        # not due yet
+        self.assertEqual(OutboxWorker(self.app).deliver_pending(), 0)
@@ -0,0 +1,25 @@
+import unittest
+
+from app import create_app, db
+from app.explain import explain, hot_queries, report
+
+
+class ExplainTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_hot_queries_use_indexes(self):
+        lines = []
+        self.assertEqual(report(log=lines.append), 0, "\n".join(lines))
+
+    def test_explain(self):
+        plan = explain(hot_queries()["user: posts of a user"])
+        self.assertIn("ix_posts_author_id_timestamp", plan[0])
@@ -0,0 +1,68 @@
+import unittest
+
+from app import create_app, db, fake
+from app.models import Comment, Follow, Post, Timeline, User
+
+
+class FakeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_generate(self):
+        results = fake.generate(
+            users=50, follows=300, posts=100, comments=200, seed=1
+        )
+        self.assertEqual(User.query.count(), 50)
+        self.assertEqual(Post.query.count(), 100)
+        self.assertEqual(Comment.query.count(), 200)
+        self.assertEqual(Follow.query.count(), 50 + results["follows"])
+        self.assertTrue(
+            all(
+                User.query.get(id).is_following(User.query.get(id))
+                for id in (1, 25, 50)
+            )
+        )
+        self.assertGreater(Timeline.query.count(), 0)
+
+        # the bulk inserts leave every counter at 0 for reconcile to fix
+        self.assertEqual(
+            results["counters"],
+            sum(
+                model.query.filter(column > 0).count()
+                for model, column in [
+                    (User, User.post_count),
+                    (User, User.comment_count),
+                    (User, User.follower_count),
+                    (User, User.followed_count),
+                    (Post, Post.comment_count),
+                ]
+            ),
+        )
+
+        # counters and timeline are consistent with the rows
+        self.assertEqual(
+            sum(User.reconcile_counters().values())
+            + sum(Post.reconcile_counters().values()),
+            0,
+        )
+        self.assertEqual(Timeline.rebuild(), Timeline.query.count())
+
+        # users can log in with the shared password
+        self.assertTrue(User.query.first().verify_password("password"))
+
+    def test_generate_appends(self):
+        fake.generate(users=20, follows=50, posts=10, comments=10, seed=1)
+        fake.generate(users=20, follows=50, posts=10, comments=10, seed=1)
+        self.assertEqual(User.query.count(), 40)
+        self.assertEqual(
+            len({u.username for u in User.query}), User.query.count()
+        )
+        self.assertEqual(Post.query.count(), 20)
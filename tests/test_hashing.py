@@ -0,0 +1,45 @@
+import unittest
+
+from app import create_app, db
+from app.exceptions import HashingServiceBusy
+from app.models import Role, User
+
+
+class HashingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.state = self.app.extensions["hashing"]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_process_pool(self):
+        self.state.workers = 1
+        self.addCleanup(self.state.shutdown)
+        u = User(password="cat")
+        self.assertTrue(u.verify_password("cat"))
+        self.assertFalse(u.verify_password("dog"))
+        self.assertIsNotNone(self.state.pool)
+
+    def test_saturated_service_fails_fast(self):
+        u = User(email="john@example.com", password="cat", confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        self.state.queue_timeout = 0
+        self.state.slots.acquire()
+        self.addCleanup(self.state.slots.release)
+        with self.assertRaises(HashingServiceBusy):
+            u.verify_password("cat")
+
+        client = self.app.test_client()
+        response = client.post(
+            "/login", data={"email": "john@example.com", "password": "cat"}
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from app import create_app, db
+from app.metrics import _key, dump
+from app.models import Role
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_metrics(self):
+        self.client.get("/")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        text = response.get_data(as_text=True)
+        self.assertIn(
+            'webuzz_http_requests_total{blueprint="main",'
+            'endpoint="main.index",method="GET",status="200"} 1\n',
+            text,
+        )
+        self.assertIn(
+            'webuzz_http_request_duration_seconds_bucket{endpoint="main.index"'
+            ',le="+Inf"} 1\n',
+            text,
+        )
+        self.assertIn('webuzz_db_queries_total{endpoint="main.index"}', text)
+        self.assertIn(
+            'webuzz_template_render_seconds_total{endpoint="main.index"}',
+            text,
+        )
+        self.assertIn('webuzz_cache_hit_ratio{cache="render"}', text)
+        self.assertIn("webuzz_email_queue_depth 0\n", text)
+
+    def test_metrics_access(self):
+        self.app.config["METRICS_ALLOWED_IPS"] = []
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 403)
+
+    def test_metrics_of_all_workers(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.app.extensions["metrics"].directory = directory
+        # totals written by another worker
+        other = {
+            _key(
+                "webuzz_http_requests_total",
+                blueprint="main",
+                endpoint="main.index",
+                method="GET",
+                status=200,
+            ): 2
+        }
+        with open(os.path.join(directory, "metrics-0.json"), "w") as f:
+            f.write(dump(other))
+
+        self.client.get("/")
+        text = self.client.get("/metrics").get_data(as_text=True)
+        self.assertIn(
+            'webuzz_http_requests_total{blueprint="main",'
+            'endpoint="main.index",method="GET",status="200"} 3\n',
+            text,
+        )
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(directory, f"metrics-{os.getpid()}.json")
+            )
+        )
@@ -0,0 +1,96 @@
+import shutil
+import tempfile
+import time
+import unittest
+
+from app import create_app, db, profiler, profiling
+
+
+def busy_view():
+    deadline = time.perf_counter() + 0.1
+    while time.perf_counter() < deadline:
+        pass
+    return "done"
+
+
+class ProfilingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app("testing")
+        self.app.config.update(
+            PROFILER_ENABLED=True,
+            PROFILER_INTERVAL=0.001,
+            PROFILER_DIR=self.directory,
+        )
+        profiler.init_app(self.app)
+        self.app.add_url_rule("/busy", "busy", busy_view)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.app.extensions["profiler"].stop()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def test_sampling_profiler(self):
+        self.client.get("/busy")
+        state = self.app.extensions["profiler"]
+        state.stop()
+        self.assertEqual(list(state.stacks), ["busy"])
+        self.assertTrue(
+            any(
+                stack[-1].startswith("busy_view (")
+                and "test_profiling.py:" in stack[-1]
+                for stack in state.stacks["busy"]
+            )
+        )
+        # no samples outside of requests
+        self.assertEqual(state.active, {})
+
+        # the worker's file holds the same stacks
+        self.assertEqual(
+            profiling.read_directory(self.directory), state.stacks
+        )
+
+    def test_init_app_again_updates_settings(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        state = self.app.extensions["profiler"]
+        self.app.config.update(PROFILER_INTERVAL=0.002, PROFILER_DIR=directory)
+        profiler.init_app(self.app)
+        self.assertIs(self.app.extensions["profiler"], state)
+        self.assertEqual(state.interval, 0.002)
+        self.assertEqual(state.directory, directory)
+
+    def test_flush_on_exit(self):
+        self.client.get("/busy")
+        self.assertEqual(profiling.read_directory(self.directory), {})
+        # what the process-wide atexit hook does
+        profiling._stop_all()
+        self.assertIn("busy", profiling.read_directory(self.directory))
+
+    def test_export(self):
+        stacks = profiling.read_collapsed(
+            [
+                "main.index;run;view 3\n",
+                "main.index;run 1\n",
+                "api.get_post;run 2",
+            ]
+        )
+        self.assertEqual(
+            profiling.collapsed(stacks),
+            "api.get_post;run 2\nmain.index;run 1\nmain.index;run;view 3\n",
+        )
+        data = profiling.speedscope(stacks, 0.01)
+        self.assertEqual(
+            [frame["name"] for frame in data["shared"]["frames"]],
+            ["run", "view"],
+        )
+        index = data["profiles"][1]
+        self.assertEqual(index["name"], "main.index")
+        self.assertEqual(index["samples"], [[0], [0, 1]])
+        self.assertEqual(index["weights"], [0.01, 0.03])
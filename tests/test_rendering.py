@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from app import create_app, db
+from app.models import Post, User
+from app.rendering import RenderingEngine, render_uncached
+from app.rerender import read_checkpoint, rerender, write_checkpoint
+
+
+class RenderingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = RenderingEngine()
+
+    def test_same_output_as_original_path(self):
+        body = "Good [post](http://example.com)! <script>x</script> www.a.io"
+        for policy in ["post", "comment"]:
+            self.assertEqual(
+                self.engine.render(policy, body),
+                render_uncached(policy, body),
+            )
+
+    def test_cache_is_keyed_by_policy_and_body(self):
+        self.engine.render("post", "# title")
+        self.engine.render("post", "# title")
+        self.assertEqual(self.engine.cache.hits, 1)
+        # comments do not allow headers, so they must not share the entry
+        self.assertEqual(self.engine.render("comment", "# title"), "title")
+        self.assertEqual(self.engine.cache.hits, 1)
+
+    def test_cache_is_bounded(self):
+        self.engine.cache.maxsize = 2
+        for body in ["a", "b", "c"]:
+            self.engine.render("post", body)
+        self.assertEqual(len(self.engine.cache), 2)
+
+    def test_disk_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.engine.directory = directory
+        html = self.engine.render("post", "*shared*")
+        other = RenderingEngine()
+        other.directory = directory
+        other.render_fresh = None  # a disk hit must not render again
+        self.assertEqual(other.render("post", "*shared*"), html)
+
+
+class RerenderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_rerender_resumes_from_checkpoint(self):
+        u = User(email="john@example.com", password="cat")
+        db.session.add(u)
+        db.session.add_all(
+            Post(body="*post* {}".format(i), author=u) for i in range(5)
+        )
+        db.session.commit()
+        db.session.execute(Post.__table__.update().values(body_html="stale"))
+        db.session.commit()
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        checkpoint = directory + "/checkpoint.json"
+        rows = rerender(
+            "posts",
+            chunk_size=2,
+            workers=1,
+            start_id=2,
+            checkpoint=checkpoint,
+            log=lambda msg: None,
+        )
+        self.assertEqual(rows, 3)
+        bodies = [p.body_html for p in Post.query.order_by(Post.id)]
+        self.assertEqual(bodies[:2], ["stale", "stale"])
+        self.assertEqual(bodies[2], "<p><em>post</em> 2</p>")
+
+        # a finished run leaves no checkpoint behind
+        self.assertFalse(os.path.exists(checkpoint))
+
+        # an interrupted run resumes after the last chunk written
+        write_checkpoint(checkpoint, "posts", 4)
+        rows = rerender(
+            "posts", workers=1, checkpoint=checkpoint, log=lambda msg: None
+        )
+        self.assertEqual(rows, 1)
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_rerender_after_finished_run_starts_over(self):
+        u = User(email="john@example.com", password="cat")
+        db.session.add(u)
+        db.session.add_all(
+            Post(body="*post* {}".format(i), author=u) for i in range(5)
+        )
+        db.session.commit()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        checkpoint = directory + "/checkpoint.json"
+        # a checkpoint of another table is kept
+        write_checkpoint(checkpoint, "comments", 7)
+        for _ in range(2):
+            rows = rerender(
+                "posts",
+                chunk_size=2,
+                workers=1,
+                checkpoint=checkpoint,
+                log=lambda msg: None,
+            )
+            self.assertEqual(rows, 5)
+        self.assertEqual(read_checkpoint(checkpoint, "comments"), 7)
+        self.assertEqual(read_checkpoint(checkpoint, "posts"), 0)
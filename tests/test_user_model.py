@@ -1,9 +1,18 @@
 import time
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from app import create_app, db
-from app.models import AnonymousUser, Follow, Permission, Role, User
+from app import create_app, db, last_seen
+from app.models import (
+    AnonymousUser,
+    Comment,
+    Follow,
+    Permission,
+    Post,
+    Role,
+    Timeline,
+    User,
+)
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -62,6 +71,49 @@ class UserModelTestCase(unittest.TestCase):
         time.sleep(2)
         self.assertFalse(u.confirm(token))
 
+    def test_auth_token(self):
+        u = User(email="john@example.com", password="cat", confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        token = u.generate_auth_token(3600)
+        self.assertEqual(User.verify_auth_token(token).id, u.id)
+
+        # verified from the token and the cached generation alone
+        queries = []
+        listener = lambda *args: queries.append(args[2])
+        db.event.listen(db.engine, "before_cursor_execute", listener)
+        self.addCleanup(
+            db.event.remove, db.engine, "before_cursor_execute", listener
+        )
+        token_user = User.verify_auth_token(token)
+        self.assertEqual(queries, [])
+        self.assertTrue(token_user.confirmed)
+        self.assertTrue(token_user.can(Permission.WRITE))
+        self.assertFalse(token_user.is_administrator())
+
+        self.assertIsNone(User.verify_auth_token(token + "x"))
+        self.assertIsNone(User.verify_auth_token(u.generate_auth_token(-1)))
+
+    def test_auth_token_revocation(self):
+        self.app.config["TOKEN_GENERATION_TTL"] = 0
+        u = User(email="john@example.com", password="cat", confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        token = u.generate_auth_token(3600)
+        self.assertIsNotNone(User.verify_auth_token(token))
+        u.password = "dog"
+        db.session.commit()
+        self.assertIsNone(User.verify_auth_token(token))
+        self.assertIsNotNone(
+            User.verify_auth_token(u.generate_auth_token(3600))
+        )
+
+        # tokens carry the permissions of the role
+        token = u.generate_auth_token(3600)
+        u.role = Role.query.filter_by(name="Administrator").first()
+        db.session.commit()
+        self.assertIsNone(User.verify_auth_token(token))
+
     def test_valid_reset_token(self):
         u = User(password="cat")
         db.session.add(u)
@@ -132,6 +184,32 @@ class UserModelTestCase(unittest.TestCase):
         self.assertTrue(u.can(Permission.MODERATE))
         self.assertTrue(u.can(Permission.ADMIN))
 
+    def test_role_cache(self):
+        u = User(email="john@example.com", password="cat")
+        db.session.add(u)
+        db.session.commit()
+        db.session.expire_all()
+
+        # neither creating users nor checking permissions loads roles
+        queries = []
+        listener = lambda *args: queries.append(args[2])
+        db.event.listen(db.engine, "before_cursor_execute", listener)
+        self.addCleanup(
+            db.event.remove, db.engine, "before_cursor_execute", listener
+        )
+        u = User.query.get(u.id)
+        queries.clear()
+        self.assertTrue(u.can(Permission.WRITE))
+        self.assertFalse(u.is_administrator())
+        User(email="susan@example.com", password="dog")
+        self.assertEqual(queries, [])
+
+        # changed roles are picked up
+        r = Role.query.filter_by(name="User").first()
+        r.add_permission(Permission.MODERATE)
+        db.session.commit()
+        self.assertTrue(User.query.get(u.id).can(Permission.MODERATE))
+
     def test_anonymous_user(self):
         u = AnonymousUser()
         self.assertFalse(u.can(Permission.FOLLOW))
@@ -149,13 +227,17 @@ class UserModelTestCase(unittest.TestCase):
         )
         self.assertTrue((datetime.utcnow() - u.last_seen).total_seconds() < 3)
 
-    def test_ping(self):
-        u = User(password="cat")
+    def test_last_seen_touch(self):
+        u = User(
+            password="cat", last_seen=datetime.utcnow() - timedelta(hours=1)
+        )
         db.session.add(u)
         db.session.commit()
-        time.sleep(2)
         last_seen_before = u.last_seen
-        u.ping()
+        last_seen.touch(u)
+        self.assertTrue(u.last_seen > last_seen_before)
+        self.assertEqual(last_seen.flush(), 1)
+        db.session.expire_all()
         self.assertTrue(u.last_seen > last_seen_before)
 
     def test_gravatar(self):
@@ -228,3 +310,78 @@ class UserModelTestCase(unittest.TestCase):
         ]
         self.assertEqual(sorted(json_user.keys()), sorted(expected_keys))
         self.assertEqual("/api/v1/users/" + str(u.id), json_user["url"])
+
+    def test_timeline(self):
+        u1 = User(email="john@example.com", password="cat")
+        u2 = User(email="susan@example.org", password="dog")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        p1 = Post(body="post by susan", author=u2)
+        db.session.add(p1)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts.count(), 0)
+        self.assertEqual(u2.followed_posts.all(), [p1])
+
+        # following backfills the existing posts
+        u1.follow(u2)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts.all(), [p1])
+
+        # new posts are fanned out to the followers
+        p2 = Post(body="another post by susan", author=u2)
+        db.session.add(p2)
+        db.session.commit()
+        self.assertEqual(
+            u1.followed_posts.order_by(Timeline.timestamp.desc()).all(),
+            [p2, p1],
+        )
+
+        # unfollowing prunes the timeline
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts.count(), 0)
+        self.assertEqual(u2.followed_posts.count(), 2)
+
+        # rebuilding gives the same result
+        Timeline.query.delete()
+        db.session.commit()
+        self.assertEqual(Timeline.rebuild(), 2)
+        self.assertEqual(u2.followed_posts.count(), 2)
+
+    def test_counters(self):
+        u1 = User(email="john@example.com", password="cat")
+        u2 = User(email="susan@example.org", password="dog")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertEqual(u1.follower_count, 1)
+        self.assertEqual(u1.followed_count, 1)
+        u1.follow(u2)
+        p = Post(body="post by susan", author=u2)
+        db.session.add(p)
+        db.session.commit()
+        c = Comment(body="comment by john", author=u1, post=p)
+        db.session.add(c)
+        db.session.commit()
+        self.assertEqual(u1.followed_count, 2)
+        self.assertEqual(u2.follower_count, 2)
+        self.assertEqual(u2.post_count, 1)
+        self.assertEqual(u1.comment_count, 1)
+        self.assertEqual(p.comment_count, 1)
+        db.session.delete(c)
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(u1.followed_count, 1)
+        self.assertEqual(u2.follower_count, 1)
+        self.assertEqual(u1.comment_count, 0)
+        self.assertEqual(p.comment_count, 0)
+
+        # reconciliation fixes drift
+        db.session.execute(
+            User.__table__.update()
+            .where(User.__table__.c.id == u2.id)
+            .values(post_count=5)
+        )
+        db.session.commit()
+        self.assertEqual(User.reconcile_counters()["post_count"], 1)
+        self.assertEqual(u2.post_count, 1)
+        self.assertEqual(Post.reconcile_counters()["comment_count"], 0)
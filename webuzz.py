@@ -31,7 +31,16 @@ import click
 from flask_migrate import Migrate, upgrade
 
 from app import create_app, db
-from app.models import Comment, Follow, Permission, Post, Role, User
+from app.models import (
+    Comment,
+    Follow,
+    Outbox,
+    Permission,
+    Post,
+    Role,
+    Timeline,
+    User,
+)
 
 
 app = create_app(os.getenv("FLASK_CONFIG") or "default")
@@ -48,7 +57,9 @@ def make_shell_context():
         Permission=Permission,
         Comment=Comment,
         Follow=Follow,
+        Outbox=Outbox,
         Post=Post,
+        Timeline=Timeline,
     )
 
 
@@ -97,31 +108,328 @@ def test(coverage, test_names):
     default=None,
     help="Directory where profiler data files are saved.",
 )
-def profile(length, profile_dir):
-    """Start the application under the code profiler."""
-    from werkzeug.contrib.profiler import ProfilerMiddleware
+@click.option(
+    "--sampling",
+    is_flag=True,
+    help="Sample the stacks of the requests per endpoint instead.",
+)
+@click.option(
+    "--interval",
+    default=None,
+    type=float,
+    help="Seconds between two samples (default: PROFILER_INTERVAL).",
+)
+@click.option("--host", default="127.0.0.1", help="Interface to bind.")
+@click.option("--port", default=5000, help="Port to bind.")
+def profile(length, profile_dir, sampling, interval, host, port):
+    """Start the application under the code profiler.
+
+    By default every request is profiled with cProfile and its report
+    printed. With --sampling, the stacks of all requests are sampled and
+    written per endpoint, on exit, to the profile directory as a
+    collapsed-stack file and a speedscope file.
+    """
+    # app.run() does nothing when called from a flask command
+    from werkzeug.serving import run_simple
+
+    if not sampling:
+        from werkzeug.middleware.profiler import ProfilerMiddleware
+
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+        app.wsgi_app = ProfilerMiddleware(
+            app.wsgi_app, restrictions=[length], profile_dir=profile_dir
+        )
+        run_simple(host, port, app, threaded=True)
+        return
+
+    import json
+
+    from app import profiler, profiling
+
+    profile_dir = profile_dir or "profiles"
+    interval = interval or app.config["PROFILER_INTERVAL"]
+    os.makedirs(profile_dir, exist_ok=True)
+    app.config.update(
+        PROFILER_ENABLED=True,
+        PROFILER_INTERVAL=interval,
+        PROFILER_DIR=profile_dir,
+    )
+    profiler.init_app(app)
+    try:
+        run_simple(host, port, app, threaded=True)
+    finally:
+        state = app.extensions["profiler"]
+        state.stop()
+        path = os.path.join(profile_dir, "profile.speedscope.json")
+        with open(path, "w") as f:
+            json.dump(profiling.speedscope(state.stacks, interval), f)
+        print(f"Profiles written to {profile_dir}.")
+
+
+@app.cli.command("profile-export")
+@click.argument("directory")
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["speedscope", "collapsed"]),
+    default="speedscope",
+    help="speedscope JSON, or collapsed stacks for flamegraph.pl.",
+)
+@click.option("--endpoint", default=None, help="Only this endpoint.")
+@click.option(
+    "--interval",
+    default=None,
+    type=float,
+    help="Seconds between the samples of the files, the weight of a sample "
+    "(default: PROFILER_INTERVAL).",
+)
+@click.option(
+    "--output", "-o", default="-", type=click.File("w"), help="Output file."
+)
+def profile_export(directory, output_format, endpoint, interval, output):
+    """Merge the stacks sampled by all workers into one file."""
+    import json
+
+    from app import profiling
+
+    stacks = profiling.read_directory(directory)
+    if endpoint is not None:
+        stacks = {endpoint: stacks.get(endpoint, {})}
+    if output_format == "collapsed":
+        output.write(profiling.collapsed(stacks))
+    else:
+        interval = interval or app.config["PROFILER_INTERVAL"]
+        json.dump(profiling.speedscope(stacks, interval), output)
+
+
+@app.cli.command("rebuild-timeline")
+@click.option(
+    "--user-id",
+    default=None,
+    type=int,
+    help="Rebuild only the timeline of this user.",
+)
+def rebuild_timeline(user_id):
+    """Rebuild the materialized home timeline from follows and posts."""
+    rows = Timeline.rebuild(user_id=user_id)
+    print(f"Timeline rebuilt: {rows} rows.")
+
+
+@app.cli.command("reconcile-counters")
+def reconcile_counters():
+    """Fix drift in the denormalized post, comment and follow counters."""
+    for model in (User, Post):
+        # both tables have a comment_count
+        table = model.__tablename__
+        for name, rows in model.reconcile_counters().items():
+            print(f"{table}.{name}: {rows} rows fixed.")
+
+
+@app.cli.command("mail-worker")
+@click.option(
+    "--workers",
+    default=None,
+    type=int,
+    help="Number of worker threads (default: MAIL_WORKERS).",
+)
+@click.option(
+    "--poll-interval",
+    default=None,
+    type=float,
+    help="Seconds to wait when the outbox is empty.",
+)
+@click.option(
+    "--once",
+    is_flag=True,
+    help="Deliver one batch of due messages and exit.",
+)
+def mail_worker(workers, poll_interval, once):
+    """Deliver the queued emails of the outbox."""
+    from app.email import run_mail_worker
 
-    app.wsgi_app = ProfilerMiddleware(
-        app.wsgi_app, restrictions=[length], profile_dir=profile_dir
+    processed = run_mail_worker(
+        app, workers=workers, poll_interval=poll_interval, once=once
     )
-    app.run()
+    if once:
+        print(f"{processed} messages processed.")
+
+
+@app.cli.command()
+@click.option(
+    "--table",
+    type=click.Choice(["posts", "comments", "all"]),
+    default="all",
+    help="Which bodies to re-render.",
+)
+@click.option(
+    "--chunk-size", default=500, help="Rows rendered and written per batch."
+)
+@click.option(
+    "--workers",
+    default=None,
+    type=int,
+    help="Rendering processes (default: number of CPUs).",
+)
+@click.option(
+    "--start-id",
+    default=None,
+    type=int,
+    help="Only re-render rows with a greater id (overrides the checkpoint).",
+)
+@click.option(
+    "--checkpoint",
+    default=None,
+    help="File where progress is saved and resumed from.",
+)
+def rerender(table, chunk_size, workers, start_id, checkpoint):
+    """Re-render body_html of posts and comments after a tag policy change."""
+    from app.rerender import rerender
+
+    tables = ["posts", "comments"] if table == "all" else [table]
+    for name in tables:
+        rerender(
+            name,
+            chunk_size=chunk_size,
+            workers=workers,
+            start_id=start_id,
+            checkpoint=checkpoint,
+        )
+
+
+@app.cli.command()
+@click.argument("names", nargs=-1)
+@click.option(
+    "--chunk-size",
+    default=None,
+    type=int,
+    help="Rows per chunk (default: set per backfill).",
+)
+@click.option(
+    "--pause", default=None, type=float, help="Seconds to wait between chunks."
+)
+@click.option(
+    "--restart",
+    is_flag=True,
+    help="Walk the whole table again, even if the backfill has finished.",
+)
+@click.option(
+    "--status", is_flag=True, help="Show the progress of the backfills."
+)
+def backfill(names, chunk_size, pause, restart, status):
+    """Run chunked, resumable data backfills (default: all of them)."""
+    from app.backfill import BACKFILLS
+
+    unknown = set(names) - set(BACKFILLS)
+    if unknown:
+        known = ", ".join(BACKFILLS)
+        raise click.BadParameter(
+            f"{', '.join(sorted(unknown))} (known: {known})",
+            param_hint="NAMES",
+        )
+    for name in names or BACKFILLS:
+        if status:
+            progress = BACKFILLS[name].progress()
+            if progress is None:
+                state = "not started"
+            elif progress.finished_at is None:
+                state = f"at id {progress.last_id}"
+            else:
+                state = f"finished {progress.finished_at:%Y-%m-%d %H:%M}"
+            rows = 0 if progress is None else progress.rows
+            print(f"{name:<18} {rows:>8} rows  {state}")
+            continue
+        BACKFILLS[name].run(
+            chunk_size=chunk_size, pause=pause, restart=restart, log=print
+        )
+
+
+@app.cli.command()
+@click.option(
+    "--strict",
+    is_flag=True,
+    help="Exit with an error if any query scans or sorts a table.",
+)
+def explain(strict):
+    """Show the query plans of the hot queries and flag missing indexes."""
+    from app.explain import report
+
+    problems = report()
+    print(f"{problems} plan steps without an index.")
+    if strict and problems:
+        sys.exit(1)
+
+
+@app.cli.command()
+@click.option(
+    "--scale",
+    type=click.Choice(["tiny", "small", "medium", "large"]),
+    default="tiny",
+    help="Preset numbers of users, follows, posts and comments.",
+)
+@click.option("--users", default=None, type=int, help="Users to add.")
+@click.option(
+    "--follows", default=None, type=int, help="About this many follows."
+)
+@click.option("--posts", default=None, type=int, help="Posts to add.")
+@click.option("--comments", default=None, type=int, help="Comments to add.")
+@click.option(
+    "--seed", default=None, type=int, help="Seed for reproducible data."
+)
+@click.option(
+    "--batch-size", default=10000, help="Rows inserted per statement."
+)
+def fake(scale, users, follows, posts, comments, seed, batch_size):
+    """Add fake users, follows, posts and comments in bulk."""
+    from app import fake as fake_data
+
+    counts = dict(fake_data.SCALES[scale])
+    for name, count in [
+        ("users", users),
+        ("follows", follows),
+        ("posts", posts),
+        ("comments", comments),
+    ]:
+        if count is not None:
+            counts[name] = count
+
+    def log(name, rows, seconds):
+        print(f"{name:<10} {rows:>10} rows {seconds:8.1f}s")
+
+    fake_data.generate(**counts, seed=seed, batch_size=batch_size, log=log)
 
 
 @app.cli.command()
-def deploy():
+@click.option(
+    "--lock-timeout",
+    default=600.0,
+    help="Seconds to wait for the deploy of another container.",
+)
+def deploy(lock_timeout):
     """Run deployment tasks.
 
     Allows database migration, creating/updating roles, adds user self
-    follow.
+    follow. The tasks are idempotent and run under a database lock, so
+    containers that start together take turns. The backfills run in
+    chunks and resume after an interruption, see ``flask backfill``.
     """
-    # migrate database to latest revision
-    upgrade()
-
-    # create or update user roles
-    Role.insert_roles()
+    from app.deploy import deploy_lock, run_tasks
 
-    # ensure all users are following themselves
-    User.add_self_follows()
+    def log(name, rows, seconds):
+        rows = "-" if rows is None else rows
+        print(f"{name:<18} {rows:>8} rows {seconds:8.2f}s")
 
-    # ensure all users have default gravatar set
-    User.add_default_gravatar()
+    with deploy_lock(timeout=lock_timeout):
+        run_tasks(
+            [
+                # migrate database to latest revision
+                ("migrate", upgrade),
+                # create or update user roles
+                ("roles", Role.insert_roles),
+                # ensure all users are following themselves
+                ("self follows", User.add_self_follows),
+                # ensure all users have default gravatar set
+                ("default gravatars", User.add_default_gravatar),
+            ],
+            log=log,
+        )